@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import aiohttp
+from sqlalchemy import create_engine, func, insert, select
+
+from thinga import models, utils
+from thinga.pair_tokens import PAIR_TOKEN_HEADER
+from thinga.database import Base
+from thinga.config import DATABASE_URL, METRICS_TOKEN
+
+USER_AGENT = "thinga-load-test/1.0"
+STATEMENT_COUNT_PATTERN = re.compile(
+    r'^db_statement_duration_seconds_count\{operation="(\w*)"\} (\S+)$',
+    re.MULTILINE,
+)
+CPU_SECONDS_PATTERN = re.compile(r"^process_cpu_seconds (\S+)$", re.MULTILINE)
+
+
+def seed_database(db_url: str, user_count: int, image_count: int) -> None:
+    """Inserts the load test users and images that do not exist yet."""
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    # Every user shares one hash, hashing thousands of them would take minutes
+    hashed_password = utils.get_password_hash("loadtest-password")
+    with engine.begin() as connection:
+        existing_usernames = set(
+            connection.scalars(
+                select(models.User.username).where(
+                    models.User.username.like("loadtest-%")
+                )
+            )
+        )
+        new_users = [
+            {
+                "username": f"loadtest-{i}",
+                "email": f"loadtest-{i}@example.com",
+                "hashed_password": hashed_password,
+            }
+            for i in range(user_count)
+            if f"loadtest-{i}" not in existing_usernames
+        ]
+        if new_users:
+            connection.execute(insert(models.User), new_users)
+            connection.execute(
+                insert(models.Profile).from_select(
+                    ["display_name", "user_id"],
+                    select(models.User.username, models.User.id).where(
+                        models.User.username.in_(
+                            [user["username"] for user in new_users]
+                        )
+                    ),
+                )
+            )
+
+        existing_image_count = connection.scalar(
+            select(func.count()).select_from(models.Image)
+        )
+        if existing_image_count < image_count:
+            connection.execute(
+                insert(models.Image),
+                [
+                    {
+                        "media_file": f"loadtest-{i}.jpg",
+                        "alt_text": f"Load test image {i}",
+                        "score": 0,
+                    }
+                    for i in range(existing_image_count, image_count)
+                ],
+            )
+    engine.dispose()
+
+
+async def _read_server_counters(
+    session: aiohttp.ClientSession,
+    api_url: str,
+) -> tuple[dict[str, float], float]:
+    """Reads the SQL statement counters and CPU time from `/metrics`.
+
+    Run the server with one worker, each scrape only reaches one of them.
+    """
+    headers = (
+        {"Authorization": f"Bearer {METRICS_TOKEN}"} if METRICS_TOKEN else {}
+    )
+    async with session.get(f"{api_url}/metrics", headers=headers) as response:
+        text = await response.text()
+    statement_counts = {
+        operation: float(count)
+        for operation, count in STATEMENT_COUNT_PATTERN.findall(text)
+    }
+    cpu_seconds = CPU_SECONDS_PATTERN.search(text)
+    return statement_counts, float(cpu_seconds[1]) if cpu_seconds else 0.0
+
+
+async def _login(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    username: str,
+) -> str:
+    async with session.post(
+        f"{api_url}/login/",
+        json={"username": username, "password": "loadtest-password"},
+    ) as response:
+        response.raise_for_status()
+        return response.cookies["access_token"].value
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        endpoint: str,
+        method: str,
+        url: str,
+        with_headers: bool = False,
+        **kwargs,
+    ):
+        started_at = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                if response.status >= 400:
+                    self.errors[endpoint] += 1
+                    return (None, None) if with_headers else None
+        except aiohttp.ClientError:
+            self.errors[endpoint] += 1
+            return (None, None) if with_headers else None
+        self.latencies[endpoint].append(time.perf_counter() - started_at)
+        if with_headers:
+            return json.loads(body), response.headers
+        return json.loads(body)
+
+
+async def run_virtual_user(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    access_token: str,
+    recorder: Recorder,
+    deadline: float,
+    top_ranked_ratio: float,
+) -> int:
+    """Repeats the voting loop until the deadline, returning the votes cast."""
+    headers = {"Cookie": f"access_token={access_token}"}
+    votes = 0
+    while time.perf_counter() < deadline:
+        pair, pair_headers = await recorder.request(
+            session,
+            "GET /images/random/",
+            "GET",
+            f"{api_url}/images/random/",
+            with_headers=True,
+            headers=headers,
+        )
+        if not pair or PAIR_TOKEN_HEADER not in pair_headers:
+            continue
+
+        image_id = random.choice(pair)["id"]
+        rated_image = await recorder.request(
+            session,
+            "POST /images/{image_id}/rate/",
+            "POST",
+            f"{api_url}/images/{image_id}/rate/",
+            headers={
+                **headers,
+                PAIR_TOKEN_HEADER: pair_headers[PAIR_TOKEN_HEADER],
+            },
+        )
+        votes += rated_image is not None
+
+        if random.random() < top_ranked_ratio:
+            await recorder.request(
+                session,
+                "GET /images/top-ranked/",
+                "GET",
+                f"{api_url}/images/top-ranked/",
+            )
+    return votes
+
+
+async def run_websocket_user(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    access_token: str,
+    recorder: Recorder,
+    deadline: float,
+    top_ranked_ratio: float,
+) -> int:
+    """Votes over one WebSocket until the deadline, returning the votes cast."""
+    endpoint = "WS /images/vote/"
+    votes = 0
+    async with session.ws_connect(
+        f"{api_url.replace('http', 'ws', 1)}/images/vote/",
+        headers={"Cookie": f"access_token={access_token}"},
+    ) as websocket:
+        pair = (await websocket.receive_json())["images"]
+        while time.perf_counter() < deadline and pair:
+            started_at = time.perf_counter()
+            await websocket.send_json({"image_id": random.choice(pair)["id"]})
+            message = await websocket.receive_json()
+            if message["type"] == "error":
+                recorder.errors[endpoint] += 1
+                if message["retry_after"] is not None:
+                    # Throttled, the same pair is voted on again
+                    await asyncio.sleep(message["retry_after"])
+                    continue
+                # The image was deleted, the next pair follows anyway
+                pair = (await websocket.receive_json())["images"]
+                continue
+            pair = message["images"]
+            recorder.latencies[endpoint].append(
+                time.perf_counter() - started_at
+            )
+            votes += 1
+
+            if random.random() < top_ranked_ratio:
+                await recorder.request(
+                    session,
+                    "GET /images/top-ranked/",
+                    "GET",
+                    f"{api_url}/images/top-ranked/",
+                )
+    return votes
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    index = max(0, round(percentile / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(
+    recorder: Recorder,
+    elapsed_seconds: float,
+    votes: int,
+    statement_counts: dict[str, float],
+    cpu_seconds: float,
+) -> dict:
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[endpoint],
+            "throughput_rps": len(latencies) / elapsed_seconds,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+        }
+
+    total_statements = sum(statement_counts.values())
+    return {
+        "elapsed_seconds": elapsed_seconds,
+        "votes": votes,
+        "votes_per_second": votes / elapsed_seconds,
+        "endpoints": endpoints,
+        "db_statements": {
+            "total": total_statements,
+            "per_vote": total_statements / votes if votes else None,
+            "by_operation": statement_counts,
+        },
+        "server_cpu": {
+            "seconds": cpu_seconds,
+            "per_vote_ms": cpu_seconds / votes * 1000 if votes else None,
+        },
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(args: argparse.Namespace) -> dict:
+    # WebSockets hold on to their connections, leaderboard requests need more
+    connector = aiohttp.TCPConnector(
+        limit=args.concurrency * (2 if args.mode == "ws" else 1)
+    )
+    async with aiohttp.ClientSession(
+        connector=connector, headers={"User-Agent": USER_AGENT}
+    ) as session:
+        access_tokens = await asyncio.gather(
+            *(
+                _login(session, args.api_url, f"loadtest-{i % args.users}")
+                for i in range(args.concurrency)
+            )
+        )
+
+        (
+            statement_counts_before,
+            cpu_seconds_before,
+        ) = await _read_server_counters(session, args.api_url)
+        run_user = run_websocket_user if args.mode == "ws" else run_virtual_user
+        recorder = Recorder()
+        started_at = time.perf_counter()
+        votes = await asyncio.gather(
+            *(
+                run_user(
+                    session,
+                    args.api_url,
+                    access_token,
+                    recorder,
+                    started_at + args.duration,
+                    args.top_ranked_ratio,
+                )
+                for access_token in access_tokens
+            )
+        )
+        elapsed_seconds = time.perf_counter() - started_at
+        (
+            statement_counts_after,
+            cpu_seconds_after,
+        ) = await _read_server_counters(session, args.api_url)
+
+    statement_counts = {
+        operation: count - statement_counts_before.get(operation, 0)
+        for operation, count in statement_counts_after.items()
+    }
+    results = {
+        "commit": _git_commit(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "users": args.users,
+            "images": args.images,
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "top_ranked_ratio": args.top_ranked_ratio,
+        },
+        **summarize(
+            recorder,
+            elapsed_seconds,
+            sum(votes),
+            statement_counts,
+            cpu_seconds_after - cpu_seconds_before,
+        ),
+    }
+    return results
+
+
+def report(results: dict, output: str) -> None:
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'endpoint':<32} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, stats in results["endpoints"].items():
+        print(
+            f"{endpoint:<32} {stats['throughput_rps']:8.1f} "
+            f"{stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} "
+            f"{stats['p99_ms']:8.2f}"
+        )
+    print(f"Votes per second: {results['votes_per_second']:.1f}")
+    print(f"SQL statements per vote: {results['db_statements']['per_vote']}")
+    print(f"Server CPU ms per vote: {results['server_cpu']['per_vote_ms']}")
+    print(f"Results written to `{output}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive the voting loop against a running Thinga server."
+    )
+    parser.add_argument(
+        "-a",
+        "--api-url",
+        type=str,
+        default="http://127.0.0.1:9906",
+        help="the Thinga API URL",
+    )
+    parser.add_argument(
+        "--db-url",
+        type=str,
+        default=DATABASE_URL,
+        help="the server's database, used for seeding",
+    )
+    parser.add_argument(
+        "-u", "--users", type=int, default=100, help="users to seed"
+    )
+    parser.add_argument(
+        "-i", "--images", type=int, default=1000, help="images to seed"
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=20,
+        help="virtual users voting at the same time",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=30,
+        help="seconds to keep voting",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        choices=("rest", "ws"),
+        default="rest",
+        help="vote with HTTP requests or over a WebSocket per virtual user",
+    )
+    parser.add_argument(
+        "--top-ranked-ratio",
+        type=float,
+        default=0.1,
+        help="share of votes followed by a leaderboard request",
+    )
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="use the users and images of an earlier run",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="load-test-results.json",
+        help="where to write the machine-readable results",
+    )
+    args = parser.parse_args()
+
+    # Seeding and writing the results block, so both stay out of the loop
+    if not args.skip_seed:
+        seed_database(args.db_url, args.users, args.images)
+    report(asyncio.run(main(args)), args.output)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import time
+
+from starlette.types import Receive, Scope, Send
+
+from thinga import metrics
+
+
+async def bare_app(scope: Scope, receive: Receive, send: Send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"[]"})
+
+
+async def send_nothing(message: dict) -> None:
+    pass
+
+
+async def receive_nothing() -> dict:
+    return {"type": "http.request", "body": b""}
+
+
+async def time_requests(app, requests: int) -> float:
+    """Returns the mean time of a request through the app in seconds."""
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/images/",
+        "headers": [(b"content-length", b"0")],
+    }
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive_nothing, send_nothing)
+    return (time.perf_counter() - started_at) / requests
+
+
+async def main(args: argparse.Namespace) -> None:
+    instrumented_app = metrics.MetricsMiddleware(bare_app)
+    bare_timings = []
+    instrumented_timings = []
+    for _ in range(args.repeat):
+        bare_timings.append(await time_requests(bare_app, args.requests))
+        instrumented_timings.append(
+            await time_requests(instrumented_app, args.requests)
+        )
+
+    overhead = min(instrumented_timings) - min(bare_timings)
+    print(f"middleware overhead: {overhead * 1e6:.2f} us per request")
+
+    started_at = time.perf_counter()
+    for _ in range(args.requests):
+        metrics.db_statement_duration.observe(0.001, "SELECT")
+    observe_cost = (time.perf_counter() - started_at) / args.requests
+    print(f"histogram observe:   {observe_cost * 1e6:.2f} us per call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the per-request cost of the metrics layer."
+    )
+    parser.add_argument(
+        "-n",
+        "--requests",
+        type=int,
+        default=100_000,
+        help="requests per measurement",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="runs to take the best of"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+import argparse
+import io
+import os
+import sys
+import json
+import random
+import itertools
+import timeit
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Callable
+
+from fastapi import Request, UploadFile
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from thinga import models, schemas, crud, utils
+from thinga.database import Base
+from thinga.storage import GALLERY, LocalStorage
+from thinga.pair_tokens import PairTokens
+
+SAMPLE_IMAGE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir,
+    "thinga",
+    "tests",
+    "sample-image.png",
+)
+SEED_CHUNK_SIZE = 50_000
+FINGERPRINT_HEADERS = [
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Benchmark/1.0"),
+    (b"accept-language", b"en-US,en;q=0.9"),
+]
+CLIENT_FINGERPRINT = utils.generate_client_fingerprint(
+    Request({"type": "http", "headers": FINGERPRINT_HEADERS})
+)
+# Validating a million ORM objects needs gigabytes of memory
+MAX_VALIDATED_IMAGES = 100_000
+
+# Name -> (factory, whether it depends on the table size)
+BENCHMARKS = {}
+
+
+def benchmark(name: str, sized: bool = True) -> Callable:
+    def decorator(factory: Callable) -> Callable:
+        BENCHMARKS[name] = (factory, sized)
+        return factory
+
+    return decorator
+
+
+@benchmark("crud.get_two_random_images")
+def bench_get_two_random_images(context: SimpleNamespace) -> Callable:
+    return lambda: crud.get_two_random_images(db=context.db)
+
+
+@benchmark("crud.get_top_ranked_images")
+def bench_get_top_ranked_images(context: SimpleNamespace) -> Callable:
+    return lambda: crud.get_top_ranked_images(db=context.db, limit=20)
+
+
+@benchmark("crud.rate_image")
+def bench_rate_image(context: SimpleNamespace) -> Callable:
+    def rate_image() -> None:
+        image_id, loser_image_id = random.sample(range(1, context.size + 1), 2)
+        crud.rate_image(
+            db=context.db,
+            rating=schemas.RatingCreate(
+                user_id=1, image_id=image_id, loser_image_id=loser_image_id
+            ),
+        )
+
+    return rate_image
+
+
+@benchmark("crud.verify_session")
+def bench_verify_session(context: SimpleNamespace) -> Callable:
+    return lambda: crud.verify_session(
+        db=context.db,
+        access_token=context.access_tokens[
+            random.randrange(len(context.access_tokens))
+        ],
+        client_fingerprint=CLIENT_FINGERPRINT,
+    )
+
+
+@benchmark("schemas.Image.validate_list")
+def bench_validate_image_list(context: SimpleNamespace) -> Callable:
+    images_adapter = TypeAdapter(list[schemas.Image])
+    db_images = (
+        context.db.query(models.Image)
+        .limit(min(context.size, MAX_VALIDATED_IMAGES))
+        .all()
+    )
+    return lambda: images_adapter.validate_python(
+        db_images, from_attributes=True
+    )
+
+
+@benchmark("utils.generate_client_fingerprint", sized=False)
+def bench_generate_client_fingerprint(context: SimpleNamespace) -> Callable:
+    request = Request({"type": "http", "headers": FINGERPRINT_HEADERS})
+    return lambda: utils.generate_client_fingerprint(request)
+
+
+@benchmark("pair_tokens.redeem", sized=False)
+def bench_redeem_pair_token(context: SimpleNamespace) -> Callable:
+    tokens = PairTokens("benchmark", 600)
+    access_token = f"{0:032x}"
+    image_ids = itertools.count(1)
+
+    def redeem() -> tuple[int, int]:
+        # Tokens are used up, so every call is for a pair of its own
+        image_id = next(image_ids)
+        token = tokens.issue((image_id, image_id + 1), access_token)
+        return tokens.redeem(token, access_token)
+
+    return redeem
+
+
+@benchmark("crud.save_image_file", sized=False)
+def bench_save_image_file(context: SimpleNamespace) -> Callable:
+    with open(SAMPLE_IMAGE_FILE, "rb") as f:
+        image_data = f.read()
+
+    def save_image_file() -> str:
+        file = UploadFile(
+            file=io.BytesIO(image_data),
+            filename="sample-image.png",
+            size=len(image_data),
+        )
+        file_name = crud.save_image_file(
+            file=file, folder=GALLERY, media_storage=context.storage
+        )
+        context.storage.delete(GALLERY, file_name)
+        return file_name
+
+    return save_image_file
+
+
+def seed_database(db_session: sessionmaker, size: int) -> list[str]:
+    """Recreates the tables with `size` images and sessions."""
+    engine = db_session.kw["bind"]
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    now = datetime.now(timezone.utc)
+    hashed_password = utils.get_password_hash("benchmark-password")
+    access_tokens = [f"{i:032x}" for i in range(size)]
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.User),
+            [
+                {
+                    "username": "benchmark",
+                    "email": "benchmark@example.com",
+                    "hashed_password": hashed_password,
+                }
+            ],
+        )
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            chunk = range(start, min(start + SEED_CHUNK_SIZE, size))
+            connection.execute(
+                insert(models.Image),
+                [
+                    {
+                        "media_file": f"{i:015x}.jpg",
+                        "alt_text": f"Benchmark image {i}",
+                        "score": random.randrange(10_000),
+                        "created_at": now,
+                    }
+                    for i in chunk
+                ],
+            )
+            connection.execute(
+                insert(models.Session),
+                [
+                    {
+                        "access_token": access_tokens[i],
+                        "client_fingerprint": CLIENT_FINGERPRINT,
+                        "user_id": 1,
+                    }
+                    for i in chunk
+                ],
+            )
+    return access_tokens
+
+
+def time_call(function: Callable, repeat: int) -> dict:
+    """Times a call the way `timeit` does, reporting per-call figures."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    timings = [
+        timing / number for timing in timer.repeat(repeat=repeat, number=number)
+    ]
+    return {
+        "min_us": min(timings) * 1e6,
+        "median_us": statistics.median(timings) * 1e6,
+        "calls_per_round": number,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> None:
+    selected = {
+        name: BENCHMARKS[name]
+        for name in BENCHMARKS
+        if args.filter is None or args.filter in name
+    }
+    engine = create_engine(args.db_url)
+    db_session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as storage_path:
+        os.mkdir(os.path.join(storage_path, GALLERY))
+        context = SimpleNamespace(
+            storage=LocalStorage(storage_path, "benchmark"), size=None
+        )
+        for name, (factory, sized) in selected.items():
+            if not sized:
+                results[name] = time_call(factory(context), args.repeat)
+                print(f"{name:<45} {results[name]['median_us']:12.2f} us")
+
+        for size in args.sizes:
+            sized_benchmarks = [
+                (name, factory)
+                for name, (factory, sized) in selected.items()
+                if sized
+            ]
+            if not sized_benchmarks:
+                break
+
+            access_tokens = seed_database(db_session, size)
+            for name, factory in sized_benchmarks:
+                with db_session() as db:
+                    context = SimpleNamespace(
+                        db=db, size=size, access_tokens=access_tokens
+                    )
+                    key = f"{name}[{size}]"
+                    results[key] = time_call(factory(context), args.repeat)
+                print(f"{key:<45} {results[key]['median_us']:12.2f} us")
+    engine.dispose()
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": _git_commit(),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "database": engine.url.get_backend_name(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to `{args.output}`.")
+
+
+def compare(args: argparse.Namespace) -> None:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key in sorted(baseline.keys() & current.keys()):
+        old_time = baseline[key]["median_us"]
+        new_time = current[key]["median_us"]
+        change = new_time / old_time - 1
+        flag = ""
+        if change > args.threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(
+            f"{key:<45} {old_time:12.2f} {new_time:12.2f} {change:+8.1%}{flag}"
+        )
+
+    if regressions:
+        print(
+            f"{regressions} benchmarks regressed by over {args.threshold:.0%}."
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot functions of crud, utils and schemas."
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--db-url",
+        type=str,
+        default="sqlite:///./benchmark.sqlite3",
+        help="a scratch database, its tables are dropped and refilled",
+    )
+    run_parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 100_000, 1_000_000],
+        help="table sizes to seed for each round",
+    )
+    run_parser.add_argument(
+        "-k", "--filter", type=str, default=None, help="run matching names only"
+    )
+    run_parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="rounds per benchmark"
+    )
+    run_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="benchmark-results.json",
+        help="where to write the results",
+    )
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="flag regressions against a baseline"
+    )
+    compare_parser.add_argument("baseline", type=str, help="earlier results")
+    compare_parser.add_argument("current", type=str, help="newer results")
+    compare_parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown ratio that counts as a regression",
+    )
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
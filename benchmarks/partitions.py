@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from thinga import models, crud, partitions
+from thinga.database import Base
+
+# The same tables but for an unpartitioned copy of ratings, found first on
+# the search path of the baseline's connections
+BASELINE_SCHEMA = "baseline"
+FILL_MONTH = text(
+    "INSERT INTO ratings (user_id, image_id, created_at) "
+    "SELECT 1, 1 + floor(random() * :image_count)::int, "
+    "CAST(:start AS timestamp) + random() * "
+    "(CAST(:end AS timestamp) - CAST(:start AS timestamp)) "
+    "FROM generate_series(1, :row_count)"
+)
+FILL_IMAGES = text(
+    "INSERT INTO images (media_file, score) "
+    "SELECT to_hex(n) || '.jpg', 0 FROM generate_series(1, :image_count) AS n"
+)
+
+
+def seed(engine: Engine, rows: int, months: int, image_count: int) -> dict:
+    """Recreates the tables with `rows` votes spread over `months` months.
+
+    The rows are copied into a plain table for the baseline afterwards.
+    """
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"DROP SCHEMA IF EXISTS {BASELINE_SCHEMA} CASCADE"
+        )
+    Base.metadata.create_all(bind=engine)
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    month_starts = [
+        partitions.month_start(now, offset) for offset in range(1 - months, 1)
+    ]
+    timings = {}
+    with engine.begin() as connection:
+        partitions.create_partitions(connection, "ratings", month_starts)
+        connection.execute(
+            insert(models.User),
+            [{"username": "benchmark", "email": "benchmark@example.com"}],
+        )
+        connection.execute(FILL_IMAGES, {"image_count": image_count})
+
+    started_at = time.perf_counter()
+    for index, month in enumerate(month_starts):
+        end = (
+            now
+            if index == len(month_starts) - 1
+            else partitions.month_start(month, 1)
+        )
+        with engine.begin() as connection:
+            connection.execute(
+                FILL_MONTH,
+                {
+                    "image_count": image_count,
+                    "start": month,
+                    "end": end,
+                    "row_count": rows // months,
+                },
+            )
+        print(f"Filled {month:%Y-%m}.")
+    timings["partitioned_load_rows_per_second"] = rows / (
+        time.perf_counter() - started_at
+    )
+
+    started_at = time.perf_counter()
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"CREATE SCHEMA {BASELINE_SCHEMA}")
+        connection.exec_driver_sql(
+            f"CREATE TABLE {BASELINE_SCHEMA}.ratings "
+            "(LIKE public.ratings INCLUDING DEFAULTS INCLUDING INDEXES)"
+        )
+        connection.exec_driver_sql(
+            f"INSERT INTO {BASELINE_SCHEMA}.ratings SELECT * FROM ratings"
+        )
+    timings["baseline_load_rows_per_second"] = rows / (
+        time.perf_counter() - started_at
+    )
+
+    # Vacuuming cannot run in a transaction
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        connection.exec_driver_sql("VACUUM ANALYZE images")
+        connection.exec_driver_sql("VACUUM ANALYZE ratings")
+        connection.exec_driver_sql(f"VACUUM ANALYZE {BASELINE_SCHEMA}.ratings")
+    return timings
+
+
+def time_inserts(
+    db_session: sessionmaker,
+    image_count: int,
+    batch_size: int,
+    seconds: float,
+) -> dict:
+    """Commits batches of votes, like the vote batcher, for `seconds`."""
+    rng = random.Random(0)
+    inserted = 0
+    started_at = time.perf_counter()
+    with db_session() as db:
+        while time.perf_counter() - started_at < seconds:
+            db.execute(
+                insert(models.Rating),
+                [
+                    {"user_id": 1, "image_id": rng.randint(1, image_count)}
+                    for _ in range(batch_size)
+                ],
+            )
+            db.commit()
+            inserted += batch_size
+    return {"rows_per_second": inserted / (time.perf_counter() - started_at)}
+
+
+def time_queries(
+    db_session: sessionmaker,
+    window_days: int,
+    seconds: float,
+) -> dict:
+    """Asks for the trending images of the last days, over and over."""
+    timings = []
+    started_at = time.perf_counter()
+    with db_session() as db:
+        while time.perf_counter() - started_at < seconds:
+            since = datetime.now(timezone.utc) - timedelta(days=window_days)
+            query_started_at = time.perf_counter()
+            crud.get_trending_images(db=db, since=since, limit=20)
+            timings.append((time.perf_counter() - query_started_at) * 1000)
+            db.rollback()  # A fresh snapshot per query, like requests
+    timings.sort()
+    return {
+        "queries_per_second": len(timings) / (time.perf_counter() - started_at),
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[max(0, round(len(timings) * 0.95) - 1)],
+    }
+
+
+def time_expiry(engine: Engine, baseline_engine: Engine) -> dict:
+    """Removes the oldest month of votes from both tables."""
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        oldest = partitions.expired_partitions(
+            "ratings",
+            partitions.list_partitions(connection, "ratings"),
+            before=datetime.max,
+        )[0]
+        started_at = time.perf_counter()
+        partitions.detach_partitions(connection, "ratings", [oldest], "")
+        partitioned_seconds = time.perf_counter() - started_at
+
+    month = datetime.strptime(oldest, "ratings_%Y_%m")
+    started_at = time.perf_counter()
+    with baseline_engine.begin() as connection:
+        connection.execute(
+            text("DELETE FROM ratings WHERE created_at < :end"),
+            {"end": partitions.month_start(month, 1)},
+        )
+    return {
+        "month": f"{month:%Y-%m}",
+        "partitioned_seconds": partitioned_seconds,
+        "baseline_seconds": time.perf_counter() - started_at,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    engine = create_engine(args.db_url)
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Partitioning needs a PostgreSQL database.")
+    baseline_engine = create_engine(
+        args.db_url,
+        connect_args={"options": f"-c search_path={BASELINE_SCHEMA},public"},
+    )
+
+    results = {}
+    if not args.skip_seed:
+        results["load"] = seed(engine, args.rows, args.months, args.images)
+        print(json.dumps(results["load"], indent=2))
+    with engine.connect() as connection:
+        rows = connection.scalar(text("SELECT count(*) FROM ratings"))
+
+    for name, db_engine in (
+        ("partitioned", engine),
+        ("baseline", baseline_engine),
+    ):
+        db_session = sessionmaker(bind=db_engine)
+        results[name] = {
+            "insert": time_inserts(
+                db_session, args.images, args.batch_size, args.seconds
+            ),
+            "recent_window": time_queries(
+                db_session, args.window_days, args.seconds
+            ),
+        }
+        print(f"{name}: {json.dumps(results[name])}")
+
+    if args.expire:
+        results["expiry"] = time_expiry(engine, baseline_engine)
+        print(f"expiry: {json.dumps(results['expiry'])}")
+
+    with open(args.output, "w") as f:
+        json.dump({"rows": rows, "results": results}, f, indent=2)
+    print(f"Results written to `{args.output}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare votes in monthly partitions with one plain table, "
+            "on PostgreSQL."
+        )
+    )
+    parser.add_argument(
+        "--db-url",
+        type=str,
+        required=True,
+        help="a scratch PostgreSQL database, its tables are dropped",
+    )
+    parser.add_argument(
+        "-r", "--rows", type=int, default=100_000_000, help="votes to seed"
+    )
+    parser.add_argument(
+        "-m", "--months", type=int, default=24, help="months they span"
+    )
+    parser.add_argument(
+        "-i", "--images", type=int, default=100_000, help="images voted on"
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=100,
+        help="votes committed together while timing inserts",
+    )
+    parser.add_argument(
+        "-w",
+        "--window-days",
+        type=int,
+        default=7,
+        help="days of votes the trending query reads",
+    )
+    parser.add_argument(
+        "-s",
+        "--seconds",
+        type=float,
+        default=30,
+        help="how long to time inserts and queries for, each",
+    )
+    parser.add_argument(
+        "--expire",
+        action="store_true",
+        help="also time removing the oldest month from each table",
+    )
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="reuse the votes of an earlier run",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="partitions-benchmark-results.json",
+        help="where to write the results",
+    )
+    args = parser.parse_args()
+
+    main(args)
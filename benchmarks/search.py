@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from thinga import models, search
+from thinga.database import Base
+
+SEED_CHUNK_SIZE = 50_000
+COMMON_WORDS = [
+    "photo", "red", "blue", "green", "small", "large", "old", "new",
+    "dog", "cat", "car", "house", "tree", "beach", "city", "mountain",
+    "river", "street", "portrait", "sunset", "night", "winter", "summer",
+    "garden", "bridge", "market", "forest", "lake", "road", "sky",
+]  # fmt: skip
+
+
+def _alt_text(rng: random.Random, rare_word_count: int) -> str:
+    words = rng.choices(COMMON_WORDS, k=rng.randint(2, 5))
+    # Rare words stand in for names and places, most images have one
+    words.append(f"place{rng.randrange(rare_word_count)}")
+    return " ".join(words)
+
+
+def seed_images(db_url: str, size: int, seed: int) -> sessionmaker:
+    """Recreates the tables with `size` images, indexed for search."""
+    engine = create_engine(db_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            connection.execute(
+                insert(models.Image),
+                [
+                    {
+                        "media_file": f"{i:015x}.jpg",
+                        "alt_text": _alt_text(rng, max(size // 20, 1)),
+                        "score": 0,
+                        "created_at": now,
+                    }
+                    for i in range(start, min(start + SEED_CHUNK_SIZE, size))
+                ],
+            )
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE images")
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+
+def time_queries(
+    db_session: sessionmaker,
+    queries: list[str],
+    limit: int,
+    pages: int,
+) -> dict:
+    """Times the first and the last of `pages` pages of every query."""
+    first_page_timings = []
+    last_page_timings = []
+    with db_session() as db:
+        for query in queries:
+            after = None
+            for page in range(pages):
+                started_at = time.perf_counter()
+                rows = search.search_images(
+                    db=db, query=query, limit=limit, after=after
+                )
+                elapsed_ms = (time.perf_counter() - started_at) * 1000
+                if page == 0:
+                    first_page_timings.append(elapsed_ms)
+                if len(rows) < limit:
+                    break
+                after = rows[-1].rank, rows[-1].id
+            last_page_timings.append(elapsed_ms)
+
+    def summarize(timings: list[float]) -> dict:
+        timings.sort()
+        return {
+            "p50_ms": statistics.median(timings),
+            "p95_ms": timings[max(0, round(len(timings) * 0.95) - 1)],
+            "max_ms": timings[-1],
+        }
+
+    return {
+        "first_page": summarize(first_page_timings),
+        f"page_{pages}": summarize(last_page_timings),
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.skip_seed:
+        engine = create_engine(args.db_url)
+        db_session = sessionmaker(bind=engine)
+    else:
+        started_at = time.perf_counter()
+        db_session = seed_images(args.db_url, args.size, args.seed)
+        print(f"Seeded in {time.perf_counter() - started_at:.1f} seconds.")
+
+    with db_session() as db:
+        size = db.scalar(select(func.count()).select_from(models.Image))
+    rng = random.Random(args.seed + 1)
+    rare_word_count = max(size // 20, 1)
+    # From a handful of matches to a good share of the table
+    query_classes = {
+        "rare word": [
+            f"place{rng.randrange(rare_word_count)}"
+            for _ in range(args.queries)
+        ],
+        "rare and common word": [
+            f"{rng.choice(COMMON_WORDS)} place{rng.randrange(rare_word_count)}"
+            for _ in range(args.queries)
+        ],
+        "two common words": [
+            " ".join(rng.sample(COMMON_WORDS, 2)) for _ in range(args.queries)
+        ],
+    }
+
+    results = {}
+    print(f"{'query':<24} {'page':<10} {'p50':>9} {'p95':>9} {'max':>9}")
+    for name, queries in query_classes.items():
+        results[name] = time_queries(
+            db_session, queries, args.limit, args.pages
+        )
+        for page, stats in results[name].items():
+            print(
+                f"{name:<24} {page:<10} {stats['p50_ms']:7.2f}ms "
+                f"{stats['p95_ms']:7.2f}ms {stats['max_ms']:7.2f}ms"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump({"size": size, "results": results}, f, indent=2)
+    print(f"Results written to `{args.output}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time full-text image search over a large table."
+    )
+    parser.add_argument(
+        "--db-url",
+        type=str,
+        default="sqlite:///./benchmark-search.sqlite3",
+        help="a scratch database, its tables are dropped and refilled",
+    )
+    parser.add_argument(
+        "-s", "--size", type=int, default=1_000_000, help="images to seed"
+    )
+    parser.add_argument(
+        "-q", "--queries", type=int, default=200, help="queries per class"
+    )
+    parser.add_argument(
+        "-l", "--limit", type=int, default=20, help="results per page"
+    )
+    parser.add_argument(
+        "-p", "--pages", type=int, default=5, help="pages to follow per query"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--skip-seed",
+        action="store_true",
+        help="search the images of an earlier run",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="search-benchmark-results.json",
+        help="where to write the results",
+    )
+    args = parser.parse_args()
+
+    main(args)
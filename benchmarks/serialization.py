@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import timeit
+from datetime import datetime, timezone
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from thinga import models, schemas, crud
+from thinga.database import Base
+from thinga.responses import RowsJSONResponse
+
+images_adapter = TypeAdapter(list[schemas.Image])
+
+
+def seed_images(db_url: str, row_count: int) -> sessionmaker:
+    """Fills a fresh database with the given number of images."""
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(models.Image),
+            [
+                {
+                    "media_file": f"{i:015x}.jpg",
+                    "alt_text": f"Sample image number {i}",
+                    "score": i % 1000,
+                    "created_at": now,
+                }
+                for i in range(row_count)
+            ],
+        )
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+
+def serialize_with_response_model(db_session: sessionmaker) -> bytes:
+    """Mirrors what FastAPI does with `response_model` and ORM objects."""
+    with db_session() as db:
+        db_images = db.query(models.Image).all()
+        validated_images = images_adapter.validate_python(
+            db_images, from_attributes=True
+        )
+        content = images_adapter.dump_python(validated_images, mode="json")
+        return json.dumps(content, separators=(",", ":")).encode("utf-8")
+
+
+def serialize_rows(db_session: sessionmaker) -> bytes:
+    """Reads plain rows and encodes them straight to JSON bytes."""
+    with db_session() as db:
+        return RowsJSONResponse(crud.get_images(db=db)).body
+
+
+def main(args: argparse.Namespace) -> None:
+    db_session = seed_images(args.db_url, args.rows)
+    assert json.loads(serialize_rows(db_session)) == json.loads(
+        serialize_with_response_model(db_session)
+    )
+
+    results = {}
+    for name, serialize in (
+        ("response_model", serialize_with_response_model),
+        ("rows_json", serialize_rows),
+    ):
+        timings = timeit.repeat(
+            lambda: serialize(db_session), number=1, repeat=args.repeat
+        )
+        results[name] = min(timings) * 1000
+        print(f"{name:>15}: {results[name]:8.2f} ms for {args.rows} rows")
+
+    speedup = results["response_model"] / results["rows_json"]
+    print(f"{'speedup':>15}: {speedup:8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the image list serialization paths."
+    )
+    parser.add_argument(
+        "-n", "--rows", type=int, default=10_000, help="images to serialize"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="runs to take the best of"
+    )
+    parser.add_argument(
+        "--db-url",
+        type=str,
+        default="sqlite://",
+        help="database to seed, in memory by default",
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from sqlalchemy import bindparam, create_engine, select, update
+
+from thinga import models, utils
+from thinga.config import DATABASE_URL
+from thinga.storage import GALLERY, storage
+
+
+def read_file_metadata(
+    image_id: int,
+    media_file: str,
+) -> tuple[int, Optional[utils.ImageMetadata]]:
+    """Decodes a stored image, `None` when its file can not be read."""
+    try:
+        data = storage.read(GALLERY, media_file)
+    except Exception:  # Missing files raise differently on each backend
+        return image_id, None
+    return image_id, utils.read_image_metadata(data)
+
+
+def main(args: argparse.Namespace) -> None:
+    engine = create_engine(args.db_url)
+    update_statement = (
+        update(models.Image)
+        .where(models.Image.id == bindparam("image_id"))
+        .values(
+            width=bindparam("width"),
+            height=bindparam("height"),
+            blurhash=bindparam("blurhash"),
+        )
+    )
+    last_id = 0
+    updated_count = missing_count = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        while True:
+            # Walking by id keeps every batch an index range scan, and images
+            # that cannot be decoded are not picked up again
+            with engine.connect() as connection:
+                batch = connection.execute(
+                    select(models.Image.id, models.Image.media_file)
+                    .where(
+                        models.Image.id > last_id,
+                        models.Image.blurhash.is_(None),
+                    )
+                    .order_by(models.Image.id)
+                    .limit(args.batch_size)
+                ).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            results = executor.map(
+                read_file_metadata,
+                [image_id for image_id, _ in batch],
+                [media_file for _, media_file in batch],
+                chunksize=16,
+            )
+            rows = []
+            for image_id, metadata in results:
+                if metadata is None:
+                    missing_count += 1
+                    continue
+                rows.append({"image_id": image_id, **metadata._asdict()})
+            if rows:
+                with engine.begin() as connection:
+                    connection.execute(update_statement, rows)
+            updated_count += len(rows)
+            print(f"Backfilled {updated_count} images, up to id {last_id}.")
+
+    engine.dispose()
+    print(
+        f"Done, {updated_count} images backfilled, "
+        f"{missing_count} files missing."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill in the size and BlurHash of images stored earlier."
+    )
+    parser.add_argument(
+        "--db-url", type=str, default=DATABASE_URL, help="the database"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes decoding images in parallel",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=500,
+        help="images read and updated per round",
+    )
+    args = parser.parse_args()
+
+    main(args)
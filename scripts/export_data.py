@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import Row, create_engine
+
+from thinga import exports
+from thinga.config import DATABASE_URL
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+
+
+def _load_checkpoint(checkpoint_file: str, filters: dict) -> tuple[int, int]:
+    """Returns the last id exported and the number of the next part."""
+    if not os.path.exists(checkpoint_file):
+        return 0, 0
+
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    if checkpoint["filters"] != filters:
+        raise SystemExit(
+            "Error: The output folder holds an export made with other "
+            "options, choose another folder."
+        )
+    return checkpoint["last_id"], checkpoint["parts"]
+
+
+def _save_checkpoint(
+    checkpoint_file: str,
+    filters: dict,
+    last_id: int,
+    parts: int,
+) -> None:
+    with open(f"{checkpoint_file}.tmp", "w") as f:
+        json.dump({"filters": filters, "last_id": last_id, "parts": parts}, f)
+    os.replace(f"{checkpoint_file}.tmp", checkpoint_file)
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.format == "parquet" and exports.pyarrow is None:
+        raise SystemExit("Error: Parquet exports need `pyarrow` installed.")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_file = os.path.join(args.output_dir, CHECKPOINT_FILE_NAME)
+    filters = {
+        "table": args.table,
+        "format": args.format,
+        "since": args.since and args.since.isoformat(),
+        "until": args.until and args.until.isoformat(),
+        "rows_per_file": args.rows_per_file,
+    }
+    last_id, parts = _load_checkpoint(checkpoint_file, filters)
+
+    engine = create_engine(args.db_url)
+    table = exports.EXPORT_TABLES[args.table]
+    exported_count = 0
+    while True:
+        part_last_id: Optional[int] = None
+        part_row_count = 0
+
+        def tracked(batches: Iterator[list[Row]]) -> Iterator[list[Row]]:
+            nonlocal part_last_id, part_row_count
+            for batch in batches:
+                part_last_id = batch[-1].id
+                part_row_count += len(batch)
+                yield batch
+
+        # A query per part keeps every transaction, and snapshot, short
+        part_file = os.path.join(
+            args.output_dir, f"part-{parts:05d}.{args.format}"
+        )
+        with (
+            engine.connect() as connection,
+            open(f"{part_file}.tmp", "wb") as f,
+        ):
+            statement = exports.select_rows(
+                table,
+                after_id=last_id,
+                since=args.since,
+                until=args.until,
+                limit=args.rows_per_file,
+            )
+            batches = exports.iter_batches(
+                connection, statement, args.batch_size
+            )
+            for chunk in exports.export_chunks(
+                table, tracked(batches), args.format
+            ):
+                f.write(chunk)
+
+        if part_last_id is None:
+            os.remove(f"{part_file}.tmp")
+            break
+        # Only finished parts are recorded, a rerun redoes the one cut short
+        os.replace(f"{part_file}.tmp", part_file)
+        last_id, parts = part_last_id, parts + 1
+        _save_checkpoint(checkpoint_file, filters, last_id, parts)
+        exported_count += part_row_count
+        print(f"Exported {exported_count} rows, up to id {last_id}.")
+
+    engine.dispose()
+    print(f"Done, {parts} files in `{args.output_dir}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export ratings or images to CSV or Parquet files."
+    )
+    parser.add_argument(
+        "table", choices=tuple(exports.EXPORT_TABLES), help="what to export"
+    )
+    parser.add_argument(
+        "--db-url", type=str, default=DATABASE_URL, help="the database"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=tuple(exports.MEDIA_TYPES),
+        default="csv",
+        help="the format of the files",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        default="exports",
+        help="a folder for the files, rerun with it to resume an export",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only rows created at or after this time",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only rows created before this time",
+    )
+    parser.add_argument(
+        "-n",
+        "--rows-per-file",
+        type=int,
+        default=1000000,
+        help="rows in each file",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=exports.EXPORT_BATCH_SIZE,
+        help="rows fetched and written at a time",
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -7,11 +7,32 @@ import random
 import re
 import asyncio
 import http
+import json
+import struct
+import hashlib
+from dataclasses import dataclass
 from typing import Optional
+from urllib.parse import quote_plus
 
 import aiohttp
 import aiofiles
-from playwright.async_api import Page, async_playwright
+from playwright.async_api import (
+    Page,
+    Browser,
+    TimeoutError as PlaywrightTimeoutError,
+    async_playwright,
+)
+
+SEARCH_URL_TEMPLATE = (
+    "https://duckduckgo.com/?t=h_&q={query}&iax=images&ia=images"
+)
+IMAGE_SELECTOR = "img[class*='tile--img__img']"
+MANIFEST_FILE_NAME = "manifest.jsonl"
+MAX_HEADER_BYTES = 256 * 1024
+JPEG_FRAME_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+}  # fmt: skip
 
 
 def _correct_image_url(url: str) -> str:
@@ -20,26 +41,64 @@ def _correct_image_url(url: str) -> str:
     return corrected_url
 
 
+def _query_to_dir_name(query: str) -> str:
+    """Turns a query into a folder name that is safe on every platform."""
+    return re.sub(r"[^\w-]+", "-", query.lower()).strip("-") or "query"
+
+
+async def _count_images(page: Page) -> int:
+    """Counts the image tiles rendered on the page so far."""
+    return len(await page.query_selector_all(IMAGE_SELECTOR))
+
+
 async def collect_image_urls(
     page: Page,
     query: str,
     max_images: int,
+    search_url_template: str = SEARCH_URL_TEMPLATE,
+    load_timeout: float = 15,
+    max_scrolls: int = 10,
 ) -> list[str]:
     """Collects image URLs from DuckDuckGo."""
     await page.goto(
-        f"https://duckduckgo.com/?t=h_&q={query}&iax=images&ia=images",
+        search_url_template.format(query=quote_plus(query)),
         wait_until="domcontentloaded",
     )
-    await asyncio.sleep(8)  # Wait for the page to load
+    try:
+        await page.wait_for_selector(
+            IMAGE_SELECTOR, timeout=load_timeout * 1000
+        )
+    except PlaywrightTimeoutError:
+        print(f"No images showed up for `{query}`...")
+        return []
 
-    image_elements = await page.query_selector_all(
-        "xpath=//img[contains(@class, 'tile--img__img')]"
-    )
+    # Scroll until enough tiles are rendered or the results stop growing
+    image_count = await _count_images(page)
+    for _ in range(max_scrolls):
+        if image_count >= max_images:
+            break
+
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        try:
+            await page.wait_for_function(
+                "([selector, count]) => "
+                "document.querySelectorAll(selector).length > count",
+                arg=[IMAGE_SELECTOR, image_count],
+                timeout=load_timeout * 1000,
+            )
+        except PlaywrightTimeoutError:
+            break
+        image_count = await _count_images(page)
+
+    image_elements = await page.query_selector_all(IMAGE_SELECTOR)
     random.shuffle(image_elements)
-    image_urls = [
-        _correct_image_url(await img.get_attribute("src"))
-        for img in image_elements[:max_images]
-    ]
+    image_urls = []
+    for img in image_elements:
+        src = await img.get_attribute("src")
+        if src:
+            image_urls.append(_correct_image_url(src))
+        if len(image_urls) == max_images:
+            break
     return image_urls
 
 
@@ -53,53 +112,327 @@ def _get_file_extension_from_mime(mime: str) -> Optional[str]:
     return mime_to_extension.get(mime)
 
 
+def _read_image_dimensions(header: bytes) -> Optional[tuple[int, int]]:
+    """Reads the width and height from the first bytes of an image."""
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and len(header) >= 24:
+        return struct.unpack(">II", header[16:24])
+    elif header[:6] in (b"GIF87a", b"GIF89a") and len(header) >= 10:
+        return struct.unpack("<HH", header[6:10])
+    elif header.startswith(b"\xff\xd8"):
+        # Walk the JPEG segments until the start-of-frame one
+        i = 2
+        while i + 9 <= len(header):
+            if header[i] != 0xFF:
+                return None
+            marker = header[i + 1]
+            if marker in JPEG_FRAME_MARKERS:
+                height, width = struct.unpack(">HH", header[i + 5 : i + 9])
+                return width, height
+            (segment_length,) = struct.unpack(">H", header[i + 2 : i + 4])
+            i += 2 + segment_length
+    return None
+
+
+def _has_image_trailer(file_extension: str, tail: bytes) -> bool:
+    """Checks that the file ends the way a complete image does."""
+    if file_extension == ".png":
+        return tail.endswith(b"IEND\xaeB`\x82")
+    elif file_extension == ".gif":
+        return tail.endswith(b";")
+    return tail.rstrip(b"\x00\r\n").endswith(b"\xff\xd9")
+
+
+@dataclass(frozen=True)
+class ValidationRules:
+    min_width: int = 128
+    min_height: int = 128
+    max_bytes: int = 10 * 1024 * 1024
+
+
+class HashIndex:
+    """An append-only file of the SHA-256 hashes of every kept image."""
+
+    def __init__(self, index_file: str) -> None:
+        self.index_file = index_file
+        self.hashes = set()
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.hashes.update(line.strip() for line in f)
+
+    def add(self, image_hash: str) -> bool:
+        """Records the hash, returning false when it was already seen."""
+        if image_hash in self.hashes:
+            return False
+
+        self.hashes.add(image_hash)
+        with open(self.index_file, "a") as f:
+            f.write(f"{image_hash}\n")
+        return True
+
+
+def _append_to_manifest(output_dir: str, record: dict) -> None:
+    """Appends a kept image to the manifest the uploader reads."""
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+async def _stream_image(
+    response: aiohttp.ClientResponse,
+    file_path: str,
+    file_extension: str,
+    rules: ValidationRules,
+) -> Optional[tuple[str, int, int, int]]:
+    """Writes the body to disk while hashing and checking it on the fly."""
+    image_hash = hashlib.sha256()
+    header = b""
+    tail = b""
+    dimensions = None
+    size = 0
+
+    async with aiofiles.open(file_path, mode="wb") as f:
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > rules.max_bytes:
+                print(
+                    f"Skipping `{response.url}` for exceeding the size limit..."
+                )
+                return None
+
+            if dimensions is None:
+                header = (header + chunk)[:MAX_HEADER_BYTES]
+                dimensions = _read_image_dimensions(header)
+                if dimensions is None and len(header) == MAX_HEADER_BYTES:
+                    print(f"Skipping `{response.url}` as it is unreadable...")
+                    return None
+                elif dimensions is not None and (
+                    dimensions[0] < rules.min_width
+                    or dimensions[1] < rules.min_height
+                ):
+                    print(f"Skipping `{response.url}` as it is too small...")
+                    return None
+
+            image_hash.update(chunk)
+            tail = (tail + chunk)[-16:]
+            await f.write(chunk)
+
+    if (
+        dimensions is None
+        or (response.content_length not in (None, size))
+        or not _has_image_trailer(file_extension, tail)
+    ):
+        print(f"Skipping `{response.url}` as it is truncated...")
+        return None
+    return image_hash.hexdigest(), size, *dimensions
+
+
 async def _save_image(
     response: aiohttp.ClientResponse,
     output_dir: str,
-) -> None:
+    hash_index: HashIndex,
+    rules: ValidationRules,
+    query: Optional[str],
+) -> Optional[dict]:
     """Saves the image to the specified directory."""
     content_type = response.headers.get("content-type")
     file_extension = _get_file_extension_from_mime(content_type)
     if file_extension is None:
         print(f"Skipping `{response.url}` due to unsupported MIME type...")
         return None
+    elif (response.content_length or 0) > rules.max_bytes:
+        print(f"Skipping `{response.url}` for exceeding the size limit...")
+        return None
 
-    unique_id = uuid.uuid4().hex[:15]
-    file_path = os.path.join(output_dir, f"{unique_id}{file_extension}")
+    partial_file_path = os.path.join(output_dir, f"{uuid.uuid4().hex}.part")
+    try:
+        result = await _stream_image(
+            response, partial_file_path, file_extension, rules
+        )
+        if result is None:
+            return None
 
-    async with aiofiles.open(file_path, mode="wb") as f:
-        async for chunk in response.content:
-            await f.write(chunk)
+        image_hash, size, width, height = result
+        if not hash_index.add(image_hash):
+            print(f"Skipping `{response.url}` as a duplicate...")
+            return None
 
-    print(f"Downloaded `{response.url}` to `{file_path}`.")
+        file_name = f"{image_hash[:15]}{file_extension}"
+        os.replace(partial_file_path, os.path.join(output_dir, file_name))
+    finally:
+        if os.path.exists(partial_file_path):
+            os.remove(partial_file_path)
 
+    record = {
+        "file": file_name,
+        "sha256": image_hash,
+        "source_url": str(response.url),
+        "width": width,
+        "height": height,
+        "size": size,
+        "query": query,
+    }
+    _append_to_manifest(output_dir, record)
+    print(f"Downloaded `{response.url}` to `{file_name}`.")
+    return record
+
+
+def create_download_session(
+    concurrency: int = 16,
+    per_host_limit: int = 4,
+    timeout: float = 30,
+) -> aiohttp.ClientSession:
+    """Creates one keep-alive session shared by every download."""
+    connector = aiohttp.TCPConnector(
+        limit=concurrency,
+        limit_per_host=per_host_limit,
+        ttl_dns_cache=300,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=10),
+    )
 
-async def download_images(image_urls: list[str], output_dir: str) -> None:
-    """Downloads images from the given URLs and saves them to the specified directory."""
-    os.makedirs(output_dir, exist_ok=True)
 
-    async with aiohttp.ClientSession() as session:
-        for image_url in image_urls:
+async def _download_image(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    image_url: str,
+    output_dir: str,
+    max_retries: int,
+    hash_index: HashIndex,
+    rules: ValidationRules,
+    query: Optional[str],
+) -> Optional[dict]:
+    """Downloads a single image, retrying server errors and timeouts."""
+    async with semaphore:
+        for attempt in range(max_retries + 1):
             try:
                 async with session.get(image_url) as response:
-                    if response.status != http.HTTPStatus.OK:
+                    if response.status == http.HTTPStatus.OK:
+                        return await _save_image(
+                            response, output_dir, hash_index, rules, query
+                        )
+                    elif response.status < 500:
                         print(f"Failed to download `{image_url}`...")
-                        continue
-
-                    await _save_image(response, output_dir)
-            except Exception as e:
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 print(f"Error downloading `{image_url}`: {e}")
 
+            if attempt < max_retries:
+                await asyncio.sleep(0.5 * 2**attempt)
 
-async def main(args: argparse.Namespace) -> None:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-        context = await browser.new_context()
+    print(f"Giving up on `{image_url}` after {max_retries} retries...")
+    return None
+
+
+async def download_images(
+    session: aiohttp.ClientSession,
+    image_urls: list[str],
+    output_dir: str,
+    hash_index: HashIndex,
+    rules: ValidationRules = ValidationRules(),
+    query: Optional[str] = None,
+    concurrency: int = 16,
+    max_retries: int = 2,
+) -> list[dict]:
+    """Downloads images from the given URLs and saves them to the specified directory."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    records = await asyncio.gather(
+        *(
+            _download_image(
+                session,
+                semaphore,
+                image_url,
+                output_dir,
+                max_retries,
+                hash_index,
+                rules,
+                query,
+            )
+            for image_url in image_urls
+        )
+    )
+    return [record for record in records if record is not None]
+
+
+async def collect_query(
+    browser: Browser,
+    session: aiohttp.ClientSession,
+    query: str,
+    output_dir: str,
+    hash_index: HashIndex,
+    args: argparse.Namespace,
+) -> list[dict]:
+    """Collects the images of one query in its own page."""
+    context = await browser.new_context()
+    try:
         page = await context.new_page()
+        image_urls = await collect_image_urls(
+            page,
+            query,
+            args.max_images,
+            search_url_template=args.search_url,
+            load_timeout=args.load_timeout,
+        )
+    finally:
+        await context.close()
+
+    return await download_images(
+        session,
+        image_urls,
+        output_dir,
+        hash_index,
+        rules=ValidationRules(
+            min_width=args.min_width,
+            min_height=args.min_height,
+            max_bytes=args.max_bytes,
+        ),
+        query=query,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+    )
+
+
+def _read_queries(args: argparse.Namespace) -> list[tuple[str, str]]:
+    """Pairs each query with the folder its images go to."""
+    if args.queries_file is None:
+        return [(args.query, args.output_dir)]
+
+    with open(args.queries_file) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    return [
+        (query, os.path.join(args.output_dir, _query_to_dir_name(query)))
+        for query in queries
+    ]
+
+
+async def main(args: argparse.Namespace) -> None:
+    queries = _read_queries(args)
+    page_slots = asyncio.Semaphore(args.parallel_pages)
+    os.makedirs(args.output_dir, exist_ok=True)
+    hash_index = HashIndex(
+        args.hash_index or os.path.join(args.output_dir, "hash-index.txt")
+    )
 
-        image_urls = await collect_image_urls(page, args.query, args.max_images)
-        await download_images(image_urls, args.output_dir)
+    async with (
+        async_playwright() as p,
+        create_download_session(
+            concurrency=args.concurrency,
+            per_host_limit=args.per_host_limit,
+            timeout=args.download_timeout,
+        ) as session,
+    ):
+        browser = await p.chromium.launch(headless=not args.headed)
 
+        async def run(query: str, output_dir: str) -> None:
+            async with page_slots:
+                records = await collect_query(
+                    browser, session, query, output_dir, hash_index, args
+                )
+            print(f"Collected {len(records)} images for `{query}`.")
+
+        await asyncio.gather(*(run(*query) for query in queries))
         await browser.close()
 
 
@@ -108,7 +441,14 @@ if __name__ == "__main__":
         description="Download images from DuckDuckGo."
     )
     parser.add_argument(
-        "query", type=str, help="write what you are looking for"
+        "query", type=str, nargs="?", help="write what you are looking for"
+    )
+    parser.add_argument(
+        "-q",
+        "--queries-file",
+        type=str,
+        default=None,
+        help="a file with one query per line, each saved to its own folder",
     )
     parser.add_argument(
         "-m",
@@ -124,6 +464,88 @@ if __name__ == "__main__":
         default="collected-images",
         help="a folder to store images",
     )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=16,
+        help="downloads in flight at the same time",
+    )
+    parser.add_argument(
+        "--per-host-limit",
+        type=int,
+        default=4,
+        help="open connections allowed to a single host",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=2,
+        help="retries for a download that failed with a transient error",
+    )
+    parser.add_argument(
+        "--download-timeout",
+        type=float,
+        default=30,
+        help="seconds allowed for a single download",
+    )
+    parser.add_argument(
+        "--load-timeout",
+        type=float,
+        default=15,
+        help="seconds to wait for the search results to render",
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel-pages",
+        type=int,
+        default=3,
+        help="queries crawled at the same time in the browser",
+    )
+    parser.add_argument(
+        "--min-width",
+        type=int,
+        default=128,
+        help="narrower images are dropped while downloading",
+    )
+    parser.add_argument(
+        "--min-height",
+        type=int,
+        default=128,
+        help="shorter images are dropped while downloading",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=10 * 1024 * 1024,
+        help="larger downloads are aborted",
+    )
+    parser.add_argument(
+        "--hash-index",
+        type=str,
+        default=None,
+        help="a file of kept image hashes used to drop duplicates across runs",
+    )
+    parser.add_argument(
+        "--headed",
+        action="store_true",
+        help="show the browser window, to watch or debug a crawl",
+    )
+    # The default now, kept so existing command lines still work
+    parser.add_argument(
+        "--headless",
+        action="store_false",
+        dest="headed",
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--search-url",
+        type=str,
+        default=SEARCH_URL_TEMPLATE,
+        help="search page URL with a `{query}` placeholder",
+    )
     args = parser.parse_args()
+    if (args.query is None) == (args.queries_file is None):
+        parser.error("pass either a query or `--queries-file`")
 
     asyncio.run(main(args))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import argparse
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Connection, Engine
+
+from thinga import models
+from thinga.config import DATABASE_URL
+from thinga.database import Base
+
+# Columns added to the tables of earlier versions, oldest first. New
+# tables are made whole by `create_all`, these need an `ALTER TABLE`
+ADDED_COLUMNS = (
+    models.Image.__table__.c.category_id,
+    models.Image.__table__.c.width,
+    models.Image.__table__.c.height,
+    models.Image.__table__.c.blurhash,
+    models.Image.__table__.c.deleted_at,
+    models.Rating.__table__.c.loser_image_id,
+)
+
+
+def column_definition(connection: Connection, column) -> str:
+    """The column as `ADD COLUMN` takes it, with its foreign key if any."""
+    definition = (
+        f"{column.name} {column.type.compile(dialect=connection.dialect)}"
+    )
+    for foreign_key in column.foreign_keys:
+        definition += (
+            f" REFERENCES {foreign_key.column.table.name} "
+            f"({foreign_key.column.name})"
+        )
+        if foreign_key.ondelete:
+            definition += f" ON DELETE {foreign_key.ondelete}"
+    return definition
+
+
+def upgrade(engine: Engine) -> list[str]:
+    """Brings a database of an earlier version up to the models.
+
+    Only adds what is missing, so running it again changes nothing.
+    Returns what was added.
+    """
+    # New tables first, the new columns may point to them
+    Base.metadata.create_all(bind=engine)
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for column in ADDED_COLUMNS:
+            table_name = column.table.name
+            existing = {
+                existing_column["name"]
+                for existing_column in inspector.get_columns(table_name)
+            }
+            if column.name in existing:
+                continue
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table_name} "
+                f"ADD COLUMN {column_definition(connection, column)}"
+            )
+            added.append(f"{table_name}.{column.name}")
+
+        # Indexes of tables that existed before, `create_all` skips them
+        for table in Base.metadata.sorted_tables:
+            existing = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    added.append(index.name)
+    return added
+
+
+def main(args: argparse.Namespace) -> None:
+    engine = create_engine(args.db_url)
+    added = upgrade(engine)
+    engine.dispose()
+    if not added:
+        print("The database is up to date.")
+        return None
+    for name in added:
+        print(f"Added `{name}`.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Add the columns and indexes of this version to an existing "
+            "database."
+        )
+    )
+    parser.add_argument(
+        "--db-url", type=str, default=DATABASE_URL, help="the database"
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import json
+import asyncio
+import http
+import mimetypes
+from typing import Optional
+
+import aiohttp
+import aiofiles
+
+IMAGE_FILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+MANIFEST_FILE_NAME = "manifest.jsonl"
+# The bulk endpoint is not idempotent, so only answers saying the batch
+# was turned away before being stored are retried. A gateway error or a
+# timeout may come after the images were stored, retrying would upload
+# them twice
+RETRYABLE_STATUSES = (
+    http.HTTPStatus.TOO_MANY_REQUESTS,
+    http.HTTPStatus.SERVICE_UNAVAILABLE,
+)
+
+
+def _load_uploaded_files(progress_file: str) -> set[str]:
+    """Reads the names of the files that earlier runs already uploaded."""
+    if not os.path.exists(progress_file):
+        return set()
+
+    uploaded_files = set()
+    with open(progress_file) as f:
+        for line in f:
+            try:
+                uploaded_files.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                continue  # A run killed mid-write leaves a partial line
+    return uploaded_files
+
+
+def _read_manifest(manifest_file: str) -> list[tuple[str, Optional[str]]]:
+    """Reads the images the collector already validated and deduplicated."""
+    images = []
+    with open(manifest_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            images.append((record["file"], record.get("query")))
+    return images
+
+
+def find_pending_images(
+    images_dir: str,
+    progress_file: str,
+) -> list[tuple[str, Optional[str]]]:
+    """Lists the images, with their query, that were not uploaded yet."""
+    manifest_file = os.path.join(images_dir, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_file):
+        images = _read_manifest(manifest_file)
+    else:
+        images = [
+            (file_name, None)
+            for file_name in os.listdir(images_dir)
+            if file_name.lower().endswith(IMAGE_FILE_EXTENSIONS)
+        ]
+
+    uploaded_files = _load_uploaded_files(progress_file)
+    return sorted(
+        (file_name, query)
+        for file_name, query in images
+        if file_name not in uploaded_files
+        and os.path.exists(os.path.join(images_dir, file_name))
+    )
+
+
+async def login(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    username: str,
+    password: str,
+) -> str:
+    """Logs in once and returns the access token shared by all workers."""
+    async with session.post(
+        f"{api_url}/login/",
+        json={"username": username, "password": password},
+    ) as response:
+        if response.status != http.HTTPStatus.OK:
+            raise RuntimeError(f"Login failed: {await response.text()}")
+        return response.cookies["access_token"].value
+
+
+async def _upload_batch(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    access_token: str,
+    images_dir: str,
+    batch: list[str],
+    alt_text: Optional[str],
+    category: Optional[str],
+    max_retries: int,
+) -> Optional[list[dict]]:
+    """Posts a batch to the bulk endpoint, retrying when it surely failed."""
+    files = []
+    for file_name in batch:
+        async with aiofiles.open(
+            os.path.join(images_dir, file_name), "rb"
+        ) as f:
+            files.append((file_name, await f.read()))
+
+    params = {
+        name: value
+        for name, value in (("alt_text", alt_text), ("category", category))
+        if value is not None
+    }
+    for attempt in range(max_retries + 1):
+        delay = min(2**attempt, 30)
+        form_data = aiohttp.FormData()
+        for file_name, content in files:
+            mime_type, _ = mimetypes.guess_type(file_name)
+            form_data.add_field(
+                "media_files",
+                content,
+                filename=file_name,
+                content_type=mime_type,
+            )
+
+        try:
+            async with session.post(
+                f"{api_url}/images/bulk/",
+                data=form_data,
+                params=params,
+                headers={"Cookie": f"access_token={access_token}"},
+            ) as response:
+                if response.status == http.HTTPStatus.OK:
+                    return await response.json()
+                elif response.status not in RETRYABLE_STATUSES:
+                    error_message = await response.text()
+                    print(f"Rejected batch `{batch[0]}`...: {error_message}")
+                    return None
+                # Throttled uploads wait as long as the server asks
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+        except aiohttp.ClientConnectorError as e:
+            # Nothing was sent without a connection
+            print(f"Error connecting for batch `{batch[0]}`...: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(
+                f"Error uploading batch `{batch[0]}`...: {e}, it may have "
+                "been stored, so it is not retried; check before rerunning."
+            )
+            return None
+
+        await asyncio.sleep(delay)
+
+    print(f"Giving up on batch `{batch[0]}`... after {max_retries} retries.")
+    return None
+
+
+async def upload_images(
+    api_url: str,
+    access_token: str,
+    images_dir: str,
+    pending_images: list[tuple[str, Optional[str]]],
+    progress_file: str,
+    batch_size: int,
+    concurrency: int,
+    alt_text: Optional[str],
+    category: Optional[str],
+    max_retries: int,
+) -> int:
+    """Uploads the images in batches over a bounded pool of connections."""
+    # Images of a query share one alt text, so they are batched together
+    images_by_alt_text = {}
+    for file_name, query in pending_images:
+        images_by_alt_text.setdefault(alt_text or query, []).append(file_name)
+
+    batches = asyncio.Queue()
+    for batch_alt_text, file_names in images_by_alt_text.items():
+        for i in range(0, len(file_names), batch_size):
+            batches.put_nowait((file_names[i : i + batch_size], batch_alt_text))
+
+    uploaded_count = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with (
+        aiohttp.ClientSession(connector=connector, timeout=timeout) as session,
+        aiofiles.open(progress_file, "a") as progress,
+    ):
+
+        async def worker() -> None:
+            nonlocal uploaded_count
+            while not batches.empty():
+                batch, batch_alt_text = batches.get_nowait()
+                uploaded_images = await _upload_batch(
+                    session,
+                    api_url,
+                    access_token,
+                    images_dir,
+                    batch,
+                    batch_alt_text,
+                    category,
+                    max_retries,
+                )
+                if uploaded_images is None:
+                    continue
+
+                await progress.write(
+                    "".join(
+                        json.dumps({"file": file_name, "image_id": image["id"]})
+                        + "\n"
+                        for file_name, image in zip(batch, uploaded_images)
+                    )
+                )
+                await progress.flush()
+                uploaded_count += len(batch)
+                print(
+                    f"Uploaded {uploaded_count}/{len(pending_images)} images."
+                )
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return uploaded_count
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not os.path.isdir(args.images_dir):
+        raise SystemExit("Error: Images directory does not exist.")
+
+    progress_file = args.progress_file or os.path.join(
+        args.images_dir, "upload-progress.jsonl"
+    )
+    pending_images = find_pending_images(args.images_dir, progress_file)
+    if not pending_images:
+        print("Nothing to upload.")
+        return None
+
+    async with aiohttp.ClientSession() as session:
+        access_token = await login(
+            session, args.api_url, args.username, args.password
+        )
+
+    uploaded_count = await upload_images(
+        args.api_url,
+        access_token,
+        args.images_dir,
+        pending_images,
+        progress_file,
+        args.batch_size,
+        args.concurrency,
+        args.alt_text,
+        args.category,
+        args.max_retries,
+    )
+    print(f"Done, {uploaded_count} of {len(pending_images)} images uploaded.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upload collected images to the Thinga API."
+    )
+    parser.add_argument(
+        "-a",
+        "--api-url",
+        type=str,
+        default="http://127.0.0.1:9906",
+        help="the Thinga API URL",
+    )
+    parser.add_argument(
+        "-u", "--username", type=str, default="root", help="username for login"
+    )
+    parser.add_argument(
+        "-p", "--password", type=str, default="toor", help="password for login"
+    )
+    parser.add_argument(
+        "-d",
+        "--images-dir",
+        type=str,
+        default="collected-images",
+        help="a folder containing the images to upload",
+    )
+    parser.add_argument(
+        "-t",
+        "--alt-text",
+        type=str,
+        default=None,
+        help="alt text for every image instead of the query in the manifest",
+    )
+    parser.add_argument(
+        "-k",
+        "--category",
+        type=str,
+        default=None,
+        help="slug of an existing category to upload the images into",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=50,
+        help="images sent per request",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=8,
+        help="requests in flight at the same time",
+    )
+    parser.add_argument(
+        "-r",
+        "--max-retries",
+        type=int,
+        default=5,
+        help="retries for a batch throttled or refused before being sent",
+    )
+    parser.add_argument(
+        "--progress-file",
+        type=str,
+        default=None,
+        help="where to record uploaded files so a rerun can resume",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,68 @@
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from thinga import models
+from thinga.database import SessionLocal
+from thinga.invalidation import bus
+
+
+class ListingVersion:
+    """Tags the state of a listing of images alike in every worker.
+
+    Votes show in the newest rating id, other changes of images bump a
+    counter in the database along with them. A worker reads both once,
+    then again only after hearing of a change.
+    """
+
+    def __init__(self, name: str, session_factory) -> None:
+        self.name = name
+        self.session_factory = session_factory
+        self._etag = None
+        self._changes = 0
+
+    def invalidate(self) -> None:
+        self._changes += 1
+        self._etag = None
+
+    def _bump_existing(self, db: Session) -> int:
+        return db.execute(
+            update(models.CacheVersion)
+            .where(models.CacheVersion.name == self.name)
+            .values(version=models.CacheVersion.version + 1)
+        ).rowcount
+
+    def bump(self, db: Session) -> None:
+        """Counts a change, committed along with the rest of `db`."""
+        if self._bump_existing(db):
+            return None
+        try:
+            with db.begin_nested():
+                db.add(models.CacheVersion(name=self.name, version=1))
+        except IntegrityError:
+            self._bump_existing(db)  # Added by another worker meanwhile
+
+    def read(self) -> str:
+        with self.session_factory() as db:
+            version = db.scalar(
+                select(models.CacheVersion.version).where(
+                    models.CacheVersion.name == self.name
+                )
+            )
+            last_rating_id = db.scalar(select(func.max(models.Rating.id)))
+        return f'W/"{version or 0}-{last_rating_id or 0}"'
+
+    async def etag(self) -> str:
+        etag = self._etag
+        if etag is None:
+            changes = self._changes
+            etag = await run_in_threadpool(self.read)
+            # A change heard of meanwhile may be missing from what was read
+            if changes == self._changes:
+                self._etag = etag
+        return etag
+
+
+image_listing_version = ListingVersion("images", SessionLocal)
+bus.subscribe("images", lambda key: image_listing_version.invalidate())
@@ -0,0 +1,286 @@
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from thinga import models, metrics
+from thinga.database import SessionLocal
+from thinga.storage import GALLERY, Storage, storage
+from thinga.config import RATING_DELETE_BATCH_SIZE
+
+# Keeps `IN (...)` lists under the bound parameter limits of databases
+IMAGE_BATCH_SIZE = 500
+# Votes are stamped by the worker taking them, whose clock may be behind
+# the one that stamped their image
+CLOCK_SKEW_MARGIN = timedelta(days=1)
+# Listing the gallery is the costly part of finding orphaned files, one
+# worker per interval does it
+ORPHANED_FILES_SWEEP = "orphaned_files"
+
+
+class CleanupReport(NamedTuple):
+    images_purged: int = 0
+    ratings_deleted: int = 0
+    files_removed: int = 0
+    bytes_reclaimed: int = 0
+
+
+def _remove_files(
+    media_storage: Storage,
+    file_names: list[str],
+) -> tuple[int, int]:
+    removed_count = reclaimed_bytes = 0
+    for file_name in file_names:
+        size = media_storage.delete(GALLERY, file_name)
+        if size is None:
+            continue  # Removed by another worker already
+        removed_count += 1
+        reclaimed_bytes += size
+    return removed_count, reclaimed_bytes
+
+
+def _unreferenced(*, db: Session, file_names: list[str]) -> list[str]:
+    referenced = set(
+        db.scalars(
+            select(models.Image.media_file).where(
+                models.Image.media_file.in_(file_names)
+            )
+        )
+    )
+    return [name for name in file_names if name not in referenced]
+
+
+def delete_ratings(
+    *,
+    db: Session,
+    image_ids: list[int],
+    batch_size: int = RATING_DELETE_BATCH_SIZE,
+    created_after: Optional[datetime] = None,
+) -> int:
+    """Deletes the ratings of images a batch per transaction.
+
+    With `created_after`, PostgreSQL skips the partitions of older months.
+    """
+    window = []
+    if created_after is not None:
+        window.append(models.Rating.created_at >= created_after)
+    batch = (
+        select(models.Rating.id)
+        .where(models.Rating.image_id.in_(image_ids), *window)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    deleted_count = 0
+    while True:
+        result = db.execute(
+            delete(models.Rating).where(models.Rating.id.in_(batch), *window),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        deleted_count += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted_count
+
+
+def purge_deleted_images(
+    *,
+    db: Session,
+    deleted_before: datetime,
+    media_storage: Storage = storage,
+) -> CleanupReport:
+    """Removes images deleted long enough ago, with their ratings and files."""
+    images_purged = ratings_deleted = files_removed = bytes_reclaimed = 0
+    while True:
+        batch = db.execute(
+            select(
+                models.Image.id,
+                models.Image.media_file,
+                models.Image.created_at,
+            )
+            .where(models.Image.deleted_at <= deleted_before)
+            .limit(IMAGE_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        image_ids = [row.id for row in batch]
+        # No image is voted on before it exists
+        created_at = [row.created_at for row in batch]
+        created_after = None
+        if None not in created_at:
+            created_after = min(created_at) - CLOCK_SKEW_MARGIN
+
+        ratings_deleted += delete_ratings(
+            db=db, image_ids=image_ids, created_after=created_after
+        )
+        db.execute(
+            delete(models.Image).where(models.Image.id.in_(image_ids)),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        images_purged += len(image_ids)
+
+        # Files go once their rows are gone, unless another row shares them
+        file_names = _unreferenced(
+            db=db, file_names=list({row.media_file for row in batch})
+        )
+        removed_count, reclaimed_bytes = _remove_files(
+            media_storage, file_names
+        )
+        files_removed += removed_count
+        bytes_reclaimed += reclaimed_bytes
+
+    return CleanupReport(
+        images_purged, ratings_deleted, files_removed, bytes_reclaimed
+    )
+
+
+def remove_orphaned_files(
+    *,
+    db: Session,
+    modified_before: float,
+    modified_after: float = 0,
+    media_storage: Storage = storage,
+) -> CleanupReport:
+    """Unlinks gallery files no image points to, like those of failed uploads.
+
+    Files are written once, so a sweep only has to look at those modified
+    since the last one. Recent files are left alone, their rows may not be
+    committed yet.
+    """
+    candidates = [
+        stored_file.name
+        for stored_file in media_storage.list(GALLERY)
+        if modified_after < stored_file.modified_at <= modified_before
+    ]
+
+    orphaned_files = []
+    for start in range(0, len(candidates), IMAGE_BATCH_SIZE):
+        orphaned_files += _unreferenced(
+            db=db, file_names=candidates[start : start + IMAGE_BATCH_SIZE]
+        )
+    db.rollback()  # Ends the read transaction
+    removed_count, reclaimed_bytes = _remove_files(
+        media_storage, orphaned_files
+    )
+    return CleanupReport(
+        files_removed=removed_count, bytes_reclaimed=reclaimed_bytes
+    )
+
+
+def claim_sweep(
+    *,
+    db: Session,
+    name: str,
+    claimed_until: datetime,
+) -> Optional[float]:
+    """Claims a sweep for this worker, unless another one holds it.
+
+    Returns the modification time the last sweep got to, or None when the
+    sweep is not this worker's to run.
+    """
+    now = datetime.now(timezone.utc)
+    claimed_count = db.execute(
+        update(models.Sweep)
+        .where(models.Sweep.name == name, models.Sweep.claimed_until <= now)
+        .values(claimed_until=claimed_until),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if claimed_count:
+        swept_until = db.scalar(
+            select(models.Sweep.swept_until).where(models.Sweep.name == name)
+        )
+        db.commit()
+        return swept_until
+    if db.get(models.Sweep, name) is not None:
+        db.rollback()
+        return None
+    try:
+        db.add(models.Sweep(name=name, claimed_until=claimed_until))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None  # The first sweep was claimed by another worker
+    return 0.0
+
+
+def finish_sweep(*, db: Session, name: str, swept_until: float) -> None:
+    """Records how far a sweep got, the next one starts from there."""
+    db.execute(
+        update(models.Sweep)
+        .where(models.Sweep.name == name)
+        .values(swept_until=swept_until)
+    )
+    db.commit()
+
+
+def purge_used_pair_tokens(*, db: Session, expired_before: datetime) -> int:
+    """Forgets used pair tokens, once they would be refused as too old."""
+    result = db.execute(
+        delete(models.UsedPairToken).where(
+            models.UsedPairToken.expires_at <= expired_before
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def record(report: CleanupReport) -> CleanupReport:
+    metrics.images_purged.inc(amount=report.images_purged)
+    metrics.image_files_removed.inc(amount=report.files_removed)
+    metrics.image_files_reclaimed_bytes.inc(amount=report.bytes_reclaimed)
+    return report
+
+
+async def run_cleanup_worker(
+    *,
+    interval_seconds: float,
+    purge_delay_seconds: float,
+) -> None:
+    """Purges deleted images and orphaned files every interval, forever.
+
+    Orphaned files are looked for by one worker per interval, from where
+    the last successful sweep of any worker got to.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        now = datetime.now(timezone.utc)
+        deleted_before = now - timedelta(seconds=purge_delay_seconds)
+        modified_before = time.time() - purge_delay_seconds
+
+        def sweep() -> None:
+            with SessionLocal() as db:
+                record(
+                    purge_deleted_images(db=db, deleted_before=deleted_before)
+                )
+                modified_after = claim_sweep(
+                    db=db,
+                    name=ORPHANED_FILES_SWEEP,
+                    claimed_until=now + timedelta(seconds=interval_seconds),
+                )
+                if modified_after is not None:
+                    record(
+                        remove_orphaned_files(
+                            db=db,
+                            modified_before=modified_before,
+                            modified_after=modified_after,
+                        )
+                    )
+                    finish_sweep(
+                        db=db,
+                        name=ORPHANED_FILES_SWEEP,
+                        swept_until=modified_before,
+                    )
+                purge_used_pair_tokens(
+                    db=db, expired_before=datetime.now(timezone.utc)
+                )
+
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception:
+            # Database or storage errors alike, the worker must keep going
+            metrics.image_cleanup_failures.inc()
+            continue  # Whatever is left gets picked up next round
@@ -14,14 +14,99 @@ ALLOWED_ORIGINS = re.split(r"[,;]\s?", os.environ["ALLOWED_ORIGINS"])
 DATABASE_URL = os.environ["DATABASE_URL"]
 TEST_DATABASE_URL = os.environ["TEST_DATABASE_URL"]
 
+DATABASE_REPLICA_URLS = [
+    url
+    for url in re.split(r"[,;]\s?", os.environ["DATABASE_REPLICA_URLS"])
+    if url
+]
+DATABASE_POOL_SIZE = int(os.environ["DATABASE_POOL_SIZE"])
+DATABASE_MAX_OVERFLOW = int(os.environ["DATABASE_MAX_OVERFLOW"])
+DATABASE_POOL_TIMEOUT_SECONDS = float(
+    os.environ["DATABASE_POOL_TIMEOUT_SECONDS"]
+)
+DATABASE_POOL_RECYCLE_SECONDS = int(os.environ["DATABASE_POOL_RECYCLE_SECONDS"])
+DATABASE_POOL_PRE_PING = os.environ["DATABASE_POOL_PRE_PING"] == "1"
+DATABASE_STATEMENT_CACHE_SIZE = int(os.environ["DATABASE_STATEMENT_CACHE_SIZE"])
+DATABASE_EXTERNAL_POOLER = os.environ["DATABASE_EXTERNAL_POOLER"] == "1"
+
+REPLICA_MAX_LAG_SECONDS = float(os.environ["REPLICA_MAX_LAG_SECONDS"])
+REPLICA_HEALTH_CHECK_SECONDS = float(os.environ["REPLICA_HEALTH_CHECK_SECONDS"])
+# Reads stay on the primary this long after a client writes
+READ_YOUR_WRITES_SECONDS = int(os.environ["READ_YOUR_WRITES_SECONDS"])
+
 SESSION_EXPIRE_DAYS = int(os.environ["SESSION_EXPIRE_DAYS"])
 
+BCRYPT_ROUNDS = int(os.environ["BCRYPT_ROUNDS"])
+
 COOKIE_SECURE_MODE = not DEBUG_ENABLED
 COOKIE_NO_JS_ACCESS = os.environ["COOKIE_NO_JS_ACCESS"] == "1"
 COOKIE_SAMESITE_POLICY = "lax" if DEBUG_ENABLED else "none"
 
 MEDIA_STORAGE_PATH = os.path.join(BASE_DIR, "media")
-GALLERY_STORAGE_PATH = os.path.join(MEDIA_STORAGE_PATH, "gallery")
-AVATARS_STORAGE_PATH = os.path.join(MEDIA_STORAGE_PATH, "avatars")
+
+STORAGE_BACKEND = os.environ["STORAGE_BACKEND"]
+STORAGE_SIGNING_KEY = os.environ["STORAGE_SIGNING_KEY"]
+S3_BUCKET = os.environ["S3_BUCKET"]
+S3_ENDPOINT_URL = os.environ["S3_ENDPOINT_URL"]
+S3_REGION = os.environ["S3_REGION"]
+S3_ACCESS_KEY_ID = os.environ["S3_ACCESS_KEY_ID"]
+S3_SECRET_ACCESS_KEY = os.environ["S3_SECRET_ACCESS_KEY"]
+DIRECT_UPLOAD_EXPIRE_SECONDS = int(os.environ["DIRECT_UPLOAD_EXPIRE_SECONDS"])
 
 MAX_IMAGE_SIZE_BYTES = int(os.environ["MAX_IMAGE_SIZE_BYTES"])
+MAX_BULK_UPLOAD_FILES = int(os.environ["MAX_BULK_UPLOAD_FILES"])
+MAX_BATCH_IMAGE_IDS = 100
+MAX_BULK_DELETE_IMAGES = 1000
+# Trending windows stay within the partitions of a month or two
+MAX_TRENDING_DAYS = 31
+
+# Deleted images are purged with their ratings and files after a delay
+IMAGE_PURGE_DELAY_SECONDS = int(os.environ["IMAGE_PURGE_DELAY_SECONDS"])
+IMAGE_CLEANUP_INTERVAL_SECONDS = int(
+    os.environ["IMAGE_CLEANUP_INTERVAL_SECONDS"]
+)
+# Ratings removed per transaction, so purges never hold locks for long
+RATING_DELETE_BATCH_SIZE = 1000
+
+# Monthly partitions of ratings on PostgreSQL, made this many months ahead.
+# Whole months kept before the current one, 0 to keep all, and where those
+# detached go, empty to drop them.
+RATING_PARTITIONS_AHEAD = 3
+RATING_RETENTION_MONTHS = int(os.environ["RATING_RETENTION_MONTHS"])
+RATING_ARCHIVE_SCHEMA = os.environ["RATING_ARCHIVE_SCHEMA"]
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = 3600
+
+# Background jobs run by each worker at once, 0 to run none there
+JOB_WORKER_CONCURRENCY = int(os.environ["JOB_WORKER_CONCURRENCY"])
+JOB_POLL_INTERVAL_SECONDS = float(os.environ["JOB_POLL_INTERVAL_SECONDS"])
+# Running jobs not finished by then are taken up again by another worker
+JOB_LEASE_SECONDS = 300
+
+# Votes over WebSockets within this long of each other are committed together
+VOTE_BATCH_WAIT_SECONDS = 0.005
+
+COMPRESSION_MINIMUM_SIZE_BYTES = 1024
+
+# Signs the pairs served to voters, votes must come back within the max age
+PAIR_TOKEN_SIGNING_KEY = os.environ["PAIR_TOKEN_SIGNING_KEY"]
+PAIR_TOKEN_MAX_AGE_SECONDS = int(os.environ["PAIR_TOKEN_MAX_AGE_SECONDS"])
+
+# Requests per user and per client as `burst/seconds`
+VOTE_RATE_LIMIT = os.environ["VOTE_RATE_LIMIT"]
+VOTE_CLIENT_RATE_LIMIT = os.environ["VOTE_CLIENT_RATE_LIMIT"]
+UPLOAD_RATE_LIMIT = os.environ["UPLOAD_RATE_LIMIT"]
+UPLOAD_CLIENT_RATE_LIMIT = os.environ["UPLOAD_CLIENT_RATE_LIMIT"]
+# A SQLite file shared by the workers of a host, empty to limit per worker
+RATE_LIMIT_STORE_PATH = os.environ["RATE_LIMIT_STORE_PATH"]
+RATE_LIMIT_MAX_BUCKETS = int(os.environ["RATE_LIMIT_MAX_BUCKETS"])
+
+# How workers tell each other's caches about writes
+INVALIDATION_BUS = os.environ["INVALIDATION_BUS"]
+INVALIDATION_SOCKET_DIR = os.environ["INVALIDATION_SOCKET_DIR"]
+
+# Profile one in every N requests to this route template, empty to turn off
+PROFILED_ROUTE = os.environ["PROFILED_ROUTE"]
+PROFILE_EVERY_N_REQUESTS = int(os.environ["PROFILE_EVERY_N_REQUESTS"])
+
+# Bearer token `/metrics` asks for, empty to serve it to anyone who reaches it
+METRICS_TOKEN = os.environ["METRICS_TOKEN"]
@@ -1,18 +1,23 @@
-import os
-import shutil
+import io
+import time
+import random
 import mimetypes
 from datetime import datetime, timezone
 from typing import Optional
 
 from fastapi import UploadFile, HTTPException, status
-from sqlalchemy import func
+from sqlalchemy import Row, func, select, update
 from sqlalchemy.orm import Session
 
-from thinga import models, schemas, enums, utils
+from thinga import models, schemas, enums, utils, metrics, jobs
+from thinga.cache import image_listing_version
+from thinga.invalidation import bus
+from thinga.storage import GALLERY, AVATARS, Storage, storage
 from thinga.config import (
-    GALLERY_STORAGE_PATH,
-    AVATARS_STORAGE_PATH,
     MAX_IMAGE_SIZE_BYTES,
+    MAX_BULK_UPLOAD_FILES,
+    MAX_BULK_DELETE_IMAGES,
+    DIRECT_UPLOAD_EXPIRE_SECONDS,
 )
 
 
@@ -47,33 +52,28 @@ def create_user(*, db: Session, user: schemas.UserCreate) -> models.User:
         )
 
     hashed_password = utils.get_password_hash(user.password)
+    avatar_file_name = None
+    if user.avatar_file is not None:
+        validate_image_file(file=user.avatar_file)
+        avatar_file_name = save_image_file(
+            file=user.avatar_file, folder=AVATARS
+        )
+    # The user and its profile land in one commit, never one without the
+    # other
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password,
+        profile=models.Profile(
+            display_name=user.display_name,
+            avatar_file=avatar_file_name,
+            bio=user.bio,
+        ),
     )
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
 
-    avatar_file_name = (
-        save_image_file(
-            file=user.avatar_file,
-            storage_path=AVATARS_STORAGE_PATH,
-        )
-        if user.avatar_file is not None
-        else None
-    )
-    db_profile = models.Profile(
-        display_name=user.display_name,
-        avatar_file=avatar_file_name,
-        bio=user.bio,
-        user_id=db_user.id,
-    )
-    db.add(db_profile)
-    db.commit()
-    db.refresh(db_profile)
-
     return db_user
 
 
@@ -91,6 +91,7 @@ def update_user_role(
         )
     db_user.role = new_role
     db.commit()
+    bus.publish("users", str(db_user.id))
     db.refresh(db_user)
     return db_user
 
@@ -139,60 +140,330 @@ def update_user_profile(
     )
     existing_user.profile.bio = user.bio or existing_user.profile.bio
     if user.avatar_file is not None:
+        validate_image_file(file=user.avatar_file)
         avatar_file_name = save_image_file(
-            file=user.avatar_file,
-            storage_path=AVATARS_STORAGE_PATH,
+            file=user.avatar_file, folder=AVATARS
         )
         existing_user.profile.avatar_file = avatar_file_name
     db.commit()
+    bus.publish("users", str(existing_user.id))
     db.refresh(existing_user)
 
     return existing_user
 
 
-def get_images(*, db: Session) -> list[models.Image]:
-    return db.query(models.Image).all()
+# Plain columns of the response schema, read as rows instead of ORM objects
+IMAGE_COLUMNS = tuple(
+    getattr(models.Image, field_name)
+    for field_name in schemas.Image.model_fields
+)
+
+
+def get_images(*, db: Session) -> list[Row]:
+    return db.query(*IMAGE_COLUMNS).filter(models.LIVE_IMAGES).all()
+
+
+def get_two_random_images(*, db: Session) -> list[Row]:
+    return _get_two_random_images(db=db, criteria=())
+
+
+def _get_two_random_images(*, db: Session, criteria: tuple) -> list[Row]:
+    """Two live images matching `criteria`, found by seeking random ids.
+
+    Each pick is a single seek along the ids, where sorting by `random()`
+    reads every row. Images after a gap in the ids come up a little more
+    often, which a contest of pairs can live with.
+    """
+    live = (*criteria, models.LIVE_IMAGES)
+    lowest_id, highest_id = (
+        db.query(func.min(models.Image.id), func.max(models.Image.id))
+        .filter(*live)
+        .one()
+    )
+    images = []
+    if lowest_id is None:
+        return images
+    for _ in range(2):
+        # Leaving out the first pick keeps the pair distinct without retries
+        remaining = (
+            *live,
+            *(models.Image.id != image.id for image in images),
+        )
+        random_id = random.randint(lowest_id, highest_id)
+        image = (
+            db.query(*IMAGE_COLUMNS)
+            .filter(*remaining, models.Image.id >= random_id)
+            .order_by(models.Image.id)
+            .first()
+        ) or (
+            db.query(*IMAGE_COLUMNS)
+            .filter(*remaining, models.Image.id < random_id)
+            .order_by(models.Image.id.desc())
+            .first()
+        )
+        if image is None:
+            break
+        images.append(image)
+    return images
 
 
-def get_two_random_images(*, db: Session) -> list[models.Image]:
-    return db.query(models.Image).order_by(func.random()).limit(2).all()
+def get_top_ranked_images(*, db: Session, limit: int) -> list[Row]:
+    return (
+        db.query(*IMAGE_COLUMNS)
+        .filter(models.LIVE_IMAGES)
+        .order_by(models.Image.score.desc(), models.Image.id.desc())
+        .limit(limit)
+        .all()
+    )
 
 
-def get_top_ranked_images(*, db: Session, limit: int) -> list[models.Image]:
+def get_trending_images(
+    *,
+    db: Session,
+    since: datetime,
+    limit: int,
+) -> list[Row]:
+    """The images voted for most since a moment.
+
+    Ratings are only filtered on `created_at`, their partition key, so
+    PostgreSQL reads the partitions of the window and none older.
+    """
+    recent_votes = (
+        select(models.Rating.image_id, func.count().label("votes"))
+        .where(models.Rating.created_at >= since)
+        .group_by(models.Rating.image_id)
+        .subquery()
+    )
     return (
-        db.query(models.Image)
-        .order_by(models.Image.score.desc())
+        db.query(*IMAGE_COLUMNS)
+        .join(recent_votes, recent_votes.c.image_id == models.Image.id)
+        .filter(models.LIVE_IMAGES)
+        .order_by(recent_votes.c.votes.desc(), models.Image.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def get_categories(*, db: Session) -> list[models.Category]:
+    return db.query(models.Category).order_by(models.Category.name).all()
+
+
+def get_category_by_slug(
+    *,
+    db: Session,
+    slug: str,
+) -> Optional[models.Category]:
+    return (
+        db.query(models.Category).filter(models.Category.slug == slug).first()
+    )
+
+
+def create_category(
+    *,
+    db: Session,
+    category: schemas.CategoryCreate,
+) -> models.Category:
+    if get_category_by_slug(db=db, slug=category.slug) is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category already exists.",
+        )
+    db_category = models.Category(slug=category.slug, name=category.name)
+    db.add(db_category)
+    db.commit()
+    db.refresh(db_category)
+    return db_category
+
+
+def get_two_random_images_in_category(
+    *,
+    db: Session,
+    category_id: int,
+) -> list[Row]:
+    return _get_two_random_images(
+        db=db, criteria=(models.Image.category_id == category_id,)
+    )
+
+
+def get_top_ranked_images_in_category(
+    *,
+    db: Session,
+    category_id: int,
+    limit: int,
+) -> list[Row]:
+    return (
+        db.query(*IMAGE_COLUMNS)
+        .filter(models.Image.category_id == category_id, models.LIVE_IMAGES)
+        .order_by(models.Image.score.desc(), models.Image.id.desc())
         .limit(limit)
         .all()
     )
 
 
 def get_image_by_id(*, db: Session, image_id: int) -> Optional[models.Image]:
-    return db.query(models.Image).filter(models.Image.id == image_id).first()
+    return (
+        db.query(models.Image)
+        .filter(models.Image.id == image_id, models.LIVE_IMAGES)
+        .first()
+    )
 
 
 def create_image(*, db: Session, image: schemas.ImageCreate) -> models.Image:
-    file_name = save_image_file(
-        file=image.media_file,
-        storage_path=GALLERY_STORAGE_PATH,
+    # Oversized or unknown files are turned away before being read
+    validate_image_file(file=image.media_file)
+    file_name, metadata = save_gallery_image_file(file=image.media_file)
+    db_image = models.Image(
+        media_file=file_name,
+        alt_text=image.alt_text,
+        category_id=image.category_id,
+        **metadata._asdict(),
     )
-    db_image = models.Image(media_file=file_name, alt_text=image.alt_text)
     db.add(db_image)
+    image_listing_version.bump(db)
     db.commit()
+    bus.publish("images")
     db.refresh(db_image)
     return db_image
 
 
-def update_image_score(*, db: Session, image_id: int) -> models.Image:
-    db_image = get_image_by_id(db=db, image_id=image_id)
+def create_images(
+    *,
+    db: Session,
+    images: list[schemas.ImageCreate],
+) -> list[models.Image]:
+    if len(images) > MAX_BULK_UPLOAD_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                "Too many files in one upload, the limit is "
+                f"{MAX_BULK_UPLOAD_FILES}."
+            ),
+        )
+    # Reject the whole batch before anything touches the disk
+    for image in images:
+        validate_image_file(file=image.media_file)
+
+    db_images = []
+    for image in images:
+        file_name, metadata = save_gallery_image_file(file=image.media_file)
+        db_images.append(
+            models.Image(
+                media_file=file_name,
+                alt_text=image.alt_text,
+                category_id=image.category_id,
+                **metadata._asdict(),
+            )
+        )
+    db.add_all(db_images)
+    db.flush()
+    image_ids = [db_image.id for db_image in db_images]
+    image_listing_version.bump(db)
+    db.commit()
+    bus.publish("images")
+    return (
+        db.query(models.Image)
+        .filter(models.Image.id.in_(image_ids))
+        .order_by(models.Image.id)
+        .all()
+    )
+
+
+def create_image_upload(
+    *,
+    upload: schemas.ImageUploadCreate,
+) -> schemas.ImageUpload:
+    mime_type = validate_image(file_name=upload.file_name, size=upload.size)
+    media_file = utils.generate_unique_file_name(upload.file_name)
+    direct_upload = storage.create_upload(
+        GALLERY,
+        media_file,
+        mime_type,
+        upload.size,
+        DIRECT_UPLOAD_EXPIRE_SECONDS,
+    )
+    return schemas.ImageUpload(
+        media_file=media_file,
+        upload_url=direct_upload.url,
+        method=direct_upload.method,
+        headers=direct_upload.headers,
+        expires_in=DIRECT_UPLOAD_EXPIRE_SECONDS,
+    )
+
+
+def complete_image_upload(
+    *,
+    db: Session,
+    media_file: str,
+    alt_text: Optional[str],
+    category_id: Optional[int],
+) -> models.Image:
+    if (
+        db.query(models.Image.id)
+        .filter(models.Image.media_file == media_file)
+        .first()
+        is not None
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload already completed.",
+        )
+    size = storage.size(GALLERY, media_file)
+    if size is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Uploaded file not found.",
+        )
+    elif size > MAX_IMAGE_SIZE_BYTES:
+        storage.delete(GALLERY, media_file)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=(
+                "Image file size exceeds the limit of "
+                f"{MAX_IMAGE_SIZE_BYTES / (1024 * 1024)} MB."
+            ),
+        )
+
+    # The file is not read here, a job fills in its size and placeholder
+    db_image = models.Image(
+        media_file=media_file,
+        alt_text=alt_text,
+        category_id=category_id,
+    )
+    db.add(db_image)
+    db.flush()
+    image_listing_version.bump(db)
+    jobs.enqueue(
+        db=db, kind="image_metadata", payload={"image_id": db_image.id}
+    )
+    bus.publish("images")
+    db.refresh(db_image)
+    return db_image
+
+
+def rate_image(*, db: Session, rating: schemas.RatingCreate) -> Row:
+    """Counts a vote, returning the image it was for in the same statement."""
+    db_image = db.execute(
+        update(models.Image)
+        .where(models.Image.id == rating.image_id, models.LIVE_IMAGES)
+        .values(score=models.Image.score + 1)
+        .returning(*IMAGE_COLUMNS),
+        execution_options={"synchronize_session": False},
+    ).first()
     if db_image is None:
+        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found.",
         )
-    db_image.score += 1
+    db.add(
+        models.Rating(
+            user_id=rating.user_id,
+            image_id=rating.image_id,
+            loser_image_id=rating.loser_image_id,
+        )
+    )
     db.commit()
-    db.refresh(db_image)
+    bus.publish("images")
     return db_image
 
 
@@ -203,20 +474,33 @@ def delete_image(*, db: Session, image_id: int) -> None:
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found.",
         )
-    db.delete(db_image)
+    # Only hidden here, `cleanup` purges its ratings and file later
+    db_image.deleted_at = datetime.now(timezone.utc)
+    image_listing_version.bump(db)
     db.commit()
+    bus.publish("images")
 
 
-def create_rating(
-    *,
-    db: Session,
-    rating: schemas.RatingCreate,
-) -> models.Rating:
-    db_rating = models.Rating(user_id=rating.user_id, image_id=rating.image_id)
-    db.add(db_rating)
+def delete_images(*, db: Session, image_ids: list[int]) -> int:
+    if len(image_ids) > MAX_BULK_DELETE_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Delete up to {MAX_BULK_DELETE_IMAGES} images at once.",
+        )
+    deleted_count = (
+        db.query(models.Image)
+        .filter(models.Image.id.in_(image_ids), models.LIVE_IMAGES)
+        .update(
+            {models.Image.deleted_at: datetime.now(timezone.utc)},
+            synchronize_session=False,
+        )
+    )
+    if deleted_count:
+        image_listing_version.bump(db)
     db.commit()
-    db.refresh(db_rating)
-    return db_rating
+    if deleted_count:
+        bus.publish("images")
+    return deleted_count
 
 
 def get_session_by_access_token(
@@ -252,6 +536,7 @@ def deactivate_session(*, db: Session, access_token: str) -> None:
     if db_session is not None:
         db_session.status = enums.SessionStatus.INACTIVE
         db.commit()
+        bus.publish("sessions", str(db_session.id))
 
 
 def verify_session(
@@ -259,6 +544,7 @@ def verify_session(
     db: Session,
     access_token: str,
     client_fingerprint: str,
+    read_only: bool = False,
 ) -> Optional[models.Session]:
     db_session = get_session_by_access_token(db=db, access_token=access_token)
     if (
@@ -274,14 +560,18 @@ def verify_session(
     elif db_session.expires_at.replace(tzinfo=timezone.utc) <= datetime.now(
         timezone.utc
     ):
+        if read_only:
+            # Replicas refuse writes, the next request to the primary expires it
+            return None
         db_session.status = enums.SessionStatus.EXPIRED
         db.commit()
+        bus.publish("sessions", str(db_session.id))
 
     return db_session
 
 
-def save_image_file(*, file: UploadFile, storage_path: str) -> str:
-    mime_type, _ = mimetypes.guess_type(file.filename)
+def validate_image(*, file_name: str, size: int) -> str:
+    mime_type, _ = mimetypes.guess_type(file_name)
     if mime_type not in (
         "image/jpeg",
         "image/png",
@@ -292,7 +582,7 @@ def save_image_file(*, file: UploadFile, storage_path: str) -> str:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="The file must be an image.",
         )
-    elif file.size > MAX_IMAGE_SIZE_BYTES:
+    elif size > MAX_IMAGE_SIZE_BYTES:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=(
@@ -300,9 +590,36 @@ def save_image_file(*, file: UploadFile, storage_path: str) -> str:
                 f"{MAX_IMAGE_SIZE_BYTES / (1024 * 1024)} MB."
             ),
         )
+    return mime_type
 
+
+def validate_image_file(*, file: UploadFile) -> None:
+    validate_image(file_name=file.filename, size=file.size)
+
+
+def save_image_file(
+    *,
+    file: UploadFile,
+    folder: str,
+    media_storage: Storage = storage,
+) -> str:
+    """Stores an upload its caller already validated, under a new name."""
     file_name = utils.generate_unique_file_name(file.filename)
-    file_path = os.path.join(storage_path, file_name)
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    started_at = time.perf_counter()
+    written_bytes = media_storage.save(folder, file_name, file.file)
+    elapsed_seconds = time.perf_counter() - started_at
+    metrics.image_upload_bytes.inc(amount=written_bytes)
+    if elapsed_seconds > 0:
+        metrics.image_upload_throughput.observe(written_bytes / elapsed_seconds)
     return file_name
+
+
+def save_gallery_image_file(
+    *,
+    file: UploadFile,
+) -> tuple[str, utils.ImageMetadata]:
+    # One read of the upload both lands on disk and gets decoded
+    data = file.file.read()
+    file.file = io.BytesIO(data)
+    file_name = save_image_file(file=file, folder=GALLERY)
+    return file_name, utils.read_image_metadata(data)
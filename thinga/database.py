@@ -1,9 +1,142 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+
+from thinga.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URLS,
+    DATABASE_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT_SECONDS,
+    DATABASE_POOL_RECYCLE_SECONDS,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DATABASE_EXTERNAL_POOLER,
+    REPLICA_MAX_LAG_SECONDS,
+    REPLICA_HEALTH_CHECK_SECONDS,
+)
+
+# A replica that has replayed all the WAL it received is caught up, as
+# long as its WAL receiver is streaming from the primary. Without one,
+# e.g. after losing the primary, it may be any amount behind and has no
+# lag to report. Roles without `pg_read_all_stats` cannot see the status
+# and only go by the receiver existing
+POSTGRESQL_REPLICATION_LAG = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver"
+    " WHERE COALESCE(status, 'streaming') = 'streaming') THEN NULL"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM"
+    " now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def create_configured_engine(database_url: str) -> Engine:
+    options = {
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+        "query_cache_size": DATABASE_STATEMENT_CACHE_SIZE,
+    }
+    if DATABASE_EXTERNAL_POOLER:
+        # PgBouncer and the like pool for us, and in transaction mode they
+        # may hand each transaction to a different server connection, where
+        # a statement prepared earlier does not exist
+        options["poolclass"] = NullPool
+        if make_url(database_url).get_driver_name() == "psycopg":
+            options["connect_args"] = {"prepare_threshold": None}
+    else:
+        options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+            pool_recycle=DATABASE_POOL_RECYCLE_SECONDS,
+        )
+    return create_engine(database_url, **options)
+
+
+class ReplicaSet:
+    """Hands out replica engines round-robin, skipping unhealthy ones.
+
+    Health is probed in the background, see `run_health_checks`, so
+    requests never wait on a slow or unreachable replica.
+    """
 
-from thinga.config import DATABASE_URL
+    def __init__(
+        self,
+        engines: list[Engine],
+        max_lag_seconds: float,
+        health_check_seconds: float,
+    ) -> None:
+        self.engines = engines
+        self.max_lag_seconds = max_lag_seconds
+        self.health_check_seconds = health_check_seconds
+        self._turns = itertools.count()
+        # Engine -> whether it was usable at the last check, none are
+        # before the first
+        self._health = {}
 
-engine = create_engine(DATABASE_URL)
+    def measure_lag(self, engine: Engine) -> float:
+        """Seconds the replica is behind its primary."""
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                lag = connection.scalar(POSTGRESQL_REPLICATION_LAG)
+                return float("inf") if lag is None else float(lag)
+            # Other databases, like SQLite files standing in for replicas,
+            # only get a liveness check
+            connection.execute(text("SELECT 1"))
+            return 0.0
+
+    def check_health(self) -> None:
+        """Probes every replica, replacing the verdicts `choose` goes by."""
+        for engine in self.engines:
+            try:
+                healthy = self.measure_lag(engine) <= self.max_lag_seconds
+            except SQLAlchemyError:
+                healthy = False
+            self._health[engine] = healthy
+
+    async def run_health_checks(self) -> None:
+        """Probes the replicas every interval, forever."""
+        while True:
+            await asyncio.to_thread(self.check_health)
+            await asyncio.sleep(self.health_check_seconds)
+
+    def is_healthy(self, engine: Engine) -> bool:
+        return self._health.get(engine, False)
+
+    def choose(self) -> Optional[Engine]:
+        """The next healthy replica, or `None` to fall back to the primary."""
+        if not self.engines:
+            return None
+        start = next(self._turns)
+        for offset in range(len(self.engines)):
+            engine = self.engines[(start + offset) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+
+engine = create_configured_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+replicas = ReplicaSet(
+    [create_configured_engine(url) for url in DATABASE_REPLICA_URLS],
+    max_lag_seconds=REPLICA_MAX_LAG_SECONDS,
+    health_check_seconds=REPLICA_HEALTH_CHECK_SECONDS,
+)
+# Names used in metrics and pool stats, replica URLs may hold passwords
+engine_names = {
+    engine: "primary",
+    **{
+        replica: f"replica-{index}"
+        for index, replica in enumerate(replicas.engines)
+    },
+}
+
 Base = declarative_base()
@@ -1,20 +1,93 @@
-from typing import Iterator
+import time
+import secrets
+from typing import Iterator, Optional
 
-from fastapi import Request, Depends, HTTPException, status
+from fastapi import Request, Response, Depends, Header, HTTPException, status
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session
 
-from thinga import models, crud, enums, utils
-from thinga.database import SessionLocal
+from thinga import models, crud, enums, utils, metrics, voting
+from thinga.rate_limiting import vote_rate_limit, upload_rate_limit
+from thinga.pair_tokens import PAIR_TOKEN_HEADER, pair_tokens
+from thinga.database import SessionLocal, engine, engine_names, replicas
+from thinga.loaders import Loaders
+from thinga.config import (
+    COOKIE_SECURE_MODE,
+    COOKIE_SAMESITE_POLICY,
+    READ_YOUR_WRITES_SECONDS,
+    METRICS_TOKEN,
+)
 
+READ_PRIMARY_COOKIE = "read_primary"
 
-def get_db() -> Iterator[Session]:
-    db = SessionLocal()
+
+def _open_session(db_engine: Engine) -> Iterator[Session]:
+    engine_name = engine_names[db_engine]
+    db = SessionLocal(bind=db_engine)
     try:
+        # Checking the connection out up front makes the pool wait measurable
+        started_at = time.perf_counter()
+        try:
+            db.connection()
+        except PoolTimeoutError as e:
+            metrics.db_pool_checkout_timeouts.inc(engine_name)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The server is busy, try again shortly.",
+                headers={"Retry-After": "1"},
+            ) from e
+        finally:
+            metrics.db_pool_checkout_wait.observe(
+                time.perf_counter() - started_at, engine_name
+            )
         yield db
     finally:
         db.close()
 
 
+def get_db() -> Iterator[Session]:
+    yield from _open_session(engine)
+
+
+def get_read_db(request: Request) -> Iterator[Session]:
+    # Clients that just wrote something read it back from the primary
+    replica = (
+        None if READ_PRIMARY_COOKIE in request.cookies else replicas.choose()
+    )
+    metrics.db_read_routing.inc("primary" if replica is None else "replica")
+    yield from _open_session(replica or engine)
+
+
+def get_session_factory() -> voting.SessionFactory:
+    # Connections outliving a request, like WebSockets, open a session for
+    # each message rather than holding on to one of the pool
+    return SessionLocal
+
+
+def get_vote_batcher() -> voting.VoteBatcher:
+    return voting.vote_batcher
+
+
+async def get_loaders(db: Session = Depends(get_read_db)) -> Loaders:
+    return Loaders(db)
+
+
+async def get_primary_loaders(db: Session = Depends(get_db)) -> Loaders:
+    return Loaders(db)
+
+
+async def pin_reads_to_primary(response: Response) -> None:
+    response.set_cookie(
+        key=READ_PRIMARY_COOKIE,
+        value="1",
+        max_age=READ_YOUR_WRITES_SECONDS,
+        httponly=True,
+        secure=COOKIE_SECURE_MODE,
+        samesite=COOKIE_SAMESITE_POLICY,
+    )
+
+
 async def get_access_token(request: Request) -> str:
     access_token = request.cookies.get("access_token")
     if access_token is None:
@@ -25,16 +98,49 @@ async def get_access_token(request: Request) -> str:
     return access_token
 
 
-async def get_current_user(
-    request: Request,
+async def verify_metrics_token(
+    authorization: Optional[str] = Header(None),
+) -> None:
+    if not METRICS_TOKEN:
+        return None
+    if authorization is None or not secrets.compare_digest(
+        authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+async def get_offered_pair(
+    image_id: int,
+    pair_token: str = Header(..., alias=PAIR_TOKEN_HEADER),
     access_token: str = Depends(get_access_token),
-    db: Session = Depends(get_db),
+) -> tuple[int, int]:
+    # Checked before the session, so forged votes never reach the database
+    image_ids = pair_tokens.verify(pair_token, access_token)
+    if image_id not in image_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The image is not part of the pair.",
+        )
+    return image_ids
+
+
+async def _authenticate(
+    request: Request,
+    access_token: str,
+    db: Session,
+    loaders: Loaders,
+    read_only: bool = False,
 ) -> models.User:
     client_fingerprint = utils.generate_client_fingerprint(request)
     db_session = crud.verify_session(
         db=db,
         access_token=access_token,
         client_fingerprint=client_fingerprint,
+        read_only=read_only,
     )
     if db_session is None:
         raise HTTPException(
@@ -42,7 +148,8 @@ async def get_current_user(
             detail="Not authenticated.",
         )
 
-    db_user = crud.get_user_by_id(db=db, user_id=db_session.user_id)
+    # The user and its profile come together, off the event loop
+    db_user = await loaders.load_user(db_session.user_id)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -51,6 +158,26 @@ async def get_current_user(
     return db_user
 
 
+async def get_current_user(
+    request: Request,
+    access_token: str = Depends(get_access_token),
+    db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_primary_loaders),
+) -> models.User:
+    return await _authenticate(request, access_token, db, loaders)
+
+
+async def get_current_user_for_read(
+    request: Request,
+    access_token: str = Depends(get_access_token),
+    db: Session = Depends(get_read_db),
+    loaders: Loaders = Depends(get_loaders),
+) -> models.User:
+    return await _authenticate(
+        request, access_token, db, loaders, read_only=True
+    )
+
+
 async def get_admin_or_moderator(
     current_user: models.User = Depends(get_current_user),
 ) -> models.User:
@@ -63,3 +190,31 @@ async def get_admin_or_moderator(
             detail="Only admins and moderators can perform this action.",
         )
     return current_user
+
+
+def limit_votes(
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+) -> None:
+    # Not async, so FastAPI runs it in the threadpool, where waiting for
+    # the lock of the shared SQLite store blocks no other request
+    vote_rate_limit.check(current_user.id, utils.generate_client_key(request))
+
+
+async def get_voted_pair(
+    pair_token: str = Header(..., alias=PAIR_TOKEN_HEADER),
+    access_token: str = Depends(get_access_token),
+    offered_pair: tuple[int, int] = Depends(get_offered_pair),
+    rate_limit: None = Depends(limit_votes),
+    db: Session = Depends(get_db),
+) -> tuple[int, int]:
+    # Used up only once the vote is let through, a vote turned away by the
+    # rate limit can be sent again with the same token
+    return pair_tokens.redeem(pair_token, access_token, db)
+
+
+def limit_uploads(
+    request: Request,
+    current_user: models.User = Depends(get_admin_or_moderator),
+) -> None:
+    upload_rate_limit.check(current_user.id, utils.generate_client_key(request))
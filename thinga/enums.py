@@ -11,3 +11,10 @@ class SessionStatus(StrEnum):
     ACTIVE = auto()
     INACTIVE = auto()
     EXPIRED = auto()
+
+
+class JobStatus(StrEnum):
+    QUEUED = auto()
+    RUNNING = auto()
+    SUCCEEDED = auto()
+    FAILED = auto()
@@ -0,0 +1,140 @@
+import io
+import csv
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import DateTime, Integer, Row, Select, Table, select
+from sqlalchemy.engine import Connection
+
+from thinga import models
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet is optional, CSV needs nothing extra
+    pyarrow = None
+
+EXPORT_TABLES = {
+    "ratings": models.Rating.__table__,
+    "images": models.Image.__table__,
+}
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Rows held in memory at once, and the size of each Parquet row group
+EXPORT_BATCH_SIZE = 10000
+
+
+def select_rows(
+    table: Table,
+    *,
+    after_id: int = 0,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Select:
+    # Walking the primary key lets an export resume from the last id written
+    statement = select(table).where(table.c.id > after_id).order_by(table.c.id)
+    if since is not None:
+        statement = statement.where(table.c.created_at >= since)
+    if until is not None:
+        statement = statement.where(table.c.created_at < until)
+    return statement.limit(limit)
+
+
+def iter_batches(
+    connection: Connection,
+    statement: Select,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[list[Row]]:
+    # A server-side cursor where the driver has them, so rows are fetched
+    # a batch at a time instead of all at once
+    result = connection.execute(
+        statement.execution_options(yield_per=batch_size)
+    )
+    yield from result.partitions()
+
+
+def csv_chunks(table: Table, batches: Iterable[list[Row]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table.columns.keys())
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # Only the header, nothing matched
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file whose contents are taken out as they come."""
+
+    def __init__(self) -> None:
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_type(column_type) -> "pyarrow.DataType":
+    if isinstance(column_type, Integer):
+        return pyarrow.int64()
+    elif isinstance(column_type, DateTime):
+        return pyarrow.timestamp("us")
+    return pyarrow.string()
+
+
+def parquet_chunks(
+    table: Table,
+    batches: Iterable[list[Row]],
+) -> Iterator[bytes]:
+    if pyarrow is None:
+        raise RuntimeError("Parquet exports need `pyarrow` installed.")
+
+    schema = pyarrow.schema(
+        (column.name, _arrow_type(column.type)) for column in table.columns
+    )
+    sink = _ChunkSink()
+    with pyarrow.parquet.ParquetWriter(
+        sink, schema, compression="zstd"
+    ) as writer:
+        for batch in batches:
+            # Each batch is written out as a row group of its own
+            writer.write_table(
+                pyarrow.Table.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(zip(*batch), schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            yield sink.take()
+    yield sink.take()  # The footer
+
+
+def export_chunks(
+    table: Table,
+    batches: Iterable[list[Row]],
+    file_format: str,
+) -> Iterator[bytes]:
+    if file_format == "parquet":
+        return parquet_chunks(table, batches)
+    return csv_chunks(table, batches)
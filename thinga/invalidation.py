@@ -0,0 +1,335 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Protocol
+
+from sqlalchemy.engine import Engine
+
+from thinga import metrics
+
+logger = logging.getLogger(__name__)
+
+POSTGRESQL_CHANNEL = "thinga_invalidation"
+RECONNECT_DELAY_SECONDS = 1.0
+# Socket paths hold 104 bytes on macOS and 108 on Linux, the null included
+MAX_SOCKET_PATH_BYTES = 103
+# Workers started since the last look are found within this long
+PEER_REFRESH_SECONDS = 1.0
+
+
+class Transport(Protocol):
+    """Carries the events of one worker to the others."""
+
+    name: str
+
+    def send(self, payload: str) -> None: ...
+
+    async def start(
+        self,
+        receive: Callable[[str], None],
+        reset: Callable[[], None],
+    ) -> None: ...
+
+    async def stop(self) -> None: ...
+
+
+class SocketTransport:
+    """Datagrams between the workers of one host, a socket per worker."""
+
+    name = "socket"
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex[:8]}.sock")
+        if len(os.fsencode(self.path)) > MAX_SOCKET_PATH_BYTES:
+            raise ValueError(
+                f"The socket directory `{directory}` is too long, Unix "
+                f"socket paths take {MAX_SOCKET_PATH_BYTES} bytes at most."
+            )
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._peers = []
+        self._peers_listed_at = None
+
+    def _list_peers(self) -> list[str]:
+        now = time.monotonic()
+        if (
+            self._peers_listed_at is None
+            or now - self._peers_listed_at >= PEER_REFRESH_SECONDS
+        ):
+            self._peers = [
+                path
+                for path in (
+                    os.path.join(self.directory, file_name)
+                    for file_name in os.listdir(self.directory)
+                    if file_name.endswith(".sock")
+                )
+                if path != self.path
+            ]
+            self._peers_listed_at = now
+        return self._peers
+
+    def send(self, payload: str) -> None:
+        data = payload.encode()
+        for path in self._list_peers():
+            try:
+                self._socket.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that is gone
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._peers_listed_at = None
+            except BlockingIOError:
+                metrics.cache_invalidations_dropped.inc(self.name)
+
+    async def start(
+        self,
+        receive: Callable[[str], None],
+        reset: Callable[[], None],
+    ) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._socket.bind(self.path)
+
+        def on_readable() -> None:
+            while True:
+                try:
+                    data = self._socket.recv(65536)
+                except BlockingIOError:
+                    return None
+                receive(data.decode())
+
+        asyncio.get_running_loop().add_reader(
+            self._socket.fileno(), on_readable
+        )
+
+    async def stop(self) -> None:
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class PostgreSQLTransport:
+    """`LISTEN`/`NOTIFY` on the primary, for workers on any number of hosts.
+
+    Both connections are taken out of the engine's pool for good, they
+    stay open as long as the worker does. Events are sent from a thread of
+    their own, in order, so publishing never waits on the database.
+    """
+
+    name = "postgresql"
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self._notify_connection = None
+        self._notify_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="invalidation-notify"
+        )
+        self._task = None
+
+    def _connect(self):
+        """A connection of the driver, no longer known to the pool."""
+        connection = self.engine.raw_connection()
+        driver_connection = connection.driver_connection
+        # Leaves the pool without its reference to the driver's connection
+        connection.detach()
+        driver_connection.autocommit = True
+        return driver_connection
+
+    def send(self, payload: str) -> None:
+        self._notify_executor.submit(self._notify, payload)
+
+    def _notify(self, payload: str) -> None:
+        try:
+            if self._notify_connection is None:
+                self._notify_connection = self._connect()
+            cursor = self._notify_connection.cursor()
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", (POSTGRESQL_CHANNEL, payload)
+            )
+            cursor.close()
+        except self.engine.dialect.loaded_dbapi.Error:
+            metrics.cache_invalidations_dropped.inc(self.name)
+            self._notify_connection = None  # Reconnects on the next event
+
+    async def _listen(
+        self,
+        receive: Callable[[str], None],
+        reset: Callable[[], None],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                driver_connection = await asyncio.to_thread(self._connect)
+                cursor = driver_connection.cursor()
+                cursor.execute(f"LISTEN {POSTGRESQL_CHANNEL}")
+                cursor.close()
+            except self.engine.dialect.loaded_dbapi.Error:
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+                continue
+
+            # Events sent while this worker was not listening are lost
+            reset()
+            readable = asyncio.Event()
+            loop.add_reader(driver_connection.fileno(), readable.set)
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    driver_connection.poll()
+                    while driver_connection.notifies:
+                        receive(driver_connection.notifies.pop(0).payload)
+            except self.engine.dialect.loaded_dbapi.Error:
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+            finally:
+                loop.remove_reader(driver_connection.fileno())
+                driver_connection.close()
+
+    async def start(
+        self,
+        receive: Callable[[str], None],
+        reset: Callable[[], None],
+    ) -> None:
+        self._task = asyncio.create_task(self._listen(receive, reset))
+        self._task.add_done_callback(self._report_stopped)
+
+    def _report_stopped(self, task: asyncio.Task) -> None:
+        # Only database errors are retried, anything else ends listening
+        if not task.cancelled() and task.exception() is not None:
+            metrics.cache_invalidation_listener_failures.inc(self.name)
+            logger.error(
+                "Stopped listening for cache invalidations, caches of this "
+                "worker may go stale.",
+                exc_info=task.exception(),
+            )
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        # A listener that failed was reported when it stopped
+        await asyncio.gather(self._task, return_exceptions=True)
+        # Lets the events still queued go out first
+        await asyncio.to_thread(self._notify_executor.shutdown)
+        if self._notify_connection is not None:
+            self._notify_connection.close()
+
+
+class InvalidationBus:
+    """Tells every worker's caches about writes made by any of them.
+
+    Subscribers of a topic are called with the key that changed, or `None`
+    when anything under the topic may have.
+    """
+
+    def __init__(self) -> None:
+        self.origin = uuid.uuid4().hex[:8]
+        self._versions = itertools.count(1)
+        # Origin -> the last version received from it, to spot lost events
+        self._last_versions = {}
+        self._subscribers = {}
+        self.transport: Optional[Transport] = None
+
+    def subscribe(
+        self,
+        topic: str,
+        callback: Callable[[Optional[str]], None],
+    ) -> None:
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def _invalidate(self, topic: str, key: Optional[str]) -> None:
+        for callback in self._subscribers.get(topic, ()):
+            callback(key)
+
+    def _invalidate_all(self) -> None:
+        for topic in self._subscribers:
+            self._invalidate(topic, None)
+
+    def publish(self, topic: str, key: Optional[str] = None) -> None:
+        metrics.cache_invalidations_published.inc(topic)
+        self._invalidate(topic, key)
+        if self.transport is not None:
+            self.transport.send(
+                json.dumps(
+                    {
+                        "origin": self.origin,
+                        "version": next(self._versions),
+                        "topic": topic,
+                        "key": key,
+                        "sent_at": time.time(),
+                    }
+                )
+            )
+
+    def receive(self, payload: str) -> None:
+        event = json.loads(payload)
+        if event["origin"] == self.origin:
+            return None  # `NOTIFY` reaches its own sender too
+
+        last_version = self._last_versions.get(event["origin"])
+        if last_version is not None and event["version"] <= last_version:
+            return None
+        self._last_versions[event["origin"]] = event["version"]
+        if last_version is not None and event["version"] > last_version + 1:
+            # Some events never arrived, so no cached entry can be trusted
+            metrics.cache_invalidation_gaps.inc()
+            self._invalidate_all()
+        else:
+            self._invalidate(event["topic"], event["key"])
+
+        metrics.cache_invalidations_received.inc(event["topic"])
+        metrics.cache_invalidation_propagation.observe(
+            max(time.time() - event["sent_at"], 0), self.transport.name
+        )
+
+    async def start(self, transport: Optional[Transport]) -> None:
+        if transport is None:
+            return None  # A single worker, its caches are invalidated locally
+        await transport.start(self.receive, self._invalidate_all)
+        self.transport = transport
+
+    async def stop(self) -> None:
+        if self.transport is not None:
+            await self.transport.stop()
+            self.transport = None
+
+
+def create_transport(
+    kind: str,
+    *,
+    engine: Engine,
+    socket_dir: str,
+    external_pooler: bool = False,
+) -> Optional[Transport]:
+    if kind == "postgresql":
+        if external_pooler:
+            # Transaction poolers hand `LISTEN` to a server connection that
+            # goes back to the pool, nothing is ever delivered to it
+            raise ValueError(
+                "INVALIDATION_BUS=postgresql cannot listen through an "
+                "external pooler, use `socket` or connect to PostgreSQL."
+            )
+        elif (engine.dialect.name, engine.dialect.driver) != (
+            "postgresql",
+            "psycopg2",
+        ):
+            raise ValueError(
+                "INVALIDATION_BUS=postgresql needs a `postgresql+psycopg2` "
+                f"database, not `{engine.dialect.name}+"
+                f"{engine.dialect.driver}`."
+            )
+        return PostgreSQLTransport(engine)
+    elif kind == "socket":
+        return SocketTransport(socket_dir)
+    return None
+
+
+bus = InvalidationBus()
@@ -0,0 +1,288 @@
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, NamedTuple, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from thinga import models, enums, metrics, utils
+from thinga.database import SessionLocal
+from thinga.cache import image_listing_version
+from thinga.invalidation import bus
+from thinga.storage import GALLERY, storage
+from thinga.config import JOB_LEASE_SECONDS
+
+MAX_RETRY_DELAY_SECONDS = 600
+
+
+class JobKind(NamedTuple):
+    function: Callable[[Session, dict], None]
+    # Jobs of this kind one worker runs at the same time
+    concurrency: int
+    max_attempts: int
+
+
+job_kinds: dict[str, JobKind] = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a job that would fail the same way on every attempt."""
+
+
+def register(
+    kind: str,
+    *,
+    concurrency: int = 1,
+    max_attempts: int = 5,
+) -> Callable:
+    def decorator(function: Callable[[Session, dict], None]) -> Callable:
+        job_kinds[kind] = JobKind(function, concurrency, max_attempts)
+        return function
+
+    return decorator
+
+
+def enqueue(
+    *,
+    db: Session,
+    kind: str,
+    payload: Optional[dict[str, Any]] = None,
+    priority: int = 0,
+    delay_seconds: float = 0,
+) -> models.Job:
+    """Queues a job, committing it along with whatever the session holds."""
+    db_job = models.Job(
+        kind=kind,
+        payload=payload,
+        priority=priority,
+        max_attempts=job_kinds[kind].max_attempts,
+        run_at=datetime.now(timezone.utc) + timedelta(seconds=delay_seconds),
+    )
+    db.add(db_job)
+    db.commit()
+    return db_job
+
+
+def claim_job(
+    *,
+    db: Session,
+    kinds: list[str],
+    worker_id: str,
+) -> Optional[models.Job]:
+    """Takes the most urgent due job of the kinds, leasing it for a while.
+
+    Workers skip rows others have locked on PostgreSQL. SQLite runs one
+    writer at a time instead, and a claim only succeeds if the job is
+    still due when it is updated, so no job is ever taken twice. A job
+    whose lease ran out on its last attempt, likely by taking its worker
+    down, is failed instead of being run again.
+    """
+    while True:
+        now = datetime.now(timezone.utc)
+        candidate = db.execute(
+            select(
+                models.Job.id,
+                models.Job.kind,
+                models.Job.run_at,
+                models.Job.attempts,
+                models.Job.max_attempts,
+            )
+            .where(
+                models.PENDING_JOBS,
+                models.Job.run_at <= now,
+                models.Job.kind.in_(kinds),
+            )
+            .order_by(models.Job.priority.desc(), models.Job.run_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if candidate is None:
+            db.rollback()
+            return None
+
+        due_job = update(models.Job).where(
+            models.Job.id == candidate.id,
+            models.PENDING_JOBS,
+            models.Job.run_at <= now,
+        )
+        if candidate.attempts < candidate.max_attempts:
+            break
+        db.execute(
+            due_job.values(
+                status=enums.JobStatus.FAILED,
+                finished_at=now,
+                last_error="The lease ran out on the last attempt.",
+                locked_by=None,
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        metrics.jobs_processed.inc(candidate.kind, enums.JobStatus.FAILED)
+
+    claimed_count = db.execute(
+        due_job.values(
+            status=enums.JobStatus.RUNNING,
+            attempts=models.Job.attempts + 1,
+            started_at=now,
+            run_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            locked_by=worker_id,
+        ),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.commit()
+    if not claimed_count:
+        return None  # Another worker took it first
+
+    db_job = db.get(models.Job, candidate.id)
+    metrics.job_queue_latency.observe(
+        (now - candidate.run_at.replace(tzinfo=timezone.utc)).total_seconds(),
+        candidate.kind,
+    )
+    return db_job
+
+
+def run_job(*, db: Session, db_job: models.Job) -> None:
+    """Runs a claimed job, then records how it went while still leased.
+
+    A job outliving its lease may have been claimed again, in which case
+    the worker holding it now records the outcome instead.
+    """
+    job_id, kind, attempts, max_attempts, lease_holder = (
+        db_job.id,
+        db_job.kind,
+        db_job.attempts,
+        db_job.max_attempts,
+        db_job.locked_by,
+    )
+    started_at = time.perf_counter()
+    outcome = {"locked_by": None}
+    try:
+        job_kinds[kind].function(db, db_job.payload or {})
+    except Exception as e:
+        db.rollback()
+        now = datetime.now(timezone.utc)
+        outcome["last_error"] = f"{type(e).__name__}: {e}"[:500]
+        if attempts < max_attempts and not isinstance(e, PermanentJobError):
+            # Backs off exponentially between attempts
+            outcome["status"] = enums.JobStatus.QUEUED
+            outcome["run_at"] = now + timedelta(
+                seconds=min(2**attempts, MAX_RETRY_DELAY_SECONDS)
+            )
+        else:
+            outcome["status"] = enums.JobStatus.FAILED
+            outcome["finished_at"] = now
+    else:
+        outcome["status"] = enums.JobStatus.SUCCEEDED
+        outcome["finished_at"] = datetime.now(timezone.utc)
+    recorded_count = db.execute(
+        update(models.Job)
+        .where(
+            models.Job.id == job_id,
+            models.Job.status == enums.JobStatus.RUNNING,
+            models.Job.locked_by == lease_holder,
+            models.Job.attempts == attempts,
+        )
+        .values(**outcome)
+    ).rowcount
+    db.commit()
+    if not recorded_count:
+        return None  # The lease was lost
+
+    metrics.job_duration.observe(time.perf_counter() - started_at, kind)
+    metrics.jobs_processed.inc(kind, outcome["status"])
+
+
+def get_job_by_id(*, db: Session, job_id: int) -> Optional[models.Job]:
+    return db.get(models.Job, job_id)
+
+
+def get_queue_stats(*, db: Session) -> list:
+    return (
+        db.query(
+            models.Job.kind,
+            models.Job.status,
+            func.count(models.Job.id).label("count"),
+            func.min(models.Job.run_at).label("oldest_run_at"),
+        )
+        .group_by(models.Job.kind, models.Job.status)
+        .order_by(models.Job.kind, models.Job.status)
+        .all()
+    )
+
+
+async def run_job_worker(
+    *,
+    concurrency: int,
+    poll_interval_seconds: float,
+) -> None:
+    """Runs jobs in threads of this process, at most `concurrency` at once."""
+    worker_id = uuid.uuid4().hex[:8]
+    slots = asyncio.Semaphore(concurrency)
+    running = {kind: 0 for kind in job_kinds}
+    tasks = set()
+
+    def claim(kinds: list[str]) -> Optional[models.Job]:
+        with SessionLocal() as db:
+            return claim_job(db=db, kinds=kinds, worker_id=worker_id)
+
+    def run(db_job: models.Job) -> None:
+        with SessionLocal() as db:
+            run_job(db=db, db_job=db.merge(db_job, load=False))
+
+    def finish(task: asyncio.Task, kind: str) -> None:
+        tasks.discard(task)
+        running[kind] -= 1
+        slots.release()
+
+    while True:
+        await slots.acquire()
+        kinds = [
+            kind
+            for kind, job_kind in job_kinds.items()
+            if running[kind] < job_kind.concurrency
+        ]
+        try:
+            db_job = await asyncio.to_thread(claim, kinds) if kinds else None
+        except Exception:
+            db_job = None  # The database is away, try again later
+        if db_job is None:
+            slots.release()
+            await asyncio.sleep(poll_interval_seconds)
+            continue
+
+        running[db_job.kind] += 1
+        task = asyncio.create_task(asyncio.to_thread(run, db_job))
+        tasks.add(task)
+        task.add_done_callback(
+            lambda task, kind=db_job.kind: finish(task, kind)
+        )
+
+
+@register("image_metadata", concurrency=2)
+def fill_image_metadata(db: Session, payload: dict) -> None:
+    """Reads the size and BlurHash of an image uploaded straight to storage.
+
+    A file that does not decode as an image is deleted with its image.
+    """
+    db_image = db.get(models.Image, payload["image_id"])
+    if db_image is None or db_image.deleted_at is not None:
+        return None  # Deleted since
+    metadata = utils.read_image_metadata(
+        storage.read(GALLERY, db_image.media_file)
+    )
+    if metadata == utils.ImageMetadata():
+        # The cleanup worker purges the row and its file
+        db_image.deleted_at = datetime.now(timezone.utc)
+        image_listing_version.bump(db)
+        db.commit()
+        bus.publish("images")
+        raise PermanentJobError(
+            f"`{db_image.media_file}` is not an image, so it was deleted."
+        )
+    for name, value in metadata._asdict().items():
+        setattr(db_image, name, value)
+    image_listing_version.bump(db)
+    db.commit()
+    bus.publish("images")
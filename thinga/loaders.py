@@ -0,0 +1,117 @@
+import asyncio
+from typing import Any, Iterable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, InstrumentedAttribute
+from sqlalchemy.orm.attributes import set_committed_value
+
+from thinga import models
+
+# Keeps `IN (...)` lists under the bound parameter limits of databases
+MAX_BATCH_SIZE = 500
+
+
+class Loader:
+    """Coalesces lookups made in the same event loop turn into one query.
+
+    Queries run in the threadpool, one at a time per `lock`, as loaders
+    sharing a session must not use it from two threads at once.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        lock: asyncio.Lock,
+        key_column: InstrumentedAttribute,
+        *criteria: Any,
+    ) -> None:
+        self.db = db
+        self.lock = lock
+        self.key_column = key_column
+        self.criteria = criteria
+        # Key -> future of the row, so each key is only ever queried once
+        self._cache = {}
+        self._pending_keys = []
+        self._dispatches = set()
+
+    def load(self, key: Any) -> asyncio.Future:
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[key] = loop.create_future()
+            if not self._pending_keys:
+                # Starts once every caller of this turn queued its key
+                dispatch = loop.create_task(self._dispatch())
+                self._dispatches.add(dispatch)
+                dispatch.add_done_callback(self._dispatches.discard)
+            self._pending_keys.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable[Any]) -> list[Optional[Any]]:
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _query(self, keys: list[Any]) -> list[tuple[list[Any], Any]]:
+        """Each batch of keys with its rows, or the error reading them."""
+        model = self.key_column.class_
+        results = []
+        for start in range(0, len(keys), MAX_BATCH_SIZE):
+            batch = keys[start : start + MAX_BATCH_SIZE]
+            try:
+                rows = (
+                    self.db.query(model)
+                    .filter(self.key_column.in_(batch), *self.criteria)
+                    .all()
+                )
+            except Exception as e:
+                results.append((batch, e))
+                continue
+            results.append(
+                (
+                    batch,
+                    {getattr(row, self.key_column.key): row for row in rows},
+                )
+            )
+        return results
+
+    async def _dispatch(self) -> None:
+        async with self.lock:
+            # Keys queued while waiting for the lock come along
+            keys, self._pending_keys = self._pending_keys, []
+            results = await run_in_threadpool(self._query, keys)
+        for batch, found in results:
+            for key in batch:
+                if isinstance(found, Exception):
+                    if not self._cache[key].done():
+                        self._cache[key].set_exception(found)
+                    # A later call may try again
+                    del self._cache[key]
+                elif not self._cache[key].done():
+                    self._cache[key].set_result(found.get(key))
+
+
+class Loaders:
+    """The loaders of a single request, sharing its session."""
+
+    def __init__(self, db: Session) -> None:
+        lock = asyncio.Lock()
+        self.images = Loader(db, lock, models.Image.id, models.LIVE_IMAGES)
+        self.users = Loader(db, lock, models.User.id)
+        self.profiles = Loader(db, lock, models.Profile.user_id)
+
+    async def load_user(self, user_id: int) -> Optional[models.User]:
+        """A user along with its profile, both looked up in one turn."""
+        db_user, db_profile = await asyncio.gather(
+            self.users.load(user_id), self.profiles.load(user_id)
+        )
+        if db_user is not None:
+            set_committed_value(db_user, "profile", db_profile)
+        return db_user
+
+    async def load_profile(self, db_user: models.User) -> models.User:
+        """Reads the profile of a user looked up some other way.
+
+        Serializing the user then does not lazy-load it on the event loop.
+        """
+        db_profile = await self.profiles.load(db_user.id)
+        set_committed_value(db_user, "profile", db_profile)
+        return db_user
@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
@@ -5,17 +7,88 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from thinga.database import Base, engine
-from thinga.routers import user_management, image_comparison
-from thinga.config import ALLOWED_ORIGINS, MEDIA_STORAGE_PATH
+from thinga import metrics, cleanup, invalidation, jobs, partitions
+from thinga.cache import image_listing_version
+from thinga.pair_tokens import PAIR_TOKEN_HEADER
+from thinga.database import Base, engine, engine_names, replicas
+from thinga.middleware import CompressionMiddleware, ConditionalGetMiddleware
+from thinga.profiling import RequestProfilerMiddleware
+from thinga.routers import (
+    user_management,
+    image_comparison,
+    categories,
+    exports,
+    jobs as job_queue,
+    monitoring,
+    uploads,
+)
+from thinga.config import (
+    ALLOWED_ORIGINS,
+    MEDIA_STORAGE_PATH,
+    STORAGE_BACKEND,
+    COMPRESSION_MINIMUM_SIZE_BYTES,
+    PROFILED_ROUTE,
+    PROFILE_EVERY_N_REQUESTS,
+    IMAGE_CLEANUP_INTERVAL_SECONDS,
+    IMAGE_PURGE_DELAY_SECONDS,
+    INVALIDATION_BUS,
+    INVALIDATION_SOCKET_DIR,
+    DATABASE_EXTERNAL_POOLER,
+    JOB_WORKER_CONCURRENCY,
+    JOB_POLL_INTERVAL_SECONDS,
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     Base.metadata.create_all(bind=engine)
+    await invalidation.bus.start(
+        invalidation.create_transport(
+            INVALIDATION_BUS,
+            engine=engine,
+            socket_dir=INVALIDATION_SOCKET_DIR,
+            external_pooler=DATABASE_EXTERNAL_POOLER,
+        )
+    )
+    cleanup_task = None
+    if IMAGE_CLEANUP_INTERVAL_SECONDS > 0:
+        cleanup_task = asyncio.create_task(
+            cleanup.run_cleanup_worker(
+                interval_seconds=IMAGE_CLEANUP_INTERVAL_SECONDS,
+                purge_delay_seconds=IMAGE_PURGE_DELAY_SECONDS,
+            )
+        )
+    job_task = None
+    if JOB_WORKER_CONCURRENCY > 0:
+        job_task = asyncio.create_task(
+            jobs.run_job_worker(
+                concurrency=JOB_WORKER_CONCURRENCY,
+                poll_interval_seconds=JOB_POLL_INTERVAL_SECONDS,
+            )
+        )
+    replica_task = None
+    if replicas.engines:
+        replica_task = asyncio.create_task(replicas.run_health_checks())
+    partition_task = None
+    if engine.dialect.name == "postgresql":
+        partition_task = asyncio.create_task(
+            partitions.run_partition_worker(
+                interval_seconds=PARTITION_MAINTENANCE_INTERVAL_SECONDS
+            )
+        )
     yield
+    for task in (cleanup_task, job_task, replica_task, partition_task):
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    await invalidation.bus.stop()
 
 
+for db_engine, engine_name in engine_names.items():
+    metrics.instrument_engine(db_engine, engine_name)
+
 app = FastAPI(
     title="Thinga",
     summary="Compare and rate.",
@@ -23,19 +96,42 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+if PROFILED_ROUTE:
+    app.add_middleware(
+        RequestProfilerMiddleware,
+        route=PROFILED_ROUTE,
+        every_n_requests=PROFILE_EVERY_N_REQUESTS,
+    )
+app.add_middleware(
+    ConditionalGetMiddleware,
+    paths=("/images/", "/images/top-ranked/"),
+    version=image_listing_version,
+)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MINIMUM_SIZE_BYTES,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
     allow_credentials=True,
+    expose_headers=[PAIR_TOKEN_HEADER],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
-app.mount(
-    "/media",
-    StaticFiles(directory=MEDIA_STORAGE_PATH),
-    name="media",
-)
+if STORAGE_BACKEND == "local":
+    app.mount(
+        "/media",
+        StaticFiles(directory=MEDIA_STORAGE_PATH),
+        name="media",
+    )
 
 app.include_router(user_management.router, tags=["User Management"])
 app.include_router(image_comparison.router, tags=["Images and Ratings"])
+app.include_router(categories.router, tags=["Categories"])
+app.include_router(exports.router, tags=["Exports"])
+app.include_router(job_queue.router, tags=["Jobs"])
+app.include_router(monitoring.router, tags=["Monitoring"])
+app.include_router(uploads.router, tags=["Uploads"])
@@ -0,0 +1,448 @@
+import time
+import bisect
+import threading
+from typing import Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+SIZE_BUCKETS = (
+    128, 512, 1024, 4096, 16384, 65536,
+    262144, 1048576, 4194304, 16777216,
+)  # fmt: skip
+THROUGHPUT_BUCKETS = (
+    1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9,
+)  # fmt: skip
+
+
+def _format_labels(label_names: tuple[str, ...], labels: tuple) -> str:
+    if not label_names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(34), chr(39))}"'
+        for name, value in zip(label_names, labels)
+    )
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}
+        # Threadpool and job threads update metrics too, `+=` is not atomic
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield (
+                f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+            )
+
+
+class Gauge:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...],
+        read_values: Callable[[], dict[tuple, float]],
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.read_values = read_values
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.read_values().items():
+            yield (
+                f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+            )
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per label set: a count for every bucket plus +Inf, then the sum
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [*self.buckets, "+Inf"]
+        label_names = (*self.label_names, "le")
+        # Copies, so the count and sum of each label set agree
+        with self._lock:
+            values = [
+                (labels, list(counts)) for labels, counts in self.values.items()
+            ]
+        for labels, counts in values:
+            cumulative_count = 0
+            for bound, count in zip(bounds, counts):
+                cumulative_count += count
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_format_labels(label_names, (*labels, bound))} "
+                    f"{cumulative_count}"
+                )
+            formatted_labels = _format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{formatted_labels} {counts[-1]}"
+            yield f"{self.name}_count{formatted_labels} {cumulative_count}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return (
+            "\n".join(
+                line for metric in self.metrics for line in metric.collect()
+            )
+            + "\n"
+        )
+
+
+registry = Registry()
+
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time spent serving HTTP requests.",
+        ("method", "route", "status"),
+    )
+)
+http_request_size = registry.register(
+    Histogram(
+        "http_request_size_bytes",
+        "Size of HTTP request bodies.",
+        ("route",),
+        SIZE_BUCKETS,
+    )
+)
+http_response_size = registry.register(
+    Histogram(
+        "http_response_size_bytes",
+        "Size of HTTP response bodies.",
+        ("route",),
+        SIZE_BUCKETS,
+    )
+)
+db_pool_checkout_wait = registry.register(
+    Histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a connection from the pool.",
+        ("engine",),
+    )
+)
+db_pool_checkout_timeouts = registry.register(
+    Counter(
+        "db_pool_checkout_timeouts_total",
+        "Requests turned away after waiting too long for a connection.",
+        ("engine",),
+    )
+)
+db_statement_duration = registry.register(
+    Histogram(
+        "db_statement_duration_seconds",
+        "Time spent executing SQL statements.",
+        ("operation",),
+    )
+)
+db_read_routing = registry.register(
+    Counter(
+        "db_reads_routed_total",
+        "Sessions handed to read-only endpoints by the engine serving them.",
+        ("target",),
+    )
+)
+image_upload_bytes = registry.register(
+    Counter(
+        "image_upload_bytes_total",
+        "Bytes of uploaded image files written to storage.",
+    )
+)
+image_upload_throughput = registry.register(
+    Histogram(
+        "image_upload_throughput_bytes_per_second",
+        "Write speed of each uploaded image file.",
+        buckets=THROUGHPUT_BUCKETS,
+    )
+)
+images_purged = registry.register(
+    Counter(
+        "images_purged_total",
+        "Deleted images removed from the database with their ratings.",
+    )
+)
+image_files_removed = registry.register(
+    Counter(
+        "image_files_removed_total",
+        "Gallery files unlinked after their images were purged or orphaned.",
+    )
+)
+image_files_reclaimed_bytes = registry.register(
+    Counter(
+        "image_files_reclaimed_bytes_total",
+        "Bytes of storage freed by unlinking gallery files.",
+    )
+)
+image_cleanup_failures = registry.register(
+    Counter(
+        "image_cleanup_failures_total",
+        "Rounds of the image cleanup worker that stopped on an error.",
+    )
+)
+rating_partitions_created = registry.register(
+    Counter(
+        "rating_partitions_created_total",
+        "Monthly partitions of ratings made ahead of their votes.",
+    )
+)
+rating_partitions_detached = registry.register(
+    Counter(
+        "rating_partitions_detached_total",
+        "Monthly partitions of ratings detached past their retention.",
+    )
+)
+partition_maintenance_failures = registry.register(
+    Counter(
+        "partition_maintenance_failures_total",
+        "Rounds of the partition worker that stopped on an error.",
+    )
+)
+cache_invalidations_published = registry.register(
+    Counter(
+        "cache_invalidations_published_total",
+        "Writes announced to the caches of every worker.",
+        ("topic",),
+    )
+)
+cache_invalidations_received = registry.register(
+    Counter(
+        "cache_invalidations_received_total",
+        "Writes of other workers this worker's caches heard of.",
+        ("topic",),
+    )
+)
+cache_invalidations_dropped = registry.register(
+    Counter(
+        "cache_invalidations_dropped_total",
+        "Invalidation events that could not be sent.",
+        ("transport",),
+    )
+)
+cache_invalidation_listener_failures = registry.register(
+    Counter(
+        "cache_invalidation_listener_failures_total",
+        "Times a worker stopped hearing of other workers' writes.",
+        ("transport",),
+    )
+)
+cache_invalidation_gaps = registry.register(
+    Counter(
+        "cache_invalidation_gaps_total",
+        "Lost events noticed by version, each clearing every cache.",
+    )
+)
+cache_invalidation_propagation = registry.register(
+    Histogram(
+        "cache_invalidation_propagation_seconds",
+        "Time from publishing an invalidation to another worker receiving it.",
+        ("transport",),
+    )
+)
+vote_batch_size = registry.register(
+    Histogram(
+        "vote_batch_size",
+        "Votes of WebSocket clients committed in each transaction.",
+        buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+    )
+)
+vote_batch_failures = registry.register(
+    Counter(
+        "vote_batch_failures_total",
+        "Batches of WebSocket votes the database failed to commit.",
+    )
+)
+jobs_processed = registry.register(
+    Counter(
+        "jobs_processed_total",
+        "Attempts at background jobs by how they ended.",
+        ("kind", "status"),
+    )
+)
+job_duration = registry.register(
+    Histogram(
+        "job_duration_seconds",
+        "Time spent running background jobs.",
+        ("kind",),
+    )
+)
+job_queue_latency = registry.register(
+    Histogram(
+        "job_queue_latency_seconds",
+        "Time from a background job being due to a worker taking it.",
+        ("kind",),
+    )
+)
+password_hash_duration = registry.register(
+    Histogram(
+        "password_hash_duration_seconds",
+        "Time spent hashing or verifying passwords with bcrypt.",
+        ("operation",),
+    )
+)
+
+
+def _statement_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement else ""
+
+
+def pool_state(engine: Engine) -> dict[str, int]:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}  # Pools without queues, like `NullPool`, keep no state
+    return {
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "size": pool.size(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+
+# Name -> engine, for every engine passed to `instrument_engine`
+instrumented_engines = {}
+
+
+def _read_pool_states() -> dict[tuple, float]:
+    return {
+        (name, state): value
+        for name, engine in instrumented_engines.items()
+        for state, value in pool_state(engine).items()
+    }
+
+
+registry.register(
+    Gauge(
+        "db_pool_connections",
+        "Connections of the database pools by state.",
+        ("engine", "state"),
+        _read_pool_states,
+    )
+)
+registry.register(
+    Gauge(
+        "process_cpu_seconds",
+        "CPU time, user and system, used by this worker process so far.",
+        (),
+        lambda: {(): time.process_time()},
+    )
+)
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Times every statement and exposes the pool state of the engine."""
+    local = threading.local()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        local.started_at = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        db_statement_duration.observe(
+            time.perf_counter() - local.started_at,
+            _statement_operation(statement),
+        )
+
+    instrumented_engines[name] = engine
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return None
+
+        started_at = time.perf_counter()
+        status_code = 500
+        response_size = 0
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # Route templates keep the label set bounded, unlike raw paths
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(
+                time.perf_counter() - started_at,
+                scope["method"],
+                route,
+                status_code,
+            )
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    http_request_size.observe(int(value), route)
+                    break
+            http_response_size.observe(response_size, route)
@@ -0,0 +1,135 @@
+import gzip
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from thinga.cache import ListingVersion
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip covers every client
+    brotli = None
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {
+        encoding.split(";")[0].strip()
+        for encoding in accept_encoding.lower().split(",")
+    }
+    if brotli is not None and "br" in accepted:
+        return "br"
+    elif "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return None
+
+        encoding = _choose_encoding(
+            Headers(scope=scope).get("accept-encoding", "")
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return None
+
+        start_message = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return None
+            elif start_message is None:
+                await send(message)
+                return None
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            # Only whole JSON bodies are compressed, streams pass through
+            if (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and headers.get("content-type", "").startswith(
+                    "application/json"
+                )
+                and "content-encoding" not in headers
+            ):
+                body = _compress(body, encoding)
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+
+            await send(start_message)
+            start_message = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class ConditionalGetMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        paths: tuple[str, ...],
+        version: ListingVersion,
+    ) -> None:
+        self.app = app
+        self.paths = paths
+        self.version = version
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or scope["path"] not in self.paths
+            or scope["query_string"]
+        ):
+            await self.app(scope, receive, send)
+            return None
+
+        # Taken before the handler runs, so a concurrent write can only
+        # make the tag older than the body, never newer. That only holds
+        # for handlers reading the primary, replicas may be behind the tag
+        etag = await self.version.etag()
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [(b"etag", etag.encode("latin-1"))],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return None
+
+        async def send_with_etag(message: Message) -> None:
+            if message["type"] == "http.response.start" and (
+                message["status"] == 200
+            ):
+                headers = MutableHeaders(scope=message)
+                headers["etag"] = etag
+                headers["cache-control"] = "no-cache"
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
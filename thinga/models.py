@@ -2,16 +2,19 @@ import uuid
 from datetime import datetime, timedelta, timezone
 
 from sqlalchemy import (
+    JSON,
     Column,
     ForeignKey,
+    Index,
     Integer,
     String,
     Enum,
     DateTime,
+    Float,
 )
 from sqlalchemy.orm import relationship
 
-from thinga import enums
+from thinga import enums, partitions
 from thinga.database import Base
 from thinga.config import SESSION_EXPIRE_DAYS
 
@@ -43,6 +46,17 @@ class Profile(Base):
     user = relationship("User", back_populates="profile")
 
 
+class Category(Base):
+    __tablename__ = "categories"
+
+    id = Column(Integer, primary_key=True, index=True)
+    slug = Column(String(50), unique=True, nullable=False)
+    name = Column(String(100), nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    images = relationship("Image", back_populates="category")
+
+
 class Image(Base):
     __tablename__ = "images"
 
@@ -51,20 +65,116 @@ class Image(Base):
     alt_text = Column(String(250))
     score = Column(Integer, default=0)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    category_id = Column(Integer, ForeignKey("categories.id"))
+    width = Column(Integer)
+    height = Column(Integer)
+    blurhash = Column(String(32))
+    deleted_at = Column(DateTime)
+
+    ratings = relationship(
+        "Rating", back_populates="image", foreign_keys="Rating.image_id"
+    )
+    category = relationship("Category", back_populates="images")
+
+
+# Deleted images stay in the table until purged, hot paths skip them
+LIVE_IMAGES = Image.deleted_at.is_(None)
 
-    ratings = relationship("Rating", back_populates="image")
+# Leaderboards read the first rows of these instead of sorting
+Index(
+    "ix_images_score",
+    Image.score,
+    Image.id,
+    postgresql_where=LIVE_IMAGES,
+    sqlite_where=LIVE_IMAGES,
+)
+Index(
+    "ix_images_category_id_score",
+    Image.category_id,
+    Image.score,
+    Image.id,
+    postgresql_where=LIVE_IMAGES,
+    sqlite_where=LIVE_IMAGES,
+)
+# Random pairs of a category seek random ids along this one
+Index(
+    "ix_images_category_id_id",
+    Image.category_id,
+    Image.id,
+    postgresql_where=LIVE_IMAGES,
+    sqlite_where=LIVE_IMAGES,
+)
+# Only the few images waiting to be purged are in this one
+Index(
+    "ix_images_deleted_at",
+    Image.deleted_at,
+    postgresql_where=Image.deleted_at.is_not(None),
+    sqlite_where=Image.deleted_at.is_not(None),
+)
 
 
 class Rating(Base):
     __tablename__ = "ratings"
+    __table_args__ = (
+        # Recent votes per image are read from this alone
+        Index("ix_ratings_created_at_image_id", "created_at", "image_id"),
+        # A partition a month on PostgreSQL, kept by `thinga.partitions`
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    image_id = Column(Integer, ForeignKey("images.id"), nullable=False)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    image_id = Column(
+        Integer, ForeignKey("images.id"), nullable=False, index=True
+    )
+    # The other image of the pair, unknown for votes cast before pairs were
+    # signed
+    loser_image_id = Column(
+        Integer, ForeignKey("images.id", ondelete="SET NULL"), index=True
+    )
+    created_at = Column(
+        DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        info={partitions.PARTITION_KEY: True},
+    )
 
     user = relationship("User", back_populates="ratings")
-    image = relationship("Image", back_populates="ratings")
+    image = relationship(
+        "Image", back_populates="ratings", foreign_keys=[image_id]
+    )
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON)
+    status = Column(Enum(enums.JobStatus), default=enums.JobStatus.QUEUED)
+    priority = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    # When a queued job is due, or when the lease of a running one ends
+    run_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    last_error = Column(String(500))
+    locked_by = Column(String(32))
+
+
+# Jobs a worker may take, those left running past their lease included
+PENDING_JOBS = Job.status.in_([enums.JobStatus.QUEUED, enums.JobStatus.RUNNING])
+
+# Workers read the most urgent due job off the front of this
+Index(
+    "ix_jobs_due",
+    Job.priority.desc(),
+    Job.run_at,
+    postgresql_where=PENDING_JOBS,
+    sqlite_where=PENDING_JOBS,
+)
 
 
 class Session(Base):
@@ -91,3 +201,31 @@ class Session(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     user = relationship("User", back_populates="sessions")
+
+
+class UsedPairToken(Base):
+    __tablename__ = "used_pair_tokens"
+
+    # The signature of a redeemed pair token, so every worker refuses it
+    signature = Column(String(32), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class Sweep(Base):
+    __tablename__ = "sweeps"
+
+    # A periodic sweep one worker at a time runs, e.g. for orphaned files
+    name = Column(String(50), primary_key=True)
+    # Files modified up to this time, in seconds since the epoch, are done
+    swept_until = Column(Float, nullable=False, default=0)
+    # Other workers leave the sweep alone until then
+    claimed_until = Column(DateTime, nullable=False)
+
+
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+
+    # Counts the changes of what a cache holds, e.g. the image listings,
+    # so every worker tags the same state alike
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
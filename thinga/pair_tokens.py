@@ -0,0 +1,165 @@
+import os
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import binascii
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from thinga import models
+
+from thinga.config import PAIR_TOKEN_SIGNING_KEY, PAIR_TOKEN_MAX_AGE_SECONDS
+
+PAIR_TOKEN_HEADER = "X-Pair-Token"
+# Both image ids, a hash of the voter's access token, the issue time and a
+# nonce, so a pair served twice in a second still gets two tokens
+_PAYLOAD = struct.Struct(">QQ8sI4s")
+SIGNATURE_SIZE = 16
+
+
+def _session_binding(access_token: Optional[str]) -> bytes:
+    if access_token is None:
+        return bytes(8)  # Never matches the hash of a real token
+    return hashlib.sha256(access_token.encode()).digest()[:8]
+
+
+class PairTokens:
+    """Signs the pairs served to voters, so votes are checked in memory.
+
+    A token only counts for the session it was served to, once, and
+    within `max_age_seconds`. Used tokens are remembered by each worker
+    until they expire, and in the database for the others.
+    """
+
+    def __init__(
+        self,
+        signing_key: str,
+        max_age_seconds: int,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.signing_key = signing_key.encode()
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        # Signature -> when it expires, oldest first
+        self._used = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self.signing_key, payload, hashlib.sha256).digest()[
+            :SIGNATURE_SIZE
+        ]
+
+    def issue(
+        self,
+        image_ids: tuple[int, int],
+        access_token: Optional[str],
+    ) -> str:
+        payload = _PAYLOAD.pack(
+            *image_ids,
+            _session_binding(access_token),
+            int(self.clock()),
+            os.urandom(4),
+        )
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).decode()
+
+    def _open(
+        self,
+        token: str,
+        access_token: str,
+    ) -> tuple[tuple[int, int], bytes, float]:
+        """The pair, signature and expiry of a token, unless it is refused."""
+        try:
+            data = base64.urlsafe_b64decode(token)
+        except (binascii.Error, ValueError):
+            data = b""
+        payload, signature = data[: _PAYLOAD.size], data[_PAYLOAD.size :]
+        if len(payload) != _PAYLOAD.size or not hmac.compare_digest(
+            self._sign(payload), signature
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid pair token.",
+            )
+        *image_ids, session_binding, issued_at, _ = _PAYLOAD.unpack(payload)
+        if not hmac.compare_digest(
+            session_binding, _session_binding(access_token)
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid pair token.",
+            )
+
+        expires_at = issued_at + self.max_age_seconds
+        if expires_at <= self.clock():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The pair is too old, fetch a new one.",
+            )
+        return tuple(image_ids), signature, expires_at
+
+    def _check_unused(self, signature: bytes) -> None:
+        # Called with the lock held
+        now = self.clock()
+        while self._used:
+            _, oldest_expires_at = next(iter(self._used.items()))
+            if oldest_expires_at > now:
+                break
+            self._used.popitem(last=False)
+        if signature in self._used:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The pair was voted on already.",
+            )
+
+    def verify(self, token: str, access_token: str) -> tuple[int, int]:
+        """The pair of a token `redeem` would accept, without using it up."""
+        image_ids, signature, _ = self._open(token, access_token)
+        with self._lock:
+            self._check_unused(signature)
+        return image_ids
+
+    def redeem(
+        self,
+        token: str,
+        access_token: str,
+        db: Optional[Session] = None,
+    ) -> tuple[int, int]:
+        """The pair a vote is cast on, unless the token is refused.
+
+        With `db`, the token is marked used in the vote's transaction, so
+        other workers refuse it once that commits, and it is only used up
+        if the vote counts.
+        """
+        image_ids, signature, expires_at = self._open(token, access_token)
+        with self._lock:
+            self._check_unused(signature)
+        if db is not None:
+            try:
+                with db.begin_nested():
+                    db.add(
+                        models.UsedPairToken(
+                            signature=signature.hex(),
+                            expires_at=datetime.fromtimestamp(
+                                expires_at, timezone.utc
+                            ),
+                        )
+                    )
+            except IntegrityError:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="The pair was voted on already.",
+                )
+        with self._lock:
+            self._used[signature] = expires_at
+        return image_ids
+
+
+pair_tokens = PairTokens(PAIR_TOKEN_SIGNING_KEY, PAIR_TOKEN_MAX_AGE_SECONDS)
@@ -0,0 +1,299 @@
+import re
+import asyncio
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from sqlalchemy import PrimaryKeyConstraint, event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.compiler import compiles
+
+from thinga import metrics
+from thinga.database import Base, engine
+from thinga.config import (
+    RATING_PARTITIONS_AHEAD,
+    RATING_RETENTION_MONTHS,
+    RATING_ARCHIVE_SCHEMA,
+)
+
+PARTITIONED_TABLE = "ratings"
+# Marks the column a table is partitioned on, in the column's `info`
+PARTITION_KEY = "partition_key"
+# Any number, as long as nothing else takes the same advisory lock
+MAINTENANCE_LOCK_KEY = 7_413_902_651
+# Detaching locks out votes, so it gives up instead of queueing behind
+# long reads, and is tried again next round
+DETACH_LOCK_TIMEOUT = "5s"
+
+
+class PartitionReport(NamedTuple):
+    partitions_created: int = 0
+    partitions_detached: int = 0
+
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def compile_primary_key(
+    constraint: PrimaryKeyConstraint,
+    compiler,
+    **kwargs,
+) -> str:
+    # PostgreSQL only enforces keys of a partitioned table that hold its
+    # partition key, ids stay unique as they all come from one sequence
+    partition_key = [
+        column
+        for column in constraint.table.columns
+        if column.info.get(PARTITION_KEY)
+        and not constraint.contains_column(column)
+    ]
+    if not partition_key:
+        return compiler.visit_primary_key_constraint(constraint, **kwargs)
+    return "PRIMARY KEY ({})".format(
+        ", ".join(
+            compiler.preparer.quote(column.name)
+            for column in [*constraint.columns, *partition_key]
+        )
+    )
+
+
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    """The first moment of the month `months` after that of `moment`."""
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: datetime) -> str:
+    return f"{table_name}_{month:%Y_%m}"
+
+
+def default_partition_name(table_name: str) -> str:
+    return f"{table_name}_default"
+
+
+def expired_partitions(
+    table_name: str,
+    partition_names: list[str],
+    before: datetime,
+) -> list[str]:
+    """Those holding months before `before`, oldest first.
+
+    Partitions not named by `partition_name` are left alone.
+    """
+    pattern = re.compile(rf"{re.escape(table_name)}_(\d{{4}})_(\d{{2}})")
+    months = {}
+    for name in partition_names:
+        match = pattern.fullmatch(name)
+        if match is not None:
+            months[name] = datetime(int(match[1]), int(match[2]), 1)
+    return sorted(
+        (name for name, month in months.items() if month < before),
+        key=months.get,
+    )
+
+
+def is_partitioned(connection: Connection, table_name: str) -> bool:
+    # Tables made before partitioning stay plain until moved over by hand
+    return (
+        connection.scalar(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass(:table_name)"
+            ),
+            {"table_name": table_name},
+        )
+        is not None
+    )
+
+
+def list_partitions(connection: Connection, table_name: str) -> list[str]:
+    return connection.scalars(
+        text(
+            "SELECT child.relname FROM pg_inherits AS inherits "
+            "JOIN pg_class AS child ON child.oid = inherits.inhrelid "
+            "WHERE inherits.inhparent = CAST(:table_name AS regclass)"
+        ),
+        {"table_name": table_name},
+    ).all()
+
+
+def create_partitions(
+    connection: Connection,
+    table_name: str,
+    months: list[datetime],
+) -> list[str]:
+    """Adds the partitions of `months`, and the default one if missing.
+
+    The default partition takes the rows of months without their own,
+    such as backfilled votes from before the table was partitioned.
+    """
+    existing = list_partitions(connection, table_name)
+    quote = connection.dialect.identifier_preparer.quote
+    created = []
+    default_name = default_partition_name(table_name)
+    if default_name not in existing:
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {quote(default_name)} "
+            f"PARTITION OF {quote(table_name)} DEFAULT"
+        )
+        created.append(default_name)
+    for month in months:
+        name = partition_name(table_name, month)
+        if name in existing:
+            continue
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {quote(name)} "
+            f"PARTITION OF {quote(table_name)} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') "
+            f"TO ('{month_start(month, 1):%Y-%m-%d}')"
+        )
+        created.append(name)
+    return created
+
+
+def detach_partitions(
+    connection: Connection,
+    table_name: str,
+    partition_names: list[str],
+    archive_schema: str,
+) -> list[str]:
+    """Takes partitions out of the table, into `archive_schema` or dropped.
+
+    PostgreSQL cannot detach concurrently next to a default partition, so
+    each detach holds the table for a moment, waiting `DETACH_LOCK_TIMEOUT`
+    at most for it.
+    """
+    existing = list_partitions(connection, table_name)
+    quote = connection.dialect.identifier_preparer.quote
+    connection.exec_driver_sql(f"SET lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+    detached = []
+    try:
+        for name in partition_names:
+            if name not in existing:
+                continue
+            connection.exec_driver_sql(
+                f"ALTER TABLE {quote(table_name)} "
+                f"DETACH PARTITION {quote(name)}"
+            )
+            if archive_schema:
+                # Kept foreign keys would stop the purge of images voted on
+                for constraint_name in connection.scalars(
+                    text(
+                        "SELECT conname FROM pg_constraint "
+                        "WHERE conrelid = CAST(:name AS regclass) "
+                        "AND contype = 'f'"
+                    ),
+                    {"name": name},
+                ).all():
+                    connection.exec_driver_sql(
+                        f"ALTER TABLE {quote(name)} "
+                        f"DROP CONSTRAINT {quote(constraint_name)}"
+                    )
+                connection.exec_driver_sql(
+                    f"CREATE SCHEMA IF NOT EXISTS {quote(archive_schema)}"
+                )
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {quote(name)} "
+                    f"SET SCHEMA {quote(archive_schema)}"
+                )
+            else:
+                connection.exec_driver_sql(f"DROP TABLE {quote(name)}")
+            detached.append(name)
+    finally:
+        connection.exec_driver_sql("RESET lock_timeout")
+    return detached
+
+
+def maintain_partitions(
+    db_engine: Engine,
+    *,
+    now: datetime,
+    months_ahead: int = RATING_PARTITIONS_AHEAD,
+    retention_months: int = RATING_RETENTION_MONTHS,
+    archive_schema: str = RATING_ARCHIVE_SCHEMA,
+) -> PartitionReport:
+    """Creates the partitions of the coming months and detaches the expired.
+
+    Only the months before the last `retention_months` expire, and with no
+    retention none do.
+    """
+    if db_engine.dialect.name != "postgresql":
+        return PartitionReport()
+
+    with db_engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        if not is_partitioned(connection, PARTITIONED_TABLE):
+            return PartitionReport()
+        # Workers take turns, those finding it taken skip the round
+        if not connection.scalar(
+            text("SELECT pg_try_advisory_lock(:key)"),
+            {"key": MAINTENANCE_LOCK_KEY},
+        ):
+            return PartitionReport()
+        try:
+            created = create_partitions(
+                connection,
+                PARTITIONED_TABLE,
+                [
+                    month_start(now, months)
+                    for months in range(months_ahead + 1)
+                ],
+            )
+            detached = []
+            if retention_months > 0:
+                detached = detach_partitions(
+                    connection,
+                    PARTITIONED_TABLE,
+                    expired_partitions(
+                        PARTITIONED_TABLE,
+                        list_partitions(connection, PARTITIONED_TABLE),
+                        before=month_start(now, -retention_months),
+                    ),
+                    archive_schema,
+                )
+        finally:
+            connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": MAINTENANCE_LOCK_KEY},
+            )
+    return PartitionReport(len(created), len(detached))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_upcoming_partitions(
+    target,
+    connection: Connection,
+    **kwargs,
+) -> None:
+    """Votes need a partition for their month before the first comes in."""
+    if connection.dialect.name != "postgresql" or not is_partitioned(
+        connection, PARTITIONED_TABLE
+    ):
+        return None
+    now = datetime.now(timezone.utc)
+    create_partitions(
+        connection,
+        PARTITIONED_TABLE,
+        [
+            month_start(now, months)
+            for months in range(RATING_PARTITIONS_AHEAD + 1)
+        ],
+    )
+
+
+def record(report: PartitionReport) -> PartitionReport:
+    metrics.rating_partitions_created.inc(amount=report.partitions_created)
+    metrics.rating_partitions_detached.inc(amount=report.partitions_detached)
+    return report
+
+
+async def run_partition_worker(*, interval_seconds: float) -> None:
+    """Keeps partitions ahead of the votes and detaches old ones, forever."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            report = await asyncio.to_thread(
+                maintain_partitions, engine, now=datetime.now(timezone.utc)
+            )
+        except Exception:
+            metrics.partition_maintenance_failures.inc()
+            continue  # The months ahead leave time for the next round
+        record(report)
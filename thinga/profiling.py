@@ -0,0 +1,194 @@
+import sys
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# Set while a request is profiled, threadpool workers run its sync handlers
+# in a copy of its context
+_profiled_request = contextvars.ContextVar("profiled_request", default=None)
+
+
+def _collapse_stack(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler:
+    """Snapshots thread stacks at a fixed interval from a helper thread."""
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+        thread_ids: Optional[set[int]] = None,
+        include: Optional[Callable] = None,
+    ) -> None:
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include = include
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def _run(self) -> None:
+        own_thread_id = threading.get_ident()
+        thread_names = {
+            thread.ident: thread.name for thread in threading.enumerate()
+        }
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or (
+                    self.thread_ids is not None
+                    and thread_id not in self.thread_ids
+                ):
+                    continue
+                if self.include is not None and not self.include(frame):
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {
+                        thread.ident: thread.name
+                        for thread in threading.enumerate()
+                    }
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                self.stacks[f"{thread_name};{_collapse_stack(frame)}"] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Samples every thread of the worker for the given duration."""
+    sampler = StackSampler(interval=interval)
+    sampler.start()
+    time.sleep(seconds)
+    return sampler.stop()
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Renders stacks in the collapsed format flame graph tools read."""
+    return "".join(
+        f"{stack} {count}\n" for stack, count in stacks.most_common()
+    )
+
+
+class SlowTraceBuffer:
+    """Keeps only the slowest traces seen, evicting the fastest first."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._traces = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, duration: float, trace: dict) -> None:
+        entry = (duration, next(self._counter), trace)
+        with self._lock:
+            if len(self._traces) < self.capacity:
+                heapq.heappush(self._traces, entry)
+            elif duration > self._traces[0][0]:
+                heapq.heapreplace(self._traces, entry)
+
+    def slowest(self) -> list[dict]:
+        with self._lock:
+            entries = sorted(self._traces, reverse=True)
+        return [trace for _, _, trace in entries]
+
+
+slow_traces = SlowTraceBuffer(capacity=20)
+
+
+def _works_for(frame, request_frame, request: object) -> bool:
+    """Whether a sampled stack is doing the profiled request's work.
+
+    On the event loop the request's own frame is in the stack, other
+    requests interleave there without it. A threadpool worker runs the
+    request's sync handlers in a copy of its context, which the worker's
+    outermost frames hold.
+    """
+    outermost = []
+    while frame is not None:
+        if frame is request_frame:
+            return True
+        outermost.append(frame)
+        frame = frame.f_back
+    for frame in outermost[-3:]:
+        context = frame.f_locals.get("context")
+        if (
+            isinstance(context, contextvars.Context)
+            and context.get(_profiled_request) is request
+        ):
+            return True
+    return False
+
+
+class RequestProfilerMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        route: str,
+        every_n_requests: int,
+        interval: float = 0.001,
+    ) -> None:
+        self.app = app
+        self.route_regex, _, _ = compile_path(route)
+        self.every_n_requests = every_n_requests
+        self.interval = interval
+        self._matching_requests = itertools.count()
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if (
+            scope["type"] != "http"
+            or not self.route_regex.match(scope["path"])
+            or next(self._matching_requests) % self.every_n_requests
+        ):
+            await self.app(scope, receive, send)
+            return None
+
+        # Concurrent requests share the event loop and the threadpool, only
+        # the stacks working for this one are kept
+        request = object()
+        request_frame = sys._getframe()
+        token = _profiled_request.set(request)
+        sampler = StackSampler(
+            interval=self.interval,
+            include=lambda frame: _works_for(frame, request_frame, request),
+        )
+        started_at = datetime.now(timezone.utc)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stacks = sampler.stop()
+            _profiled_request.reset(token)
+            duration = (datetime.now(timezone.utc) - started_at).total_seconds()
+            slow_traces.add(
+                duration,
+                {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "started_at": started_at.isoformat(),
+                    "duration_seconds": duration,
+                    "profile": render_collapsed(stacks),
+                },
+            )
@@ -0,0 +1,255 @@
+import math
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Protocol
+
+from fastapi import HTTPException, status
+
+from thinga.config import (
+    VOTE_RATE_LIMIT,
+    VOTE_CLIENT_RATE_LIMIT,
+    UPLOAD_RATE_LIMIT,
+    UPLOAD_CLIENT_RATE_LIMIT,
+    RATE_LIMIT_STORE_PATH,
+    RATE_LIMIT_MAX_BUCKETS,
+)
+
+
+class Bucket(NamedTuple):
+    key: str
+    capacity: float
+    refill_rate: float
+
+
+class BucketStore(Protocol):
+    def take(self, buckets: list[Bucket]) -> float:
+        """Takes a token from each bucket, or from none if one is empty.
+
+        Returns 0 or the seconds until every bucket has a token again.
+        """
+        ...
+
+
+def _refill(
+    tokens: float,
+    updated_at: float,
+    now: float,
+    bucket: Bucket,
+) -> tuple[float, float]:
+    """The tokens of a bucket by now, and the seconds until it has one."""
+    tokens = min(
+        bucket.capacity, tokens + (now - updated_at) * bucket.refill_rate
+    )
+    if tokens >= 1:
+        return tokens, 0.0
+    return tokens, (1 - tokens) / bucket.refill_rate
+
+
+def _full_at(tokens: float, now: float, bucket: Bucket) -> float:
+    return now + (bucket.capacity - tokens) / bucket.refill_rate
+
+
+class MemoryBucketStore:
+    """Buckets of a single worker, least recently used ones evicted first."""
+
+    def __init__(
+        self,
+        max_buckets: int,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.max_buckets = max_buckets
+        self.clock = clock
+        # Key -> (tokens, last update, when the bucket is full again)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, buckets: list[Bucket]) -> float:
+        now = self.clock()
+        with self._lock:
+            refilled = [
+                _refill(
+                    *self._buckets.get(bucket.key, (bucket.capacity, now))[:2],
+                    now,
+                    bucket,
+                )
+                for bucket in buckets
+            ]
+            wait = max((wait for _, wait in refilled), default=0.0)
+            if wait:
+                return wait  # Refused, nothing is charged
+            for bucket, (tokens, _) in zip(buckets, refilled):
+                self._buckets.pop(bucket.key, None)
+                self._buckets[bucket.key] = (
+                    tokens - 1,
+                    now,
+                    _full_at(tokens - 1, now, bucket),
+                )
+
+            # A full bucket is the same as a missing one, so idle buckets
+            # can go along with any over the limit
+            while self._buckets:
+                _, (_, _, full_at) = next(iter(self._buckets.items()))
+                if len(self._buckets) <= self.max_buckets and full_at > now:
+                    break
+                self._buckets.popitem(last=False)
+        return 0.0
+
+
+class SQLiteBucketStore:
+    """Buckets shared by every worker on a host through a SQLite file."""
+
+    def __init__(
+        self,
+        path: str,
+        max_buckets: int,
+        purge_every: int = 1000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.max_buckets = max_buckets
+        self.purge_every = purge_every
+        self.clock = clock
+        self._local = threading.local()
+        self._takes = 0
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                "updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_rate_limit_buckets_updated_at "
+                "ON rate_limit_buckets (updated_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, buckets: list[Bucket]) -> float:
+        now = self.clock()
+        connection = self._connect()
+        # Locks the file for writing up front, so workers cannot race
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            refilled = []
+            for bucket in buckets:
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_buckets "
+                    "WHERE key = ?",
+                    (bucket.key,),
+                ).fetchone()
+                refilled.append(
+                    _refill(*(row or (bucket.capacity, now)), now, bucket)
+                )
+            wait = max((wait for _, wait in refilled), default=0.0)
+            if not wait:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rate_limit_buckets "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            bucket.key,
+                            tokens - 1,
+                            now,
+                            _full_at(tokens - 1, now, bucket),
+                        )
+                        for bucket, (tokens, _) in zip(buckets, refilled)
+                    ],
+                )
+                self._takes += 1
+                if self._takes % self.purge_every == 0:
+                    self._purge(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _purge(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute(
+            "DELETE FROM rate_limit_buckets WHERE full_at <= ?", (now,)
+        )
+        connection.execute(
+            "DELETE FROM rate_limit_buckets WHERE key IN ("
+            "SELECT key FROM rate_limit_buckets ORDER BY updated_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.max_buckets,),
+        )
+
+
+def parse_rate(rate: str) -> tuple[int, float]:
+    """Reads `"30/60"` as a burst of 30 requests refilled over 60 seconds."""
+    requests, seconds = rate.split("/")
+    return int(requests), float(seconds)
+
+
+class RateLimit:
+    """Throttles a route per user and per client, see `generate_client_key`.
+
+    Users behind one address with the same browser share a client, so the
+    client's bucket gets a rate of its own, usually a larger one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: str,
+        client_rate: str,
+        store: BucketStore,
+    ) -> None:
+        self.name = name
+        self.capacity, seconds = parse_rate(rate)
+        self.refill_rate = self.capacity / seconds
+        self.client_capacity, client_seconds = parse_rate(client_rate)
+        self.client_refill_rate = self.client_capacity / client_seconds
+        self.store = store
+
+    def check(self, user_id: int, client_key: str) -> None:
+        # Both buckets must have a token, so neither a new account nor a
+        # new client gets around the limit alone, and a refusal by one
+        # does not cost the other
+        wait = self.store.take(
+            [
+                Bucket(
+                    f"{self.name}:user:{user_id}",
+                    self.capacity,
+                    self.refill_rate,
+                ),
+                Bucket(
+                    f"{self.name}:client:{client_key}",
+                    self.client_capacity,
+                    self.client_refill_rate,
+                ),
+            ]
+        )
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down.",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+bucket_store = (
+    SQLiteBucketStore(RATE_LIMIT_STORE_PATH, RATE_LIMIT_MAX_BUCKETS)
+    if RATE_LIMIT_STORE_PATH
+    else MemoryBucketStore(RATE_LIMIT_MAX_BUCKETS)
+)
+vote_rate_limit = RateLimit(
+    "vote", VOTE_RATE_LIMIT, VOTE_CLIENT_RATE_LIMIT, bucket_store
+)
+upload_rate_limit = RateLimit(
+    "upload", UPLOAD_RATE_LIMIT, UPLOAD_CLIENT_RATE_LIMIT, bucket_store
+)
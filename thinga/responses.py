@@ -0,0 +1,28 @@
+from typing import Any, Optional
+
+import pydantic_core
+from fastapi.responses import JSONResponse
+from sqlalchemy import Row
+
+from thinga.pair_tokens import PAIR_TOKEN_HEADER, pair_tokens
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return pydantic_core.to_json(content)
+
+
+class RowsJSONResponse(FastJSONResponse):
+    def render(self, content: list[Row]) -> bytes:
+        return super().render([row._asdict() for row in content])
+
+
+def pair_response(
+    pair: list[Row],
+    access_token: Optional[str],
+) -> RowsJSONResponse:
+    """A pair to vote on, with the token votes for it must carry."""
+    if len(pair) < 2:
+        return RowsJSONResponse(pair)
+    token = pair_tokens.issue((pair[0].id, pair[1].id), access_token)
+    return RowsJSONResponse(pair, headers={PAIR_TOKEN_HEADER: token})
@@ -0,0 +1,69 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Cookie, HTTPException, status
+from sqlalchemy.orm import Session
+
+from thinga import models, schemas, crud
+from thinga.responses import RowsJSONResponse, pair_response
+from thinga.dependencies import get_db, get_read_db, get_admin_or_moderator
+
+router = APIRouter()
+
+
+def get_category(
+    slug: str,
+    db: Session = Depends(get_read_db),
+) -> models.Category:
+    db_category = crud.get_category_by_slug(db=db, slug=slug)
+    if db_category is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found.",
+        )
+    return db_category
+
+
+@router.get("/categories/", response_model=list[schemas.Category])
+async def get_categories(db: Session = Depends(get_read_db)):
+    return crud.get_categories(db=db)
+
+
+@router.post("/categories/", response_model=schemas.Category)
+async def create_category(
+    category: schemas.CategoryCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    return crud.create_category(db=db, category=category)
+
+
+@router.get(
+    "/categories/{slug}/images/random/",
+    response_model=list[schemas.Image],
+)
+async def get_random_images_in_category(
+    access_token: Optional[str] = Cookie(None),
+    db_category: models.Category = Depends(get_category),
+    db: Session = Depends(get_read_db),
+):
+    return pair_response(
+        crud.get_two_random_images_in_category(
+            db=db, category_id=db_category.id
+        ),
+        access_token,
+    )
+
+
+@router.get(
+    "/categories/{slug}/images/top-ranked/",
+    response_model=list[schemas.Image],
+)
+async def get_top_ranked_images_in_category(
+    db_category: models.Category = Depends(get_category),
+    db: Session = Depends(get_read_db),
+):
+    return RowsJSONResponse(
+        crud.get_top_ranked_images_in_category(
+            db=db, category_id=db_category.id, limit=20
+        )
+    )
@@ -0,0 +1,54 @@
+from datetime import datetime
+from typing import Iterator, Literal, Optional
+
+from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from thinga import models, exports
+from thinga.database import SessionLocal
+from thinga.dependencies import get_read_db, get_admin_or_moderator
+
+router = APIRouter()
+
+
+@router.get("/admin/exports/{table_name}/")
+async def export_table(
+    table_name: Literal["ratings", "images"],
+    format: Literal["csv", "parquet"] = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    if format == "parquet" and exports.pyarrow is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Parquet exports are not available, use CSV.",
+        )
+
+    table = exports.EXPORT_TABLES[table_name]
+    statement = exports.select_rows(
+        table, after_id=after_id, since=since, until=until
+    )
+
+    # The request's session may be closed before the body is streamed
+    db_bind = db.get_bind()
+
+    def stream() -> Iterator[bytes]:
+        # Iterated in a thread pool, one batch in memory at a time, on a
+        # connection of its own that is returned once the export ends
+        with SessionLocal(bind=db_bind) as export_db:
+            batches = exports.iter_batches(export_db.connection(), statement)
+            yield from exports.export_chunks(table, batches, format)
+
+    return StreamingResponse(
+        stream(),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{table_name}.{format}"'
+            )
+        },
+    )
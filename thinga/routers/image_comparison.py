@@ -1,32 +1,132 @@
+import json
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
+import pydantic_core
+from fastapi import (
+    APIRouter,
+    Depends,
+    Query,
+    Body,
+    UploadFile,
+    File,
+    HTTPException,
+    Cookie,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Row
 from sqlalchemy.orm import Session
 
-from thinga import models, schemas, crud
-from thinga.dependencies import get_db, get_current_user, get_admin_or_moderator
+from thinga import models, schemas, crud, enums, search, utils, voting
+from thinga.rate_limiting import vote_rate_limit
+from thinga.loaders import Loaders
+from thinga.responses import RowsJSONResponse, pair_response
+from thinga.config import MAX_BATCH_IMAGE_IDS, MAX_TRENDING_DAYS
+from thinga.dependencies import (
+    get_db,
+    get_read_db,
+    get_loaders,
+    get_session_factory,
+    get_vote_batcher,
+    get_voted_pair,
+    get_current_user,
+    get_admin_or_moderator,
+    pin_reads_to_primary,
+    limit_uploads,
+)
 
 router = APIRouter()
 
 
+def _get_category_id(*, db: Session, slug: Optional[str]) -> Optional[int]:
+    if slug is None:
+        return None
+    db_category = crud.get_category_by_slug(db=db, slug=slug)
+    if db_category is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found.",
+        )
+    return db_category.id
+
+
 @router.get("/images/", response_model=list[schemas.Image])
-async def get_images(db: models.Session = Depends(get_db)):
-    return crud.get_images(db=db)
+async def get_images(
+    ids: Optional[str] = Query(None, pattern=r"^\d+(,\d+)*$"),
+    # Tagged with the version the primary bumps, so a lagging replica
+    # would serve old rows under a new tag
+    db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_loaders),
+):
+    if ids is None:
+        return RowsJSONResponse(crud.get_images(db=db))
+
+    image_ids = list(
+        dict.fromkeys(int(image_id) for image_id in ids.split(","))
+    )
+    if len(image_ids) > MAX_BATCH_IMAGE_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Fetch up to {MAX_BATCH_IMAGE_IDS} images at once.",
+        )
+    # Unknown ids are left out, the rest keep the requested order
+    db_images = await loaders.images.load_many(image_ids)
+    return [db_image for db_image in db_images if db_image is not None]
+
+
+@router.get("/images/search/", response_model=schemas.ImageSearchPage)
+async def search_images(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    after = None
+    if cursor is not None:
+        after = search.decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor.",
+            )
+
+    rows = search.search_images(db=db, query=q, limit=limit, after=after)
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = search.encode_cursor(rows[-1].rank, rows[-1].id)
+    return {"results": rows, "next_cursor": next_cursor}
 
 
 @router.get("/images/random/", response_model=list[schemas.Image])
-async def get_random_images(db: models.Session = Depends(get_db)):
-    return crud.get_two_random_images(db=db)
+async def get_random_images(
+    access_token: Optional[str] = Cookie(None),
+    db: Session = Depends(get_read_db),
+):
+    return pair_response(crud.get_two_random_images(db=db), access_token)
 
 
 @router.get("/images/top-ranked/", response_model=list[schemas.Image])
 async def get_top_ranked_images(db: Session = Depends(get_db)):
-    return crud.get_top_ranked_images(db=db, limit=20)
+    return RowsJSONResponse(crud.get_top_ranked_images(db=db, limit=20))
+
+
+@router.get("/images/trending/", response_model=list[schemas.Image])
+async def get_trending_images(
+    days: int = Query(7, ge=1, le=MAX_TRENDING_DAYS),
+    db: Session = Depends(get_read_db),
+):
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return RowsJSONResponse(
+        crud.get_trending_images(db=db, since=since, limit=20)
+    )
 
 
 @router.get("/images/{image_id}/", response_model=schemas.Image)
-async def get_image(image_id: int, db: Session = Depends(get_db)):
-    db_image = crud.get_image_by_id(db=db, image_id=image_id)
+async def get_image(image_id: int, loaders: Loaders = Depends(get_loaders)):
+    db_image = await loaders.images.load(image_id)
     if db_image is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -35,15 +135,79 @@ async def get_image(image_id: int, db: Session = Depends(get_db)):
     return db_image
 
 
-@router.post("/images/", response_model=schemas.Image)
+@router.post(
+    "/images/",
+    response_model=schemas.Image,
+    dependencies=[Depends(limit_uploads)],
+)
 async def upload_image(
     media_file: UploadFile = File(None),
     alt_text: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    new_image = schemas.ImageCreate(
+        media_file=media_file,
+        alt_text=alt_text,
+        category_id=_get_category_id(db=db, slug=category),
+    )
+    # Decoding the image for its size and BlurHash would hold up the loop
+    return await run_in_threadpool(crud.create_image, db=db, image=new_image)
+
+
+@router.post(
+    "/images/bulk/",
+    response_model=list[schemas.Image],
+    dependencies=[Depends(limit_uploads)],
+)
+async def upload_images(
+    media_files: list[UploadFile] = File(...),
+    alt_text: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    category_id = _get_category_id(db=db, slug=category)
+    new_images = [
+        schemas.ImageCreate(
+            media_file=media_file,
+            alt_text=alt_text,
+            category_id=category_id,
+        )
+        for media_file in media_files
+    ]
+    return await run_in_threadpool(crud.create_images, db=db, images=new_images)
+
+
+@router.post(
+    "/images/uploads/",
+    response_model=schemas.ImageUpload,
+    dependencies=[Depends(limit_uploads)],
+)
+async def create_image_upload(
+    upload: schemas.ImageUploadCreate,
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    # Clients send the file to the returned URL, then complete the upload
+    return crud.create_image_upload(upload=upload)
+
+
+@router.post("/images/uploads/complete/", response_model=schemas.Image)
+async def complete_image_upload(
+    upload: schemas.ImageUploadComplete,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_admin_or_moderator),
 ):
-    new_image = schemas.ImageCreate(media_file=media_file, alt_text=alt_text)
-    return crud.create_image(db=db, image=new_image)
+    category_id = _get_category_id(db=db, slug=upload.category)
+    # Storage calls block, on S3 they are round trips to the bucket
+    return await run_in_threadpool(
+        crud.complete_image_upload,
+        db=db,
+        media_file=upload.media_file,
+        alt_text=upload.alt_text,
+        category_id=category_id,
+    )
 
 
 @router.delete("/images/{image_id}/")
@@ -56,14 +220,166 @@ async def delete_image(
     return {"message": "Image deleted successfully."}
 
 
-@router.post("/images/{image_id}/rate/", response_model=schemas.Image)
+@router.post("/images/bulk-delete/")
+async def delete_images(
+    image_ids: list[int] = Body(..., embed=True, min_length=1),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    deleted_count = crud.delete_images(
+        db=db, image_ids=list(dict.fromkeys(image_ids))
+    )
+    return {"deleted": deleted_count}
+
+
+@router.post(
+    "/images/{image_id}/rate/",
+    response_model=schemas.Image,
+    dependencies=[Depends(pin_reads_to_primary)],
+)
 async def rate_image(
     image_id: int,
+    pair: tuple[int, int] = Depends(get_voted_pair),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
     rating_data = schemas.RatingCreate(
-        user_id=current_user.id, image_id=image_id
+        user_id=current_user.id,
+        image_id=image_id,
+        loser_image_id=pair[1] if pair[0] == image_id else pair[0],
     )
-    crud.create_rating(db=db, rating=rating_data)
-    return crud.update_image_score(db=db, image_id=image_id)
+    return crud.rate_image(db=db, rating=rating_data)
+
+
+def _pair_message(pair: list[Row]) -> str:
+    return pydantic_core.to_json(
+        {"type": "pair", "images": [row._asdict() for row in pair]}
+    ).decode()
+
+
+def _error_message(detail: str, retry_after: Optional[int] = None) -> str:
+    return json.dumps(
+        {"type": "error", "detail": detail, "retry_after": retry_after}
+    )
+
+
+@router.websocket("/images/vote/")
+async def vote_channel(
+    websocket: WebSocket,
+    category: Optional[str] = None,
+    open_session: voting.SessionFactory = Depends(get_session_factory),
+    batcher: voting.VoteBatcher = Depends(get_vote_batcher),
+):
+    """Votes and next pairs over one connection, authenticated once.
+
+    Clients send `{"image_id": ...}` for an image of the last pair received
+    and get the next pair, or an error, back.
+    """
+    access_token = websocket.cookies.get("access_token")
+    client_fingerprint = utils.generate_client_fingerprint(websocket)
+    client_key = utils.generate_client_key(websocket)
+
+    def verify() -> Optional[models.Session]:
+        with open_session() as db:
+            db_session = crud.verify_session(
+                db=db,
+                access_token=access_token,
+                client_fingerprint=client_fingerprint,
+            )
+            if (
+                db_session is None
+                or db_session.status != enums.SessionStatus.ACTIVE
+            ):
+                return None
+            return db_session
+
+    def get_category_id() -> Optional[int]:
+        with open_session() as db:
+            db_category = crud.get_category_by_slug(db=db, slug=category)
+            return None if db_category is None else db_category.id
+
+    def get_pair(category_id: Optional[int]) -> list[Row]:
+        with open_session() as db:
+            if category_id is None:
+                return crud.get_two_random_images(db=db)
+            return crud.get_two_random_images_in_category(
+                db=db, category_id=category_id
+            )
+
+    db_session = (
+        None if access_token is None else await run_in_threadpool(verify)
+    )
+    if db_session is None:
+        await websocket.close(
+            code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated."
+        )
+        return None
+    category_id = None
+    if category is not None:
+        category_id = await run_in_threadpool(get_category_id)
+        if category_id is None:
+            await websocket.close(
+                code=status.WS_1008_POLICY_VIOLATION,
+                reason="Category not found.",
+            )
+            return None
+
+    await websocket.accept()
+    channel = voting.open_channel(db_session)
+    try:
+        pair = await run_in_threadpool(get_pair, category_id)
+        await websocket.send_text(_pair_message(pair))
+        while True:
+            text = await websocket.receive_text()
+            # Only a session ended elsewhere costs a query again
+            if channel.is_expired() or (
+                channel.stale and await run_in_threadpool(verify) is None
+            ):
+                await websocket.close(
+                    code=status.WS_1008_POLICY_VIOLATION,
+                    reason="Not authenticated.",
+                )
+                return None
+            channel.stale = False
+
+            try:
+                image_id = json.loads(text)["image_id"]
+            except (ValueError, TypeError, KeyError):
+                image_id = None
+            pair_ids = [row.id for row in pair]
+            if len(pair_ids) != 2 or image_id not in pair_ids:
+                await websocket.send_text(
+                    _error_message("Vote for an image of the last pair.")
+                )
+                continue
+            try:
+                await run_in_threadpool(
+                    vote_rate_limit.check, channel.user_id, client_key
+                )
+            except HTTPException as e:
+                await websocket.send_text(
+                    _error_message(e.detail, int(e.headers["Retry-After"]))
+                )
+                continue
+
+            loser_image_id = (
+                pair_ids[1] if pair_ids[0] == image_id else pair_ids[0]
+            )
+            try:
+                kept = await batcher.add(
+                    channel.user_id, image_id, loser_image_id
+                )
+            except voting.VotesNotSaved:
+                # The same pair stays, so the vote can be sent again
+                await websocket.send_text(
+                    _error_message("The vote could not be saved.", 1)
+                )
+                continue
+            if not kept:
+                await websocket.send_text(_error_message("Image not found."))
+            pair = await run_in_threadpool(get_pair, category_id)
+            await websocket.send_text(_pair_message(pair))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        voting.close_channel(channel)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from thinga import models, schemas, jobs
+from thinga.dependencies import get_db, get_admin_or_moderator
+
+router = APIRouter()
+
+
+@router.get("/admin/jobs/", response_model=list[schemas.JobQueueStats])
+async def get_queue_stats(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    return jobs.get_queue_stats(db=db)
+
+
+@router.get("/admin/jobs/{job_id}/", response_model=schemas.Job)
+async def get_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    db_job = jobs.get_job_by_id(db=db, job_id=job_id)
+    if db_job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found.",
+        )
+    return db_job
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import PlainTextResponse
+
+from sqlalchemy.orm import Session
+
+from thinga import models, metrics, profiling, cleanup
+from thinga.config import IMAGE_PURGE_DELAY_SECONDS
+from thinga.dependencies import (
+    get_db,
+    get_admin_or_moderator,
+    verify_metrics_token,
+)
+
+router = APIRouter()
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(verify_metrics_token)],
+)
+async def get_metrics():
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@router.get("/admin/database/pools/")
+async def get_pool_stats(
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    pools = {}
+    for name, engine in metrics.instrumented_engines.items():
+        wait_counts = metrics.db_pool_checkout_wait.values.get((name,))
+        wait_count = sum(wait_counts[:-1]) if wait_counts else 0
+        wait_seconds = wait_counts[-1] if wait_counts else 0.0
+        pools[name] = {
+            "pool_class": type(engine.pool).__name__,
+            **metrics.pool_state(engine),
+            "checkout_timeouts": metrics.db_pool_checkout_timeouts.values.get(
+                (name,), 0
+            ),
+            "checkouts": wait_count,
+            "checkout_wait_seconds_total": wait_seconds,
+            "checkout_wait_seconds_average": (
+                wait_seconds / wait_count if wait_count else None
+            ),
+        }
+    return pools
+
+
+@router.post("/admin/images/purge/")
+async def purge_deleted_images(
+    delay_seconds: int = Query(IMAGE_PURGE_DELAY_SECONDS, ge=0),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    deleted_before = datetime.now(timezone.utc) - timedelta(
+        seconds=delay_seconds
+    )
+    report = await asyncio.to_thread(
+        cleanup.purge_deleted_images, db=db, deleted_before=deleted_before
+    )
+    return cleanup.record(report)._asdict()
+
+
+@router.get("/admin/profile/", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(5, gt=0, le=60),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    # Sampled from a thread, so this worker keeps serving while it runs
+    stacks = await asyncio.to_thread(
+        profiling.sample_stacks, seconds, interval_ms / 1000
+    )
+    return PlainTextResponse(profiling.render_collapsed(stacks))
+
+
+@router.get("/admin/profile/slow-requests/")
+async def get_slow_requests(
+    current_user: models.User = Depends(get_admin_or_moderator),
+):
+    return profiling.slow_traces.slowest()
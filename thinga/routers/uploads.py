@@ -0,0 +1,62 @@
+import os
+import uuid
+
+import aiofiles
+import aiofiles.os
+from fastapi import APIRouter, Request, HTTPException, status
+
+from thinga import metrics
+from thinga.storage import LocalStorage, storage
+
+router = APIRouter()
+
+
+@router.put("/uploads/{token}")
+async def receive_direct_upload(token: str, request: Request):
+    # Stands in for the presigned URLs of S3 when files are kept locally
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    upload = storage.verify_upload(token)
+    if upload is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired upload URL.",
+        )
+    elif request.headers.get("content-type") != upload["content_type"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The file must be sent as `{upload['content_type']}`.",
+        )
+
+    file_path = storage.path(upload["folder"], upload["file_name"])
+    # Tokens stay valid until they expire, but only fill an empty name
+    if await aiofiles.os.path.exists(file_path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The file was uploaded already.",
+        )
+    partial_file_path = f"{file_path}.{uuid.uuid4().hex}.part"
+    written_bytes = 0
+    async with aiofiles.open(partial_file_path, "wb") as f:
+        async for chunk in request.stream():
+            written_bytes += len(chunk)
+            if written_bytes > upload["size"]:
+                await f.close()
+                os.remove(partial_file_path)
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="The file is larger than announced.",
+                )
+            await f.write(chunk)
+    try:
+        # Unlike a rename, linking fails when another upload got there first
+        os.link(partial_file_path, file_path)
+    except FileExistsError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The file was uploaded already.",
+        )
+    finally:
+        os.remove(partial_file_path)
+    metrics.image_upload_bytes.inc(amount=written_bytes)
+    return {"message": "File uploaded successfully."}
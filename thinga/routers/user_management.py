@@ -14,10 +14,13 @@ from fastapi import (
 from sqlalchemy.orm import Session
 
 from thinga import models, schemas, crud, enums, utils
+from thinga.loaders import Loaders
 from thinga.dependencies import (
     get_db,
+    get_primary_loaders,
     get_access_token,
     get_current_user,
+    get_current_user_for_read,
     get_admin_or_moderator,
 )
 from thinga.config import (
@@ -36,6 +39,7 @@ async def login(
     username: str = Body(...),
     password: str = Body(...),
     db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_primary_loaders),
 ):
     db_user = crud.get_user_by_username(db=db, username=username)
     if db_user is None or not utils.verify_password(
@@ -59,7 +63,8 @@ async def login(
         secure=COOKIE_SECURE_MODE,
         samesite=COOKIE_SAMESITE_POLICY,
     )
-    return db_user
+    # Read again, the new session's commit expired the user
+    return await loaders.load_user(db_user.id)
 
 
 @router.post("/logout/")
@@ -102,7 +107,7 @@ async def create_user(
 
 @router.get("/users/me/", response_model=schemas.User)
 async def read_users_me(
-    current_user: models.User = Depends(get_current_user),
+    current_user: models.User = Depends(get_current_user_for_read),
 ):
     return current_user
 
@@ -142,6 +147,8 @@ async def update_user_role(
     username: str,
     new_role: enums.UserRole,
     db: Session = Depends(get_db),
+    loaders: Loaders = Depends(get_primary_loaders),
     current_user: models.User = Depends(get_admin_or_moderator),
 ):
-    return crud.update_user_role(db=db, username=username, new_role=new_role)
+    db_user = crud.update_user_role(db=db, username=username, new_role=new_role)
+    return await loaders.load_profile(db_user)
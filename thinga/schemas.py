@@ -51,6 +51,24 @@ class UserProfileUpdate(BaseModel):
     avatar_file: Optional[UploadFile] = None
 
 
+class CategoryBase(BaseModel):
+    slug: str = Field(
+        ..., min_length=1, max_length=50, pattern=r"^[a-z0-9]+(-[a-z0-9]+)*$"
+    )
+    name: str = Field(..., min_length=1, max_length=100)
+
+
+class CategoryCreate(CategoryBase):
+    pass
+
+
+class Category(CategoryBase):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field(..., ge=1)
+    created_at: datetime
+
+
 class ImageBase(BaseModel):
     media_file: str = Field(..., max_length=35)
     alt_text: Optional[str] = Field(None, max_length=250)
@@ -58,6 +76,7 @@ class ImageBase(BaseModel):
 
 class ImageCreate(ImageBase):
     media_file: UploadFile
+    category_id: Optional[int] = None
 
 
 class Image(ImageBase):
@@ -66,11 +85,65 @@ class Image(ImageBase):
     id: int = Field(..., ge=1)
     score: int = Field(..., ge=0)
     created_at: datetime
+    category_id: Optional[int] = None
+    # Lets clients lay out and paint a card before its file arrives
+    width: Optional[int] = Field(None, ge=1)
+    height: Optional[int] = Field(None, ge=1)
+    blurhash: Optional[str] = Field(None, max_length=32)
+
+
+class ImageUploadCreate(BaseModel):
+    file_name: str = Field(..., min_length=1, max_length=255)
+    size: int = Field(..., ge=1)
+
+
+class ImageUpload(BaseModel):
+    media_file: str
+    upload_url: str
+    method: str
+    headers: dict[str, str]
+    expires_in: int
+
+
+class ImageUploadComplete(BaseModel):
+    media_file: str = Field(..., pattern=r"^[0-9a-f]{15}\.[A-Za-z0-9]+$")
+    alt_text: Optional[str] = Field(None, max_length=250)
+    category: Optional[str] = None
+
+
+class Job(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field(..., ge=1)
+    kind: str
+    payload: Optional[dict] = None
+    status: enums.JobStatus
+    priority: int
+    attempts: int = Field(..., ge=0)
+    max_attempts: int = Field(..., ge=1)
+    run_at: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+
+class JobQueueStats(BaseModel):
+    kind: str
+    status: enums.JobStatus
+    count: int
+    oldest_run_at: datetime
+
+
+class ImageSearchPage(BaseModel):
+    results: list[Image]
+    next_cursor: Optional[str] = None
 
 
 class RatingBase(BaseModel):
     user_id: int = Field(..., ge=1)
     image_id: int = Field(..., ge=1)
+    loser_image_id: Optional[int] = Field(None, ge=1)
 
 
 class RatingCreate(RatingBase):
@@ -0,0 +1,160 @@
+import json
+import base64
+import binascii
+from typing import Optional
+
+from sqlalchemy import (
+    Double,
+    Row,
+    cast,
+    event,
+    func,
+    literal_column,
+    table,
+    tuple_,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from thinga import models
+from thinga.crud import IMAGE_COLUMNS
+from thinga.database import Base
+
+# The query has to repeat this expression verbatim for PostgreSQL to use
+# the index built on it
+SEARCH_DOCUMENT = func.to_tsvector(
+    literal_column("'english'::regconfig"),
+    func.coalesce(models.Image.alt_text, literal_column("''")),
+)
+POSTGRESQL_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_images_alt_text_search ON images "
+    "USING gin (to_tsvector('english'::regconfig, coalesce(alt_text, '')))"
+)
+# An external content table, it indexes `images` without a copy of the text
+SQLITE_SEARCH_TABLE = (
+    "CREATE VIRTUAL TABLE images_fts USING fts5("
+    "alt_text, content='images', content_rowid='id')"
+)
+SQLITE_SEARCH_TRIGGERS = (
+    " ".join(
+        (
+            "CREATE TRIGGER IF NOT EXISTS images_fts_insert",
+            "AFTER INSERT ON images",
+            "BEGIN INSERT INTO images_fts (rowid, alt_text)",
+            "VALUES (new.id, new.alt_text); END",
+        )
+    ),
+    " ".join(
+        (
+            "CREATE TRIGGER IF NOT EXISTS images_fts_delete",
+            "AFTER DELETE ON images",
+            "BEGIN INSERT INTO images_fts (images_fts, rowid, alt_text)",
+            "VALUES ('delete', old.id, old.alt_text); END",
+        )
+    ),
+    " ".join(
+        (
+            "CREATE TRIGGER IF NOT EXISTS images_fts_update",
+            "AFTER UPDATE OF alt_text ON images",
+            "BEGIN INSERT INTO images_fts (images_fts, rowid, alt_text)",
+            "VALUES ('delete', old.id, old.alt_text);",
+            "INSERT INTO images_fts (rowid, alt_text)",
+            "VALUES (new.id, new.alt_text); END",
+        )
+    ),
+)
+images_fts = table("images_fts")
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_search_index(target, connection: Connection, **kwargs) -> None:
+    """Adds the full-text index, to new and existing databases alike."""
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(POSTGRESQL_SEARCH_INDEX)
+    elif connection.dialect.name == "sqlite":
+        table_exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'images_fts'"
+        ).first()
+        if not table_exists:
+            connection.exec_driver_sql(SQLITE_SEARCH_TABLE)
+            # Indexes the images stored before search existed
+            connection.exec_driver_sql(
+                "INSERT INTO images_fts (images_fts) VALUES ('rebuild')"
+            )
+        for trigger in SQLITE_SEARCH_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def drop_search_index(target, connection: Connection, **kwargs) -> None:
+    # Dropping `images` takes the triggers but leaves the SQLite table
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS images_fts")
+
+
+def _sqlite_match_query(query: str) -> str:
+    # Quoting every word keeps FTS5 operators in user input literal
+    return " ".join(
+        '"{}"'.format(word.replace('"', '""')) for word in query.split()
+    )
+
+
+def encode_cursor(rank: float, image_id: int) -> str:
+    return base64.urlsafe_b64encode(
+        json.dumps([rank, image_id]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[tuple[float, int]]:
+    try:
+        rank, image_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return float(rank), int(image_id)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def search_images(
+    *,
+    db: Session,
+    query: str,
+    limit: int,
+    after: Optional[tuple[float, int]] = None,
+) -> list[Row]:
+    """Best matches first, each row carrying its `rank` for the next cursor.
+
+    Lower ranks are better on both databases, so pages continue from the
+    last row with a `(rank, id)` greater than its own.
+    """
+    if not query.split():
+        return []
+
+    if db.get_bind().dialect.name == "postgresql":
+        ts_query = func.websearch_to_tsquery(
+            literal_column("'english'::regconfig"), query
+        )
+        # As `real`, ranks would come back rounded in cursors and no longer
+        # match the rows they were taken from
+        rank = -cast(func.ts_rank_cd(SEARCH_DOCUMENT, ts_query), Double)
+        statement = db.query(*IMAGE_COLUMNS, rank.label("rank")).filter(
+            SEARCH_DOCUMENT.op("@@")(ts_query), models.LIVE_IMAGES
+        )
+    else:
+        rank = func.bm25(literal_column("images_fts"))
+        statement = (
+            db.query(*IMAGE_COLUMNS, rank.label("rank"))
+            .select_from(images_fts)
+            .join(
+                models.Image,
+                models.Image.id == literal_column("images_fts.rowid"),
+            )
+            .filter(
+                literal_column("images_fts").op("MATCH")(
+                    _sqlite_match_query(query)
+                ),
+                models.LIVE_IMAGES,
+            )
+        )
+
+    if after is not None:
+        statement = statement.filter(tuple_(rank, models.Image.id) > after)
+    return statement.order_by(rank, models.Image.id).limit(limit).all()
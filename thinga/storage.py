@@ -0,0 +1,261 @@
+import os
+import hmac
+import json
+import time
+import base64
+import shutil
+import hashlib
+import binascii
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Protocol
+
+from thinga.config import (
+    MEDIA_STORAGE_PATH,
+    STORAGE_BACKEND,
+    STORAGE_SIGNING_KEY,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_REGION,
+    S3_ACCESS_KEY_ID,
+    S3_SECRET_ACCESS_KEY,
+)
+
+try:
+    import boto3
+    import botocore.exceptions
+except ImportError:  # Only the S3 backend needs it
+    boto3 = None
+
+GALLERY = "gallery"
+AVATARS = "avatars"
+
+
+class StoredFile(NamedTuple):
+    name: str
+    size: int
+    modified_at: float
+
+
+class DirectUpload(NamedTuple):
+    """Where and how a client sends the bytes of a file itself."""
+
+    url: str
+    method: str
+    headers: dict[str, str]
+
+
+class Storage(Protocol):
+    def save(self, folder: str, file_name: str, file: BinaryIO) -> int:
+        """Stores a file, returning the number of bytes written."""
+        ...
+
+    def read(self, folder: str, file_name: str) -> bytes: ...
+
+    def size(self, folder: str, file_name: str) -> Optional[int]:
+        """The size of a stored file, `None` when there is no such file."""
+        ...
+
+    def delete(self, folder: str, file_name: str) -> Optional[int]:
+        """Removes a file, returning the bytes freed or `None` if missing."""
+        ...
+
+    def list(self, folder: str) -> Iterator[StoredFile]: ...
+
+    def create_upload(
+        self,
+        folder: str,
+        file_name: str,
+        content_type: str,
+        size: int,
+        expires_in: int,
+    ) -> DirectUpload: ...
+
+
+class LocalStorage:
+    """Files in folders of a local directory, served under `/media`.
+
+    Direct uploads go to the API itself, at a URL carrying a signed token,
+    so clients follow the same steps as with the S3 backend.
+    """
+
+    def __init__(self, root: str, signing_key: str) -> None:
+        self.root = root
+        self.signing_key = signing_key.encode()
+
+    def path(self, folder: str, file_name: str) -> str:
+        return os.path.join(self.root, folder, os.path.basename(file_name))
+
+    def save(self, folder: str, file_name: str, file: BinaryIO) -> int:
+        with open(self.path(folder, file_name), "wb") as f:
+            shutil.copyfileobj(file, f)
+            return f.tell()
+
+    def read(self, folder: str, file_name: str) -> bytes:
+        with open(self.path(folder, file_name), "rb") as f:
+            return f.read()
+
+    def size(self, folder: str, file_name: str) -> Optional[int]:
+        try:
+            return os.stat(self.path(folder, file_name)).st_size
+        except FileNotFoundError:
+            return None
+
+    def delete(self, folder: str, file_name: str) -> Optional[int]:
+        file_path = self.path(folder, file_name)
+        try:
+            size = os.stat(file_path).st_size
+            os.remove(file_path)
+        except FileNotFoundError:
+            return None  # Removed by another worker already
+        return size
+
+    def list(self, folder: str) -> Iterator[StoredFile]:
+        with os.scandir(os.path.join(self.root, folder)) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                yield StoredFile(entry.name, stat.st_size, stat.st_mtime)
+
+    def _sign(self, payload: bytes) -> str:
+        return hmac.new(self.signing_key, payload, hashlib.sha256).hexdigest()
+
+    def create_upload(
+        self,
+        folder: str,
+        file_name: str,
+        content_type: str,
+        size: int,
+        expires_in: int,
+    ) -> DirectUpload:
+        payload = base64.urlsafe_b64encode(
+            json.dumps(
+                {
+                    "folder": folder,
+                    "file_name": file_name,
+                    "content_type": content_type,
+                    "size": size,
+                    "expires_at": int(time.time()) + expires_in,
+                }
+            ).encode()
+        )
+        token = f"{payload.decode()}.{self._sign(payload)}"
+        return DirectUpload(
+            f"/uploads/{token}", "PUT", {"Content-Type": content_type}
+        )
+
+    def verify_upload(self, token: str) -> Optional[dict]:
+        """The upload a token of `create_upload` allows, unless expired."""
+        payload, _, signature = token.encode().partition(b".")
+        if not hmac.compare_digest(self._sign(payload).encode(), signature):
+            return None
+        try:
+            upload = json.loads(base64.urlsafe_b64decode(payload))
+        except (binascii.Error, ValueError):
+            return None
+        if upload["expires_at"] < time.time():
+            return None
+        return upload
+
+
+class S3Storage:
+    """Objects under folder prefixes of a bucket on any S3-compatible store."""
+
+    def __init__(
+        self,
+        bucket: str,
+        *,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+    ) -> None:
+        if boto3 is None:
+            raise RuntimeError("The S3 storage backend needs `boto3`.")
+        self.bucket = bucket
+        # Clients are thread-safe, one serves every request of the worker
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+        )
+
+    def save(self, folder: str, file_name: str, file: BinaryIO) -> int:
+        start = file.tell()
+        file.seek(0, os.SEEK_END)
+        size = file.tell() - start
+        file.seek(start)
+        self.client.upload_fileobj(file, self.bucket, f"{folder}/{file_name}")
+        return size
+
+    def read(self, folder: str, file_name: str) -> bytes:
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=f"{folder}/{file_name}"
+        )
+        return response["Body"].read()
+
+    def size(self, folder: str, file_name: str) -> Optional[int]:
+        try:
+            response = self.client.head_object(
+                Bucket=self.bucket, Key=f"{folder}/{file_name}"
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    def delete(self, folder: str, file_name: str) -> Optional[int]:
+        size = self.size(folder, file_name)
+        if size is not None:
+            self.client.delete_object(
+                Bucket=self.bucket, Key=f"{folder}/{file_name}"
+            )
+        return size
+
+    def list(self, folder: str) -> Iterator[StoredFile]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{folder}/"):
+            for item in page.get("Contents", ()):
+                yield StoredFile(
+                    item["Key"].removeprefix(f"{folder}/"),
+                    item["Size"],
+                    item["LastModified"].timestamp(),
+                )
+
+    def create_upload(
+        self,
+        folder: str,
+        file_name: str,
+        content_type: str,
+        size: int,
+        expires_in: int,
+    ) -> DirectUpload:
+        # The size can not be signed into a `PUT`, uploads are measured
+        # once finished instead
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": f"{folder}/{file_name}",
+                "ContentType": content_type,
+            },
+            ExpiresIn=expires_in,
+        )
+        return DirectUpload(url, "PUT", {"Content-Type": content_type})
+
+
+def create_storage(backend: str) -> Storage:
+    if backend == "s3":
+        return S3Storage(
+            S3_BUCKET,
+            endpoint_url=S3_ENDPOINT_URL or None,
+            region=S3_REGION or None,
+            access_key_id=S3_ACCESS_KEY_ID or None,
+            secret_access_key=S3_SECRET_ACCESS_KEY or None,
+        )
+    return LocalStorage(MEDIA_STORAGE_PATH, STORAGE_SIGNING_KEY)
+
+
+storage = create_storage(STORAGE_BACKEND)
@@ -1,49 +1,191 @@
 import os
 import io
+import shutil
+import contextlib
 from urllib.parse import urlparse
 from unittest.mock import Mock, patch
 from typing import Iterator
 
+# Hashing at the lowest cost keeps user fixtures from dominating the suite
+os.environ["BCRYPT_ROUNDS"] = "4"
+# Tests purge images themselves, a sweep would also touch the real gallery
+os.environ["IMAGE_CLEANUP_INTERVAL_SECONDS"] = "0"
+os.environ["INVALIDATION_BUS"] = ""
+# Tests run the jobs they queue themselves
+os.environ["JOB_WORKER_CONCURRENCY"] = "0"
+
 import pytest
 from fastapi import UploadFile
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
 
-from thinga import models, schemas, crud, enums
+from thinga import models, schemas, crud, enums, voting
 from thinga.main import app
+from thinga.cache import image_listing_version
 from thinga.database import Base
-from thinga.dependencies import get_db
+from thinga.dependencies import (
+    get_db,
+    get_read_db,
+    get_session_factory,
+    get_vote_batcher,
+)
 from thinga.config import TEST_DATABASE_URL
 
-engine = create_engine(TEST_DATABASE_URL)
-TestingSessionLocal = sessionmaker(
-    bind=engine, autocommit=False, autoflush=False
-)
 
+def _create_engine(database_url: str) -> Engine:
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        # Let SQLAlchemy emit `BEGIN` itself so savepoints work on SQLite
+        @event.listens_for(engine, "connect")
+        def do_connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
 
-@pytest.fixture(scope="function")
-def test_db_session() -> Iterator[Session]:
+        @event.listens_for(engine, "begin")
+        def do_begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+def _sqlite_file_path(database_url: str) -> str:
+    return urlparse(database_url).path.strip("/")
+
+
+def _worker_database_url(worker_id: str) -> str:
+    url = make_url(TEST_DATABASE_URL)
+    if url.get_backend_name() == "sqlite":
+        root, extension = os.path.splitext(url.database)
+        return url.set(
+            database=f"{root}-{worker_id}{extension}"
+        ).render_as_string(hide_password=False)
+    return url.set(database=f"{url.database}_{worker_id}").render_as_string(
+        hide_password=False
+    )
+
+
+def _clone_database(template_url: str, clone_url: str) -> None:
+    if make_url(template_url).get_backend_name() == "sqlite":
+        shutil.copyfile(
+            _sqlite_file_path(template_url), _sqlite_file_path(clone_url)
+        )
+        return None
+
+    maintenance_engine = create_engine(
+        make_url(template_url).set(database="postgres"),
+        isolation_level="AUTOCOMMIT",
+    )
+    clone_name = make_url(clone_url).database
+    template_name = make_url(template_url).database
+    with maintenance_engine.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{clone_name}"'))
+        connection.execute(
+            text(f'CREATE DATABASE "{clone_name}" TEMPLATE "{template_name}"')
+        )
+    maintenance_engine.dispose()
+
+
+def _drop_database(database_url: str) -> None:
+    if make_url(database_url).get_backend_name() == "sqlite":
+        db_file_path = _sqlite_file_path(database_url)
+        if os.path.exists(db_file_path):
+            os.remove(db_file_path)
+            print(f"Removed test database file: {db_file_path}")
+        else:
+            print(f"Test database file does not exist: {db_file_path}")
+        return None
+
+    maintenance_engine = create_engine(
+        make_url(database_url).set(database="postgres"),
+        isolation_level="AUTOCOMMIT",
+    )
+    with maintenance_engine.connect() as connection:
+        connection.execute(
+            text(f'DROP DATABASE IF EXISTS "{make_url(database_url).database}"')
+        )
+    maintenance_engine.dispose()
+
+
+def _is_xdist_worker(config: pytest.Config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+def pytest_sessionstart(session: pytest.Session) -> None:
+    # Runs once in the controller, before any `pytest-xdist` worker starts
+    if _is_xdist_worker(session.config):
+        return None
+
+    engine = _create_engine(TEST_DATABASE_URL)
+    Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
-    session = TestingSessionLocal()
+    engine.dispose()
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    if not _is_xdist_worker(session.config):
+        _drop_database(TEST_DATABASE_URL)
+
+
+@pytest.fixture(scope="session")
+def test_engine(request: pytest.FixtureRequest) -> Iterator[Engine]:
+    if not _is_xdist_worker(request.config):
+        engine = _create_engine(TEST_DATABASE_URL)
+        yield engine
+        engine.dispose()
+        return None
+
+    # Each worker gets its own copy of the schema prepared by the controller
+    database_url = _worker_database_url(request.config.workerinput["workerid"])
+    _clone_database(TEST_DATABASE_URL, database_url)
+    engine = _create_engine(database_url)
+    yield engine
+    engine.dispose()
+    _drop_database(database_url)
+
+
+@pytest.fixture(scope="function")
+def test_db_session(test_engine: Engine) -> Iterator[Session]:
+    # Everything a test commits only releases a savepoint of this
+    # transaction, which is rolled back afterwards
+    connection = test_engine.connect()
+    transaction = connection.begin()
+    session = Session(
+        bind=connection,
+        autoflush=False,
+        join_transaction_mode="create_savepoint",
+    )
     try:
         yield session
     finally:
         session.close()
-        Base.metadata.drop_all(bind=engine)
+        transaction.rollback()
+        connection.close()
 
 
 @pytest.fixture(scope="function")
 def test_client(
+    monkeypatch: pytest.MonkeyPatch,
     test_db_session: Session,
 ) -> Iterator[TestClient]:
     def override_get_db() -> Iterator[Session]:
-        try:
-            yield test_db_session
-        finally:
-            test_db_session.close()
+        # The session outlives requests, `test_db_session` closes it
+        yield test_db_session
+
+    def open_test_session() -> contextlib.nullcontext[Session]:
+        return contextlib.nullcontext(test_db_session)
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: open_test_session
+    app.dependency_overrides[get_vote_batcher] = lambda: voting.VoteBatcher(
+        open_test_session, 0
+    )
+    # Tags are read outside of requests, from what tests can see
+    monkeypatch.setattr(
+        image_listing_version, "session_factory", open_test_session
+    )
+    image_listing_version.invalidate()
 
     with TestClient(app) as test_client:
         yield test_client
@@ -82,19 +224,26 @@ def create_sample_images(
     mock_save_image_file: Mock,
 ) -> list[models.Image]:
     # Create a BinaryIO object to mimic file upload operations
-    image_stream = io.BytesIO(b"image_data")
+    image_data = b"image_data"
+    image_stream = io.BytesIO(image_data)
 
-    cat_image = UploadFile(file=image_stream, filename="cute-cat.jpg")
+    cat_image = UploadFile(
+        file=image_stream, filename="cute-cat.jpg", size=len(image_data)
+    )
     cat_image_data = schemas.ImageCreate(
         media_file=cat_image, alt_text="A cute cat image"
     )
     beach_image = UploadFile(
-        file=image_stream, filename="a-beach-in-california.jpg"
+        file=image_stream,
+        filename="a-beach-in-california.jpg",
+        size=len(image_data),
     )
     beach_image_data = schemas.ImageCreate(
         media_file=beach_image, alt_text="A beach in California"
     )
-    rat_image = UploadFile(file=image_stream, filename="rat-in-tunnel.png")
+    rat_image = UploadFile(
+        file=image_stream, filename="rat-in-tunnel.png", size=len(image_data)
+    )
     rat_image_data = schemas.ImageCreate(
         media_file=rat_image, alt_text="A rat in the tunnel"
     )
@@ -112,17 +261,3 @@ def mock_save_image_file() -> Iterator[Mock]:
     with patch("thinga.crud.save_image_file") as mock_save_image_file:
         mock_save_image_file.return_value = "mocked_image_file_path.png"
         yield mock_save_image_file
-
-
-@pytest.fixture(scope="session", autouse=True)
-def teardown_test_database() -> Iterator[None]:
-    yield
-
-    parsed_url = urlparse(TEST_DATABASE_URL)
-    if parsed_url.scheme in ("sqlite",):
-        db_file_path = parsed_url.path.strip("/")
-        if os.path.exists(db_file_path):
-            os.remove(db_file_path)
-            print(f"Removed test database file: {db_file_path}")
-        else:
-            print(f"Test database file does not exist: {db_file_path}")
@@ -1,10 +1,40 @@
+import io
+import csv
 import os
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock
 
-from fastapi import status
+import pytest
+from fastapi import UploadFile, WebSocketDisconnect, status
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
 
-from thinga import models
+from thinga import (
+    models,
+    schemas,
+    crud,
+    jobs,
+    rate_limiting,
+    dependencies,
+    voting,
+)
+from thinga.storage import GALLERY, storage
+from thinga.pair_tokens import PAIR_TOKEN_HEADER, pair_tokens
+
+
+def _pair_headers(
+    test_client: TestClient,
+    image_id: int,
+    other_image_id: int,
+) -> dict[str, str]:
+    """Headers of a vote on a pair served to the logged in client."""
+    token = pair_tokens.issue(
+        (image_id, other_image_id),
+        # The one set by the test, the login response keeps a copy too
+        test_client.cookies.get("access_token", domain=""),
+    )
+    return {PAIR_TOKEN_HEADER: token}
 
 
 def test_create_user(test_client: TestClient) -> None:
@@ -158,9 +188,8 @@ def test_delete_image(
     assert access_token is not None
     test_client.cookies.set("access_token", access_token)
 
-    response = test_client.delete(
-        "/images/1/"  # ID 1 represents the photo of the cute cat
-    )
+    cat_image = create_sample_images[0]
+    response = test_client.delete(f"/images/{cat_image.id}/")
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert data == {"message": "Image deleted successfully."}
@@ -168,6 +197,7 @@ def test_delete_image(
 
 def test_rate_image(
     test_client: TestClient,
+    test_db_session: Session,
     create_test_user: models.User,
     create_sample_images: list[models.Image],
 ) -> None:
@@ -178,7 +208,764 @@ def test_rate_image(
     assert access_token is not None
     test_client.cookies.set("access_token", access_token)
 
-    response = test_client.post("/images/1/rate/")
+    response = test_client.get("/images/random/")
+    pair_token = response.headers[PAIR_TOKEN_HEADER]
+    winner_id, loser_id = [image["id"] for image in response.json()]
+    response = test_client.post(f"/images/{winner_id}/rate/")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    response = test_client.post(
+        f"/images/{winner_id}/rate/",
+        headers={PAIR_TOKEN_HEADER: pair_token[:-4] + "AAAA"},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = test_client.post(
+        f"/images/{winner_id}/rate/", headers={PAIR_TOKEN_HEADER: pair_token}
+    )
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
+    assert data["id"] == winner_id
     assert data["score"] == 1
+    # The voter reads its own vote back from the primary for a while
+    assert response.cookies.get("read_primary") == "1"
+    db_rating = test_db_session.query(models.Rating).one()
+    assert (db_rating.image_id, db_rating.loser_image_id) == (
+        winner_id,
+        loser_id,
+    )
+
+    response = test_client.post(
+        f"/images/{loser_id}/rate/", headers={PAIR_TOKEN_HEADER: pair_token}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+    unpaired_id = next(
+        image.id
+        for image in create_sample_images
+        if image.id not in (winner_id, loser_id)
+    )
+    response = test_client.post(
+        f"/images/{unpaired_id}/rate/",
+        headers=_pair_headers(test_client, winner_id, loser_id),
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_vote_channel(
+    test_client: TestClient,
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    with pytest.raises(WebSocketDisconnect) as e:
+        with test_client.websocket_connect("/images/vote/"):
+            pass
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+    login_response = test_client.post(
+        "/login/", json={"username": "johndoe", "password": "password123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    with test_client.websocket_connect("/images/vote/") as websocket:
+        message = websocket.receive_json()
+        assert message["type"] == "pair"
+        pair_ids = [image["id"] for image in message["images"]]
+        assert len(pair_ids) == 2
+
+        websocket.send_json({"image_id": pair_ids[0]})
+        message = websocket.receive_json()
+        assert message["type"] == "pair"
+        unpaired_id = next(
+            image.id
+            for image in create_sample_images
+            if image.id not in [image["id"] for image in message["images"]]
+        )
+        websocket.send_json({"image_id": unpaired_id})
+        assert websocket.receive_json()["type"] == "error"
+
+        # Logging out anywhere ends the channel at its next message
+        test_client.post("/logout/")
+        websocket.send_json({"image_id": message["images"][0]["id"]})
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_json()
+        assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+    voted_image = test_db_session.get(models.Image, pair_ids[0])
+    test_db_session.refresh(voted_image)
+    assert voted_image.score == 1
+    assert (
+        test_db_session.query(models.Rating)
+        .filter(models.Rating.user_id == create_test_user.id)
+        .count()
+        == 1
+    )
+
+
+def test_vote_channel_database_error(
+    test_client: TestClient,
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    login_response = test_client.post(
+        "/login/", json={"username": "johndoe", "password": "password123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+
+    def fail(**kwargs) -> None:
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    with test_client.websocket_connect("/images/vote/") as websocket:
+        message = websocket.receive_json()
+        pair_ids = [image["id"] for image in message["images"]]
+
+        with monkeypatch.context() as patch:
+            patch.setattr(voting, "write_votes", fail)
+            websocket.send_json({"image_id": pair_ids[0]})
+            message = websocket.receive_json()
+        assert message["type"] == "error"
+        assert message["retry_after"] == 1
+        assert "Could not commit a batch of 1 votes." in caplog.text
+
+        # The channel stays open and the vote can be sent again
+        websocket.send_json({"image_id": pair_ids[0]})
+        assert websocket.receive_json()["type"] == "pair"
+
+    voted_image = test_db_session.get(models.Image, pair_ids[0])
+    test_db_session.refresh(voted_image)
+    assert voted_image.score == 1
+
+
+def test_upload_images_in_bulk(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+    mock_save_image_file: Mock,
+) -> None:
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    access_token = login_response.cookies.get("access_token")
+    assert access_token is not None
+    test_client.cookies.set("access_token", access_token)
+
+    sample_image_file = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "sample-image.png"
+    )
+    with open(sample_image_file, "rb") as f:
+        image_data = f.read()
+    response = test_client.post(
+        "/images/bulk/",
+        params={"alt_text": "Forest or city!?"},
+        files=[
+            ("media_files", (f"sample-image-{i}.png", image_data, "image/png"))
+            for i in range(3)
+        ],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 3
+    assert all(image["alt_text"] == "Forest or city!?" for image in data)
+    assert all(
+        (image["width"], image["height"]) == (500, 500) and image["blurhash"]
+        for image in data
+    )
+    assert [image["id"] for image in data] == sorted(
+        image["id"] for image in data
+    )
+
+
+def test_get_top_ranked_images(
+    test_client: TestClient,
+    create_sample_images: list[models.Image],
+) -> None:
+    response = test_client.get("/images/top-ranked/")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert len(data) == 3
+    assert [
+        schemas.Image.model_validate(image).model_dump(mode="json")
+        for image in data
+    ] == data
+
+
+def test_get_trending_images(
+    test_client: TestClient,
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    cat_image, beach_image, rat_image = create_sample_images
+    last_month = datetime.now(timezone.utc) - timedelta(days=30)
+    test_db_session.add_all(
+        [
+            *(
+                models.Rating(user_id=create_test_user.id, image_id=image.id)
+                for image in (beach_image, beach_image, cat_image)
+            ),
+            *(
+                models.Rating(
+                    user_id=create_test_user.id,
+                    image_id=rat_image.id,
+                    created_at=last_month,
+                )
+                for _ in range(3)
+            ),
+        ]
+    )
+    test_db_session.commit()
+
+    response = test_client.get("/images/trending/")
+    assert response.status_code == status.HTTP_200_OK
+    assert [image["id"] for image in response.json()] == [
+        beach_image.id,
+        cat_image.id,
+    ]
+    response = test_client.get("/images/trending/", params={"days": 31})
+    assert response.json()[0]["id"] == rat_image.id
+    response = test_client.get("/images/trending/", params={"days": 365})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_get_images_with_etag(
+    test_client: TestClient,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    response = test_client.get("/images/")
+    etag = response.headers["etag"]
+    assert response.status_code == status.HTTP_200_OK
+
+    response = test_client.get("/images/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    login_response = test_client.post(
+        "/login/", json={"username": "johndoe", "password": "password123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    test_client.post(
+        f"/images/{create_sample_images[0].id}/rate/",
+        headers=_pair_headers(
+            test_client, create_sample_images[0].id, create_sample_images[1].id
+        ),
+    )
+
+    response = test_client.get("/images/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
+def test_get_images_compressed(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+    mock_save_image_file: Mock,
+) -> None:
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    test_client.post(
+        "/images/bulk/",
+        files=[
+            ("media_files", (f"image-{i}.png", b"image_data", "image/png"))
+            for i in range(20)
+        ],
+    )
+
+    response = test_client.get("/images/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 20
+
+    response = test_client.get("/images/", headers={"Accept-Encoding": ""})
+    assert "content-encoding" not in response.headers
+
+
+def test_get_metrics(
+    test_client: TestClient,
+    create_test_user: models.User,
+) -> None:
+    test_client.post(
+        "/login/", json={"username": "johndoe", "password": "password123"}
+    )
+    response = test_client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="POST",route="/login/",'
+        'status="200"}'
+    ) in response.text
+    assert 'password_hash_duration_seconds_count{operation="verify"}' in (
+        response.text
+    )
+
+
+def test_get_metrics_with_token(
+    test_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(dependencies, "METRICS_TOKEN", "scraper-token")
+    response = test_client.get("/metrics")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = test_client.get(
+        "/metrics", headers={"Authorization": "Bearer wrong-token"}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = test_client.get(
+        "/metrics", headers={"Authorization": "Bearer scraper-token"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_profile_worker(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+) -> None:
+    response = test_client.get("/admin/profile/", params={"seconds": 0.05})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    response = test_client.get(
+        "/admin/profile/", params={"seconds": 0.05, "interval_ms": 1}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    stack, count = response.text.splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack
+    assert int(count) >= 1
+
+
+def test_get_pool_stats(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+) -> None:
+    response = test_client.get("/admin/database/pools/")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    response = test_client.get("/admin/database/pools/")
+    assert response.status_code == status.HTTP_200_OK
+    primary_pool = response.json()["primary"]
+    assert primary_pool["pool_class"] == "QueuePool"
+    assert {
+        "checked_out",
+        "idle",
+        "overflow",
+        "checkouts",
+    } <= primary_pool.keys()
+
+
+def test_rate_image_is_rate_limited(
+    test_client: TestClient,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(rate_limiting.vote_rate_limit, "capacity", 1)
+    monkeypatch.setattr(
+        rate_limiting.vote_rate_limit,
+        "store",
+        rate_limiting.MemoryBucketStore(max_buckets=10),
+    )
+    login_response = test_client.post(
+        "/login/", json={"username": "johndoe", "password": "password123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+
+    image_id, other_image_id = (
+        create_sample_images[0].id,
+        create_sample_images[1].id,
+    )
+    response = test_client.post(
+        f"/images/{image_id}/rate/",
+        headers=_pair_headers(test_client, image_id, other_image_id),
+    )
+    assert response.status_code == status.HTTP_200_OK
+    headers = _pair_headers(test_client, other_image_id, image_id)
+    response = test_client.post(f"/images/{image_id}/rate/", headers=headers)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # The refused vote did not use up its pair
+    monkeypatch.setattr(
+        rate_limiting.vote_rate_limit,
+        "store",
+        rate_limiting.MemoryBucketStore(max_buckets=10),
+    )
+    response = test_client.post(f"/images/{image_id}/rate/", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_get_images_by_ids(
+    test_client: TestClient,
+    create_sample_images: list[models.Image],
+) -> None:
+    image_ids = [db_image.id for db_image in reversed(create_sample_images)]
+    response = test_client.get(
+        "/images/", params={"ids": ",".join(map(str, [*image_ids, 999999]))}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert [image["id"] for image in response.json()] == image_ids
+
+    response = test_client.get(
+        "/images/", params={"ids": ",".join(map(str, range(1, 102)))}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_search_images(
+    test_client: TestClient,
+    test_db_session: models.Session,
+    mock_save_image_file: Mock,
+) -> None:
+    for alt_text in ("A red car", "A red bus", "A blue car"):
+        crud.create_image(
+            db=test_db_session,
+            image=schemas.ImageCreate(
+                media_file=UploadFile(
+                    file=io.BytesIO(b"image_data"),
+                    filename="vehicle.jpg",
+                    size=len(b"image_data"),
+                ),
+                alt_text=alt_text,
+            ),
+        )
+
+    response = test_client.get("/images/search/", params={"q": "car"})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert {image["alt_text"] for image in data["results"]} == {
+        "A red car",
+        "A blue car",
+    }
+    assert data["next_cursor"] is None
+
+    found_alt_texts = []
+    params = {"q": "red", "limit": 1}
+    while True:
+        data = test_client.get("/images/search/", params=params).json()
+        found_alt_texts.extend(image["alt_text"] for image in data["results"])
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+    assert sorted(found_alt_texts) == ["A red bus", "A red car"]
+
+    response = test_client.get(
+        "/images/search/", params={"q": "red", "cursor": "not-a-cursor"}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_categories(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+    create_sample_images: list[models.Image],
+    mock_save_image_file: Mock,
+) -> None:
+    response = test_client.post(
+        "/categories/", json={"slug": "animals", "name": "Animals"}
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    response = test_client.post(
+        "/categories/", json={"slug": "animals", "name": "Animals"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["slug"] == "animals"
+    response = test_client.post(
+        "/categories/", json={"slug": "animals", "name": "Animals"}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = test_client.post(
+        "/images/bulk/",
+        params={"alt_text": "An animal", "category": "animals"},
+        files=[
+            ("media_files", (f"animal-{i}.png", b"image_data", "image/png"))
+            for i in range(3)
+        ],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    category_image_ids = {image["id"] for image in response.json()}
+
+    response = test_client.get("/categories/animals/images/random/")
+    assert response.status_code == status.HTTP_200_OK
+    random_ids = [image["id"] for image in response.json()]
+    assert len(set(random_ids)) == 2
+    assert set(random_ids) <= category_image_ids
+    assert PAIR_TOKEN_HEADER in response.headers
+
+    test_client.post(
+        f"/images/{max(category_image_ids)}/rate/",
+        headers=_pair_headers(
+            test_client, max(category_image_ids), min(category_image_ids)
+        ),
+    )
+    response = test_client.get("/categories/animals/images/top-ranked/")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert {image["id"] for image in data} == category_image_ids
+    assert data[0]["id"] == max(category_image_ids)
+
+    response = test_client.get("/categories/plants/images/random/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_random_images_in_category_deleted_meanwhile(
+    monkeypatch: pytest.MonkeyPatch,
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    db_category = crud.create_category(
+        db=test_db_session,
+        category=schemas.CategoryCreate(slug="places", name="Places"),
+    )
+    cat_image, beach_image, rat_image = create_sample_images
+    cat_image.category_id = beach_image.category_id = db_category.id
+    test_db_session.commit()
+
+    def randint_then_delete(low, high):
+        # Deleted after finding the ids, before the seek reaches it
+        beach_image.deleted_at = datetime.now(timezone.utc)
+        test_db_session.flush()
+        monkeypatch.undo()
+        return beach_image.id
+
+    monkeypatch.setattr(crud.random, "randint", randint_then_delete)
+    images = crud.get_two_random_images_in_category(
+        db=test_db_session, category_id=db_category.id
+    )
+    assert [image.id for image in images] == [cat_image.id]
+
+
+def test_bulk_delete_and_purge_images(
+    test_client: TestClient,
+    test_db_session: Session,
+    create_test_admin_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    cat_image, beach_image, rat_image = create_sample_images
+    cat_image_id, beach_image_id = cat_image.id, beach_image.id
+    test_client.post(
+        f"/images/{cat_image_id}/rate/",
+        headers=_pair_headers(test_client, cat_image_id, rat_image.id),
+    )
+
+    response = test_client.post(
+        "/images/bulk-delete/",
+        json={"image_ids": [cat_image_id, beach_image_id, 0]},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"deleted": 2}
+
+    # Deleted images are gone from every read path right away
+    response = test_client.get("/images/")
+    assert [image["id"] for image in response.json()] == [rat_image.id]
+    response = test_client.get(f"/images/{cat_image_id}/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = test_client.get(
+        "/images/", params={"ids": f"{cat_image_id},{rat_image.id}"}
+    )
+    assert [image["id"] for image in response.json()] == [rat_image.id]
+    response = test_client.get("/images/search/", params={"q": "cat"})
+    assert response.json()["results"] == []
+    response = test_client.post(
+        f"/images/{beach_image_id}/rate/",
+        headers=_pair_headers(test_client, beach_image_id, rat_image.id),
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    # Their rows and ratings stay until the purge delay passes
+    response = test_client.post("/admin/images/purge/")
+    assert response.json()["images_purged"] == 0
+    response = test_client.post(
+        "/admin/images/purge/", params={"delay_seconds": 0}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["images_purged"] == 2
+    assert data["ratings_deleted"] == 1
+    assert test_db_session.get(models.Image, cat_image_id) is None
+    assert (
+        test_db_session.query(models.Rating)
+        .filter(models.Rating.image_id == cat_image_id)
+        .count()
+        == 0
+    )
+
+
+def test_export_ratings(
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    for image, other_image in zip(
+        create_sample_images,
+        create_sample_images[1:] + create_sample_images[:1],
+    ):
+        test_client.post(
+            f"/images/{image.id}/rate/",
+            headers=_pair_headers(test_client, image.id, other_image.id),
+        )
+
+    response = test_client.get("/admin/exports/ratings/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["image_id"]) for row in rows] == [
+        image.id for image in create_sample_images
+    ]
+
+    response = test_client.get(
+        "/admin/exports/ratings/", params={"after_id": rows[0]["id"]}
+    )
+    assert len(list(csv.DictReader(io.StringIO(response.text)))) == 2
+    response = test_client.get(
+        "/admin/exports/ratings/", params={"until": "2000-01-01T00:00:00"}
+    )
+    assert response.text.splitlines() == [
+        "id,user_id,image_id,loser_image_id,created_at"
+    ]
+
+
+def test_direct_upload(
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+    test_client: TestClient,
+    create_test_admin_user: models.User,
+) -> None:
+    monkeypatch.setattr(storage, "root", str(tmp_path))
+    (tmp_path / GALLERY).mkdir()
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    with open(
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "sample-image.png"
+        ),
+        "rb",
+    ) as f:
+        image_data = f.read()
+
+    response = test_client.post(
+        "/images/uploads/",
+        json={"file_name": "sample-image.png", "size": len(image_data)},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    upload = response.json()
+    assert upload["method"] == "PUT"
+
+    response = test_client.put(
+        upload["upload_url"] + "x",
+        content=image_data,
+        headers=upload["headers"],
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    response = test_client.put(
+        upload["upload_url"],
+        content=image_data + b"more",
+        headers=upload["headers"],
+    )
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    response = test_client.post(
+        "/images/uploads/complete/", json={"media_file": upload["media_file"]}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    response = test_client.put(
+        upload["upload_url"], content=image_data, headers=upload["headers"]
+    )
+    assert response.status_code == status.HTTP_200_OK
+    response = test_client.put(
+        upload["upload_url"], content=b"other", headers=upload["headers"]
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+    response = test_client.post(
+        "/images/uploads/complete/",
+        json={"media_file": upload["media_file"], "alt_text": "Sample"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["media_file"] == upload["media_file"]
+    assert (tmp_path / GALLERY / upload["media_file"]).read_bytes() == (
+        image_data
+    )
+    response = test_client.post(
+        "/images/uploads/complete/", json={"media_file": upload["media_file"]}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Its size and placeholder are left to a job
+    response = test_client.get("/admin/jobs/")
+    assert response.status_code == status.HTTP_200_OK
+    assert [
+        (stats["kind"], stats["status"], stats["count"])
+        for stats in response.json()
+    ] == [("image_metadata", "queued", 1)]
+
+
+def test_get_job(
+    test_client: TestClient,
+    test_db_session: Session,
+    create_test_admin_user: models.User,
+) -> None:
+    db_job = jobs.enqueue(
+        db=test_db_session, kind="image_metadata", payload={"image_id": 1}
+    )
+    response = test_client.get(f"/admin/jobs/{db_job.id}/")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    login_response = test_client.post(
+        "/login/", json={"username": "adminuser", "password": "testpass123"}
+    )
+    test_client.cookies.set(
+        "access_token", login_response.cookies.get("access_token")
+    )
+    response = test_client.get(f"/admin/jobs/{db_job.id}/")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["kind"] == "image_metadata"
+    assert data["status"] == "queued"
+    assert data["attempts"] == 0
+    response = test_client.get(f"/admin/jobs/{db_job.id + 1}/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,35 @@
+import contextlib
+
+from sqlalchemy.orm import Session
+
+from thinga import models
+from thinga.cache import ListingVersion
+
+
+def test_workers_tag_listings_alike(
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    def open_test_session() -> contextlib.nullcontext[Session]:
+        return contextlib.nullcontext(test_db_session)
+
+    first_worker, second_worker = (
+        ListingVersion("images", open_test_session) for _ in range(2)
+    )
+    etag = first_worker.read()
+    assert second_worker.read() == etag
+
+    first_worker.bump(test_db_session)
+    test_db_session.commit()
+    assert first_worker.read() == second_worker.read() != etag
+
+    etag = first_worker.read()
+    test_db_session.add(
+        models.Rating(
+            user_id=create_test_user.id, image_id=create_sample_images[0].id
+        )
+    )
+    test_db_session.commit()
+    # Votes need no bump, their rating ids go up
+    assert second_worker.read() != etag
@@ -0,0 +1,138 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from thinga import models, cleanup
+from thinga.storage import GALLERY, LocalStorage
+
+
+def test_delete_ratings_in_batches(
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    cat_image, beach_image, _ = create_sample_images
+    test_db_session.add_all(
+        models.Rating(user_id=create_test_user.id, image_id=image.id)
+        for image in (cat_image,) * 5 + (beach_image,)
+    )
+    test_db_session.commit()
+
+    deleted_count = cleanup.delete_ratings(
+        db=test_db_session, image_ids=[cat_image.id], batch_size=2
+    )
+    assert deleted_count == 5
+    assert test_db_session.query(models.Rating).count() == 1
+
+
+def test_delete_ratings_created_after(
+    test_db_session: Session,
+    create_test_user: models.User,
+    create_sample_images: list[models.Image],
+) -> None:
+    cat_image = create_sample_images[0]
+    now = datetime.now(timezone.utc)
+    test_db_session.add_all(
+        models.Rating(
+            user_id=create_test_user.id,
+            image_id=cat_image.id,
+            created_at=now - timedelta(days=days),
+        )
+        for days in (0, 1, 40)
+    )
+    test_db_session.commit()
+
+    deleted_count = cleanup.delete_ratings(
+        db=test_db_session,
+        image_ids=[cat_image.id],
+        created_after=now - timedelta(days=2),
+    )
+    assert deleted_count == 2
+    assert test_db_session.query(models.Rating).count() == 1
+
+
+def test_remove_orphaned_files(
+    tmp_path,
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    gallery_dir = tmp_path / GALLERY
+    gallery_dir.mkdir()
+    # Sample images all point to the file the upload mock returns
+    referenced_file = gallery_dir / create_sample_images[0].media_file
+    referenced_file.write_bytes(b"kept")
+    orphaned_file = gallery_dir / "failed-upload.png"
+    orphaned_file.write_bytes(b"orphaned")
+    (gallery_dir / ".gitkeep").touch()
+    recent_file = gallery_dir / "uploading.png"
+    recent_file.write_bytes(b"recent")
+    an_hour_ago = time.time() - 3600
+    for file_path in (referenced_file, orphaned_file):
+        os.utime(file_path, (an_hour_ago, an_hour_ago))
+
+    report = cleanup.remove_orphaned_files(
+        db=test_db_session,
+        modified_before=time.time() - 60,
+        media_storage=LocalStorage(str(tmp_path), "signing-key"),
+    )
+    assert report == cleanup.CleanupReport(files_removed=1, bytes_reclaimed=8)
+    assert sorted(os.listdir(gallery_dir)) == [
+        ".gitkeep",
+        referenced_file.name,
+        recent_file.name,
+    ]
+
+
+def test_purge_used_pair_tokens(test_db_session: Session) -> None:
+    now = datetime.now(timezone.utc)
+    test_db_session.add_all(
+        [
+            models.UsedPairToken(
+                signature="expired", expires_at=now - timedelta(seconds=1)
+            ),
+            models.UsedPairToken(
+                signature="current", expires_at=now + timedelta(minutes=5)
+            ),
+        ]
+    )
+    test_db_session.commit()
+
+    assert (
+        cleanup.purge_used_pair_tokens(db=test_db_session, expired_before=now)
+        == 1
+    )
+    assert [
+        token.signature for token in test_db_session.query(models.UsedPairToken)
+    ] == ["current"]
+
+
+def test_orphaned_files_sweep_runs_in_one_worker(
+    test_db_session: Session,
+) -> None:
+    now = datetime.now(timezone.utc)
+    claimed_until = now + timedelta(minutes=5)
+    assert (
+        cleanup.claim_sweep(
+            db=test_db_session, name="orphans", claimed_until=claimed_until
+        )
+        == 0
+    )
+    # Other workers find it claimed until the interval is over
+    assert (
+        cleanup.claim_sweep(
+            db=test_db_session, name="orphans", claimed_until=claimed_until
+        )
+        is None
+    )
+    cleanup.finish_sweep(db=test_db_session, name="orphans", swept_until=42.0)
+
+    test_db_session.get(models.Sweep, "orphans").claimed_until = now
+    test_db_session.commit()
+    assert (
+        cleanup.claim_sweep(
+            db=test_db_session, name="orphans", claimed_until=claimed_until
+        )
+        == 42.0
+    )
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine
+
+from scripts import upgrade_database
+from thinga.database import ReplicaSet
+
+
+@pytest.fixture(scope="function")
+def replica_engines(tmp_path) -> list[Engine]:
+    engines = [
+        create_engine(f"sqlite:///{tmp_path / 'replica-a.sqlite3'}"),
+        create_engine(f"sqlite:///{tmp_path / 'replica-b.sqlite3'}"),
+    ]
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+def test_replicas_take_turns(replica_engines: list[Engine]) -> None:
+    replicas = ReplicaSet(
+        replica_engines, max_lag_seconds=5, health_check_seconds=10
+    )
+    replicas.check_health()
+    chosen = [replicas.choose() for _ in range(4)]
+    assert chosen == [*replica_engines, *replica_engines]
+
+
+def test_unreachable_replica_is_skipped(
+    tmp_path, replica_engines: list[Engine]
+) -> None:
+    missing_directory = os.path.join(tmp_path, "missing", "replica.sqlite3")
+    unreachable_engine = create_engine(f"sqlite:///{missing_directory}")
+    replicas = ReplicaSet(
+        [unreachable_engine, replica_engines[0]],
+        max_lag_seconds=5,
+        health_check_seconds=10,
+    )
+    replicas.check_health()
+    assert [replicas.choose() for _ in range(2)] == [replica_engines[0]] * 2
+
+
+def test_lagging_replicas_fall_back_to_primary(
+    replica_engines: list[Engine],
+) -> None:
+    replicas = ReplicaSet(
+        replica_engines, max_lag_seconds=5, health_check_seconds=10
+    )
+    replicas.measure_lag = lambda engine: 30.0
+    replicas.check_health()
+    assert replicas.choose() is None
+
+
+def test_health_changes_with_each_check(
+    replica_engines: list[Engine],
+) -> None:
+    lags = {engine: 30.0 for engine in replica_engines}
+    replicas = ReplicaSet(
+        replica_engines, max_lag_seconds=5, health_check_seconds=10
+    )
+    replicas.measure_lag = lambda engine: lags[engine]
+    assert replicas.choose() is None  # Not checked yet
+    replicas.check_health()
+    assert replicas.choose() is None
+
+    lags[replica_engines[1]] = 0.0
+    assert replicas.choose() is None  # Requests never probe themselves
+
+    replicas.check_health()
+    assert replicas.choose() is replica_engines[1]
+
+
+def test_upgrade_adds_missing_columns(tmp_path) -> None:
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.sqlite3'}")
+    with engine.begin() as connection:
+        # The images and ratings tables as the first version made them
+        connection.exec_driver_sql(
+            "CREATE TABLE images (id INTEGER PRIMARY KEY, "
+            "media_file VARCHAR(35) NOT NULL, alt_text VARCHAR(250), "
+            "score INTEGER, created_at DATETIME)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE ratings (id INTEGER PRIMARY KEY, "
+            "user_id INTEGER NOT NULL, image_id INTEGER NOT NULL, "
+            "created_at DATETIME)"
+        )
+    added = upgrade_database.upgrade(engine)
+    assert "images.category_id" in added
+    assert "ratings.loser_image_id" in added
+    assert "ix_images_category_id_score" in added
+
+    inspector = inspect(engine)
+    image_columns = {
+        column["name"] for column in inspector.get_columns("images")
+    }
+    assert {"category_id", "width", "height", "blurhash", "deleted_at"} <= (
+        image_columns
+    )
+    foreign_keys = {
+        (foreign_key["constrained_columns"][0], foreign_key["referred_table"])
+        for foreign_key in inspector.get_foreign_keys("ratings")
+    }
+    assert ("loser_image_id", "images") in foreign_keys
+    assert upgrade_database.upgrade(engine) == []
+    engine.dispose()
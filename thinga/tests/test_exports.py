@@ -0,0 +1,42 @@
+import io
+
+import pytest
+from sqlalchemy.orm import Session
+
+from thinga import models, exports
+
+
+def _export(db: Session, file_format: str, batch_size: int) -> bytes:
+    table = exports.EXPORT_TABLES["images"]
+    batches = exports.iter_batches(
+        db.connection(), exports.select_rows(table), batch_size
+    )
+    return b"".join(exports.export_chunks(table, batches, file_format))
+
+
+def test_export_csv_in_batches(
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    lines = _export(test_db_session, "csv", batch_size=2).decode().splitlines()
+    assert lines[0].startswith("id,media_file,alt_text,score")
+    assert [line.split(",")[0] for line in lines[1:]] == [
+        str(image.id) for image in create_sample_images
+    ]
+
+
+def test_export_parquet_in_row_groups(
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+    parquet_file = pyarrow_parquet.ParquetFile(
+        io.BytesIO(_export(test_db_session, "parquet", batch_size=2))
+    )
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.column("id").to_pylist() == [
+        image.id for image in create_sample_images
+    ]
+    assert table.column("alt_text")[0].as_py() == "A cute cat image"
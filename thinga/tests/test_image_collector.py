@@ -0,0 +1,219 @@
+import os
+import json
+import zlib
+import struct
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import pytest
+from aiohttp import web
+
+from scripts import image_collector
+
+
+SEARCH_PAGE = """
+<html><body style="height: 200vh">
+<script>
+  let added = 0;
+  function addTiles(count) {
+    for (let i = 0; i < count; i++, added++) {
+      const img = document.createElement("img");
+      img.className = "tile--img__img js-lazyload";
+      img.src = location.origin + "/images/" + added + ".png";
+      document.body.appendChild(img);
+    }
+    document.body.style.height = (200 + added * 10) + "vh";
+  }
+  setTimeout(() => addTiles(3), 100);
+  window.addEventListener("scroll", () => { if (added < 9) addTiles(3); });
+</script>
+</body></html>
+"""
+
+
+def _make_png(width: int, height: int, shade: int) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + chunk_type
+            + data
+            + struct.pack(">I", zlib.crc32(chunk_type + data))
+        )
+
+    row = b"\x00" + bytes([shade % 256, 0, 0]) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+@asynccontextmanager
+async def _serve(app: web.Application) -> AsyncIterator[str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def _create_stand_in_app(stats: dict) -> web.Application:
+    async def search_page(request: web.Request) -> web.Response:
+        return web.Response(text=SEARCH_PAGE, content_type="text/html")
+
+    def png_response(body: bytes) -> web.Response:
+        return web.Response(body=body, content_type="image/png")
+
+    async def image(request: web.Request) -> web.Response:
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(0.1)
+            shade = int(request.match_info["name"].split(".")[0])
+            return png_response(_make_png(200, 200, shade))
+        finally:
+            stats["in_flight"] -= 1
+
+    async def flaky_image(request: web.Request) -> web.Response:
+        stats["flaky_calls"] += 1
+        if stats["flaky_calls"] == 1:
+            return web.Response(status=503)
+        return png_response(_make_png(200, 200, 99))
+
+    async def tiny_image(request: web.Request) -> web.Response:
+        return png_response(_make_png(1, 1, 0))
+
+    async def truncated_image(request: web.Request) -> web.StreamResponse:
+        body = _make_png(200, 200, 42)
+        response = web.StreamResponse(headers={"Content-Type": "image/png"})
+        await response.prepare(request)
+        await response.write(body[: len(body) // 2])
+        return response
+
+    async def huge_image(request: web.Request) -> web.Response:
+        return png_response(_make_png(3000, 3000, 7))
+
+    app = web.Application()
+    app.router.add_get("/search", search_page)
+    app.router.add_get("/images/{name}", image)
+    app.router.add_get("/flaky.png", flaky_image)
+    app.router.add_get("/tiny.png", tiny_image)
+    app.router.add_get("/truncated.png", truncated_image)
+    app.router.add_get("/huge.png", huge_image)
+    return app
+
+
+@pytest.fixture(scope="function")
+def stats() -> dict:
+    return {"in_flight": 0, "max_in_flight": 0, "flaky_calls": 0}
+
+
+def _download(
+    stats: dict,
+    paths: list[str],
+    output_dir: str,
+    **kwargs,
+) -> list[dict]:
+    async def run() -> list[dict]:
+        async with (
+            _serve(_create_stand_in_app(stats)) as base_url,
+            image_collector.create_download_session() as session,
+        ):
+            return await image_collector.download_images(
+                session,
+                [f"{base_url}{path}" for path in paths],
+                output_dir,
+                image_collector.HashIndex(
+                    os.path.join(output_dir, "hash-index.txt")
+                ),
+                **kwargs,
+            )
+
+    return asyncio.run(run())
+
+
+def test_download_images_in_bounded_pool(tmp_path, stats: dict) -> None:
+    records = _download(
+        stats,
+        [f"/images/{i}.png" for i in range(8)],
+        str(tmp_path),
+        concurrency=3,
+    )
+    assert len(records) == 8
+    assert all(os.path.exists(tmp_path / record["file"]) for record in records)
+    assert 1 < stats["max_in_flight"] <= 3
+
+
+def test_download_images_retries_server_errors(tmp_path, stats: dict) -> None:
+    records = _download(stats, ["/flaky.png"], str(tmp_path))
+    assert len(records) == 1
+    assert stats["flaky_calls"] == 2
+
+
+def test_download_images_drops_invalid_images(tmp_path, stats: dict) -> None:
+    records = _download(
+        stats,
+        ["/tiny.png", "/truncated.png", "/huge.png", "/images/1.png"],
+        str(tmp_path),
+        rules=image_collector.ValidationRules(
+            min_width=100, min_height=100, max_bytes=16 * 1024
+        ),
+    )
+    assert [record["source_url"].split("/")[-1] for record in records] == [
+        "1.png"
+    ]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [records[0]["file"], "hash-index.txt", "manifest.jsonl"]
+    )
+
+
+def test_download_images_drops_duplicates_across_runs(
+    tmp_path,
+    stats: dict,
+) -> None:
+    first_records = _download(
+        stats, ["/images/1.png", "/images/2.png"], str(tmp_path)
+    )
+    second_records = _download(
+        stats, ["/images/2.png", "/images/3.png"], str(tmp_path), query="cats"
+    )
+    assert len(first_records) == 2
+    assert [record["source_url"][-5:] for record in second_records] == ["3.png"]
+    with open(tmp_path / "manifest.jsonl") as f:
+        manifest = [json.loads(line) for line in f]
+    assert sorted(record["sha256"] for record in manifest) == sorted(
+        record["sha256"] for record in first_records + second_records
+    )
+    assert manifest[-1]["query"] == "cats"
+    assert (manifest[-1]["width"], manifest[-1]["height"]) == (200, 200)
+
+
+def test_collect_image_urls_scrolls_past_first_page(stats: dict) -> None:
+    async def run() -> list[str]:
+        async with (
+            _serve(_create_stand_in_app(stats)) as base_url,
+            image_collector.async_playwright() as p,
+        ):
+            try:
+                browser = await p.chromium.launch(headless=True)
+            except Exception as e:
+                pytest.skip(f"Chromium is not available: {e}")
+            page = await browser.new_page()
+            image_urls = await image_collector.collect_image_urls(
+                page,
+                "cats",
+                max_images=7,
+                search_url_template=f"{base_url}/search?q={{query}}",
+                load_timeout=5,
+            )
+            await browser.close()
+            return image_urls
+
+    image_urls = asyncio.run(run())
+    assert len(image_urls) == 7
@@ -0,0 +1,113 @@
+import os
+import json
+import asyncio
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+
+from thinga import metrics
+from thinga.invalidation import (
+    InvalidationBus,
+    PostgreSQLTransport,
+    SocketTransport,
+    create_transport,
+)
+
+
+def _subscribe(bus: InvalidationBus, topic: str) -> list:
+    received = []
+    bus.subscribe(topic, received.append)
+    return received
+
+
+@pytest.fixture
+def socket_dir():
+    # Unix socket paths are short, too short for the temporary directories
+    # of pytest and its workers
+    with tempfile.TemporaryDirectory(prefix="thinga-") as directory:
+        yield directory
+
+
+def test_events_reach_other_workers(socket_dir: str) -> None:
+    async def run() -> tuple[list, list]:
+        sender, listener = InvalidationBus(), InvalidationBus()
+        sent = _subscribe(sender, "users")
+        received = _subscribe(listener, "users")
+        await sender.start(SocketTransport(socket_dir))
+        await listener.start(SocketTransport(socket_dir))
+
+        sender.publish("users", "7")
+        sender.publish("users", "8")
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await sender.stop()
+        await listener.stop()
+        return sent, received
+
+    sent, received = asyncio.run(run())
+    assert sent == ["7", "8"]  # Applied locally, not again on the echo
+    assert received == ["7", "8"]
+    assert metrics.cache_invalidation_propagation.values[("socket",)]
+    assert os.listdir(socket_dir) == []
+
+
+def test_socket_directory_too_long() -> None:
+    with pytest.raises(ValueError, match="too long"):
+        SocketTransport("/tmp/" + "d" * 100)
+
+
+def test_lost_events_clear_every_cache() -> None:
+    bus = InvalidationBus()
+    users = _subscribe(bus, "users")
+    images = _subscribe(bus, "images")
+
+    def event(version: int) -> str:
+        return json.dumps(
+            {
+                "origin": "other",
+                "version": version,
+                "topic": "users",
+                "key": str(version),
+                "sent_at": 0,
+            }
+        )
+
+    bus.transport = SocketTransport("unused")
+    bus.receive(event(1))
+    bus.receive(event(1))  # Delivered twice
+    bus.receive(event(3))
+    assert users == ["1", None]
+    assert images == [None]
+
+
+def test_postgresql_transport_refuses_what_cannot_listen() -> None:
+    engine = create_engine("sqlite://")
+    with pytest.raises(ValueError, match="external pooler"):
+        create_transport(
+            "postgresql", engine=engine, socket_dir="", external_pooler=True
+        )
+    with pytest.raises(ValueError, match="postgresql\\+psycopg2"):
+        create_transport("postgresql", engine=engine, socket_dir="")
+
+
+def test_listener_failures_are_reported(caplog) -> None:
+    transport = PostgreSQLTransport(create_engine("sqlite://"))
+
+    async def fail(receive, reset) -> None:
+        raise AttributeError("no notifies here")
+
+    transport._listen = fail
+    failures = metrics.cache_invalidation_listener_failures.values
+    failures_before = failures.get(("postgresql",), 0)
+
+    async def run() -> None:
+        await transport.start(lambda payload: None, lambda: None)
+        await asyncio.sleep(0)
+        await transport.stop()
+
+    asyncio.run(run())
+    assert "Stopped listening" in caplog.text
+    assert failures[("postgresql",)] == failures_before + 1
@@ -0,0 +1,236 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm import Session
+
+from thinga import models, enums, jobs
+from thinga.storage import GALLERY, storage
+
+calls = []
+
+
+@jobs.register("test_job", max_attempts=2)
+def record_call(db: Session, payload: dict) -> None:
+    calls.append(payload)
+    if payload.get("fail"):
+        raise ValueError("asked to fail")
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+def test_claim_by_priority_then_due_time(test_db_session: Session) -> None:
+    low = jobs.enqueue(db=test_db_session, kind="test_job", payload={"n": 1})
+    high = jobs.enqueue(
+        db=test_db_session, kind="test_job", payload={"n": 2}, priority=5
+    )
+    jobs.enqueue(
+        db=test_db_session,
+        kind="test_job",
+        payload={"n": 3},
+        priority=9,
+        delay_seconds=60,
+    )
+
+    claimed = [
+        jobs.claim_job(db=test_db_session, kinds=["test_job"], worker_id="a")
+        for _ in range(3)
+    ]
+    assert [db_job and db_job.id for db_job in claimed] == [
+        high.id,
+        low.id,
+        None,
+    ]
+    assert claimed[0].status == enums.JobStatus.RUNNING
+    assert claimed[0].attempts == 1
+    assert claimed[0].locked_by == "a"
+    assert (
+        jobs.claim_job(db=test_db_session, kinds=["other"], worker_id="a")
+        is None
+    )
+
+
+def test_run_job_retries_then_fails(test_db_session: Session) -> None:
+    db_job = jobs.enqueue(
+        db=test_db_session, kind="test_job", payload={"fail": True}
+    )
+    assert db_job.max_attempts == 2
+
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="a"
+    )
+    jobs.run_job(db=test_db_session, db_job=claimed)
+    assert claimed.status == enums.JobStatus.QUEUED
+    assert claimed.last_error == "ValueError: asked to fail"
+    # Backed off, so not due yet
+    assert (
+        jobs.claim_job(db=test_db_session, kinds=["test_job"], worker_id="a")
+        is None
+    )
+
+    claimed.run_at = datetime.now(timezone.utc)
+    test_db_session.commit()
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="a"
+    )
+    jobs.run_job(db=test_db_session, db_job=claimed)
+    assert claimed.status == enums.JobStatus.FAILED
+    assert claimed.attempts == 2
+    assert claimed.finished_at is not None
+    assert len(calls) == 2
+
+
+def test_run_job_succeeds(test_db_session: Session) -> None:
+    jobs.enqueue(db=test_db_session, kind="test_job", payload={"n": 1})
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="a"
+    )
+    jobs.run_job(db=test_db_session, db_job=claimed)
+    assert claimed.status == enums.JobStatus.SUCCEEDED
+    assert claimed.locked_by is None
+    assert calls == [{"n": 1}]
+    stats = jobs.get_queue_stats(db=test_db_session)
+    assert [(row.kind, row.status, row.count) for row in stats] == [
+        ("test_job", enums.JobStatus.SUCCEEDED, 1)
+    ]
+
+
+def test_reclaim_after_lease_ends(test_db_session: Session) -> None:
+    jobs.enqueue(db=test_db_session, kind="test_job")
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="a"
+    )
+    # Still leased to the first worker
+    assert (
+        jobs.claim_job(db=test_db_session, kinds=["test_job"], worker_id="b")
+        is None
+    )
+
+    claimed.run_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    test_db_session.commit()
+    reclaimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="b"
+    )
+    assert reclaimed.id == claimed.id
+    assert reclaimed.attempts == 2
+    assert reclaimed.locked_by == "b"
+
+
+def test_lease_ending_on_last_attempt_fails(test_db_session: Session) -> None:
+    jobs.enqueue(db=test_db_session, kind="test_job")
+    for worker_id in ("a", "b"):
+        claimed = jobs.claim_job(
+            db=test_db_session, kinds=["test_job"], worker_id=worker_id
+        )
+        # The worker died running it
+        claimed.run_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        test_db_session.commit()
+
+    assert (
+        jobs.claim_job(db=test_db_session, kinds=["test_job"], worker_id="c")
+        is None
+    )
+    test_db_session.refresh(claimed)
+    assert claimed.status == enums.JobStatus.FAILED
+    assert claimed.attempts == 2
+    assert calls == []
+
+
+def test_run_job_after_losing_lease(test_db_session: Session) -> None:
+    jobs.enqueue(db=test_db_session, kind="test_job", payload={"n": 1})
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="a"
+    )
+    # What worker "a" loaded, before its lease ran out and "b" took over
+    stale = models.Job(
+        id=claimed.id,
+        kind=claimed.kind,
+        payload=claimed.payload,
+        attempts=claimed.attempts,
+        max_attempts=claimed.max_attempts,
+        locked_by="a",
+    )
+    claimed.run_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    test_db_session.commit()
+    reclaimed = jobs.claim_job(
+        db=test_db_session, kinds=["test_job"], worker_id="b"
+    )
+
+    jobs.run_job(db=test_db_session, db_job=stale)
+    test_db_session.refresh(reclaimed)
+    assert reclaimed.status == enums.JobStatus.RUNNING
+    assert reclaimed.locked_by == "b"
+    jobs.run_job(db=test_db_session, db_job=reclaimed)
+    assert reclaimed.status == enums.JobStatus.SUCCEEDED
+    assert calls == [{"n": 1}, {"n": 1}]
+
+
+def test_fill_image_metadata(
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+    test_db_session: Session,
+) -> None:
+    monkeypatch.setattr(storage, "root", str(tmp_path))
+    published = []
+    monkeypatch.setattr(
+        jobs.bus, "publish", lambda topic, key=None: published.append(topic)
+    )
+    (tmp_path / GALLERY).mkdir()
+    with open(
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "sample-image.png"
+        ),
+        "rb",
+    ) as f:
+        (tmp_path / GALLERY / "uploaded.png").write_bytes(f.read())
+    db_image = models.Image(media_file="uploaded.png")
+    test_db_session.add(db_image)
+    test_db_session.flush()
+    jobs.enqueue(
+        db=test_db_session,
+        kind="image_metadata",
+        payload={"image_id": db_image.id},
+    )
+
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["image_metadata"], worker_id="a"
+    )
+    jobs.run_job(db=test_db_session, db_job=claimed)
+    assert claimed.status == enums.JobStatus.SUCCEEDED
+    test_db_session.refresh(db_image)
+    assert db_image.width > 0
+    assert db_image.blurhash
+    assert published == ["images"]
+
+
+def test_fill_image_metadata_of_non_image(
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+    test_db_session: Session,
+) -> None:
+    monkeypatch.setattr(storage, "root", str(tmp_path))
+    monkeypatch.setattr(jobs.bus, "publish", lambda topic, key=None: None)
+    (tmp_path / GALLERY).mkdir()
+    (tmp_path / GALLERY / "uploaded.png").write_bytes(b"not an image")
+    db_image = models.Image(media_file="uploaded.png")
+    test_db_session.add(db_image)
+    test_db_session.flush()
+    jobs.enqueue(
+        db=test_db_session,
+        kind="image_metadata",
+        payload={"image_id": db_image.id},
+    )
+
+    claimed = jobs.claim_job(
+        db=test_db_session, kinds=["image_metadata"], worker_id="a"
+    )
+    jobs.run_job(db=test_db_session, db_job=claimed)
+    # Failed for good on the first attempt, the image goes with it
+    assert claimed.status == enums.JobStatus.FAILED
+    assert claimed.attempts == 1
+    assert "not an image" in claimed.last_error
+    test_db_session.refresh(db_image)
+    assert db_image.deleted_at is not None
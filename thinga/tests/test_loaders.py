@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from thinga import models
+from thinga.loaders import Loaders
+
+
+def _count_selects(db: Session) -> list[str]:
+    statements = []
+
+    @event.listens_for(db.connection(), "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    return statements
+
+
+def test_concurrent_loads_share_one_query(
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    loaders = Loaders(test_db_session)
+    image_ids = [db_image.id for db_image in create_sample_images]
+    statements = _count_selects(test_db_session)
+
+    async def load_cards() -> list:
+        return await asyncio.gather(
+            *(loaders.images.load(image_id) for image_id in image_ids),
+            loaders.images.load(-1),
+        )
+
+    *db_images, missing_image = asyncio.run(load_cards())
+    assert [db_image.id for db_image in db_images] == image_ids
+    assert missing_image is None
+    assert len(statements) == 1
+
+
+def test_loaded_keys_are_cached(
+    test_db_session: Session,
+    create_sample_images: list[models.Image],
+) -> None:
+    loaders = Loaders(test_db_session)
+    image_id = create_sample_images[0].id
+    statements = _count_selects(test_db_session)
+
+    async def load_twice() -> tuple:
+        first_image = await loaders.images.load(image_id)
+        second_image = await loaders.images.load(image_id)
+        return first_image, second_image
+
+    first_image, second_image = asyncio.run(load_twice())
+    assert first_image is second_image
+    assert first_image.id == image_id
+    assert len(statements) == 1
+
+
+def test_user_and_profile_load_off_the_event_loop(
+    test_db_session: Session,
+    create_test_user: models.User,
+) -> None:
+    loaders = Loaders(test_db_session)
+    user_id = create_test_user.id
+    test_db_session.expunge_all()
+    statements = _count_selects(test_db_session)
+    query_threads = set()
+    event.listen(
+        test_db_session.connection(),
+        "before_cursor_execute",
+        lambda *args: query_threads.add(threading.get_ident()),
+    )
+
+    db_user = asyncio.run(loaders.load_user(user_id))
+    assert db_user.profile.display_name == "John Doe"
+    assert len(statements) == 2  # One per table, none lazy
+    assert threading.get_ident() not in query_threads
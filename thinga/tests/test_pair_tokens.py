@@ -0,0 +1,85 @@
+import pytest
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from thinga import models
+from thinga.pair_tokens import PairTokens
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _refused(tokens: PairTokens, token: str, access_token: str) -> int:
+    with pytest.raises(HTTPException) as e:
+        tokens.redeem(token, access_token)
+    return e.value.status_code
+
+
+def test_redeem_once() -> None:
+    tokens = PairTokens("signing-key", 60)
+    token = tokens.issue((3, 7), "access-token")
+    assert tokens.redeem(token, "access-token") == (3, 7)
+    assert _refused(tokens, token, "access-token") == status.HTTP_409_CONFLICT
+    # The same pair served again is another vote
+    assert tokens.redeem(tokens.issue((3, 7), "access-token"), "access-token")
+
+
+def test_verify_does_not_use_up() -> None:
+    tokens = PairTokens("signing-key", 60)
+    token = tokens.issue((3, 7), "access-token")
+    assert tokens.verify(token, "access-token") == (3, 7)
+    assert tokens.redeem(token, "access-token") == (3, 7)
+    with pytest.raises(HTTPException) as e:
+        tokens.verify(token, "access-token")
+    assert e.value.status_code == status.HTTP_409_CONFLICT
+
+
+def test_redeem_once_across_workers(test_db_session: Session) -> None:
+    first_worker = PairTokens("signing-key", 60)
+    second_worker = PairTokens("signing-key", 60)
+    token = first_worker.issue((3, 7), "access-token")
+    image_ids = first_worker.redeem(token, "access-token", test_db_session)
+    assert image_ids == (3, 7)
+    test_db_session.commit()
+    with pytest.raises(HTTPException) as e:
+        second_worker.redeem(token, "access-token", test_db_session)
+    assert e.value.status_code == status.HTTP_409_CONFLICT
+    assert test_db_session.query(models.UsedPairToken).count() == 1
+
+
+def test_redeem_refuses_forged_and_foreign_tokens() -> None:
+    tokens = PairTokens("signing-key", 60)
+    token = tokens.issue((3, 7), "access-token")
+    assert _refused(tokens, token, "other-token") == status.HTTP_400_BAD_REQUEST
+    assert _refused(tokens, token, None) == status.HTTP_400_BAD_REQUEST
+    assert (
+        _refused(tokens, "not-a-token", "access-token")
+        == status.HTTP_400_BAD_REQUEST
+    )
+    forged = PairTokens("other-key", 60).issue((3, 7), "access-token")
+    assert (
+        _refused(tokens, forged, "access-token") == status.HTTP_400_BAD_REQUEST
+    )
+    # Refused tokens are not used up
+    assert tokens.redeem(token, "access-token") == (3, 7)
+
+
+def test_redeem_refuses_stale_tokens_and_forgets_them() -> None:
+    clock = FakeClock()
+    tokens = PairTokens("signing-key", 60, clock=clock)
+    used_token = tokens.issue((1, 2), "access-token")
+    tokens.redeem(used_token, "access-token")
+    stale_token = tokens.issue((3, 7), "access-token")
+
+    clock.now += 60
+    assert (
+        _refused(tokens, stale_token, "access-token")
+        == status.HTTP_400_BAD_REQUEST
+    )
+    tokens.redeem(tokens.issue((5, 6), "access-token"), "access-token")
+    assert len(tokens._used) == 1
@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+
+from thinga import models, partitions
+
+
+def test_primary_key_holds_partition_key() -> None:
+    ddl = str(
+        CreateTable(models.Rating.__table__).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    assert "PRIMARY KEY (id, created_at)" in ddl
+    assert "PARTITION BY RANGE (created_at)" in ddl
+    ddl = str(
+        CreateTable(models.Rating.__table__).compile(dialect=sqlite.dialect())
+    )
+    assert "PRIMARY KEY (id)" in ddl
+
+
+def test_month_start() -> None:
+    moment = datetime(2026, 12, 15, 8, 30, tzinfo=timezone.utc)
+    assert partitions.month_start(moment) == datetime(2026, 12, 1)
+    assert partitions.month_start(moment, 1) == datetime(2027, 1, 1)
+    assert partitions.month_start(moment, -12) == datetime(2025, 12, 1)
+    assert (
+        partitions.partition_name("ratings", datetime(2027, 1, 1))
+        == "ratings_2027_01"
+    )
+
+
+def test_expired_partitions() -> None:
+    assert partitions.expired_partitions(
+        "ratings",
+        [
+            "ratings_2026_03",
+            "ratings_2025_12",
+            "ratings_2026_04",
+            "ratings_default",
+            "ratings_2026_01_old",
+        ],
+        before=datetime(2026, 4, 1),
+    ) == ["ratings_2025_12", "ratings_2026_03"]
+
+
+def test_maintain_partitions(test_engine: Engine) -> None:
+    now = datetime(2100, 1, 20, tzinfo=timezone.utc)
+    report = partitions.maintain_partitions(
+        test_engine, now=now, months_ahead=1, retention_months=0
+    )
+    if test_engine.dialect.name != "postgresql":
+        assert report == partitions.PartitionReport()
+        return None
+
+    assert report == partitions.PartitionReport(partitions_created=2)
+    with test_engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        names = ["ratings_2100_01", "ratings_2100_02"]
+        assert set(names) <= set(
+            partitions.list_partitions(connection, "ratings")
+        )
+        try:
+            assert (
+                partitions.detach_partitions(
+                    connection, "ratings", names, "test_archive"
+                )
+                == names
+            )
+            assert not set(names) & set(
+                partitions.list_partitions(connection, "ratings")
+            )
+            archived = inspect(connection).get_table_names(
+                schema="test_archive"
+            )
+            assert sorted(archived) == names
+            assert not inspect(connection).get_foreign_keys(
+                names[0], schema="test_archive"
+            )
+        finally:
+            connection.exec_driver_sql(
+                "DROP SCHEMA IF EXISTS test_archive CASCADE"
+            )
+            for name in names:
+                connection.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
@@ -0,0 +1,54 @@
+import time
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from thinga import profiling
+
+
+def _busy(seconds: float) -> None:
+    finish_at = time.perf_counter() + seconds
+    while time.perf_counter() < finish_at:
+        pass
+
+
+def test_request_profile_holds_only_its_own_work() -> None:
+    app = FastAPI()
+
+    @app.get("/profiled/")
+    def profiled_handler() -> dict:
+        _busy(0.1)
+        return {}
+
+    @app.get("/concurrent/")
+    async def concurrent_handler() -> dict:
+        for _ in range(20):
+            _busy(0.005)
+            await asyncio.sleep(0)
+        return {}
+
+    app.add_middleware(
+        profiling.RequestProfilerMiddleware,
+        route="/profiled/",
+        every_n_requests=1,
+    )
+
+    async def run() -> None:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            await asyncio.gather(
+                client.get("/profiled/"), client.get("/concurrent/")
+            )
+
+    asyncio.run(run())
+    trace = next(
+        trace
+        for trace in profiling.slow_traces.slowest()
+        if trace["path"] == "/profiled/"
+    )
+    # The sync handler runs in the threadpool, the concurrent one on the loop
+    assert "profiled_handler" in trace["profile"]
+    assert "concurrent_handler" not in trace["profile"]
@@ -0,0 +1,103 @@
+import pytest
+from fastapi import HTTPException, status
+
+from thinga.rate_limiting import (
+    Bucket,
+    MemoryBucketStore,
+    SQLiteBucketStore,
+    RateLimit,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_memory_store_refills_over_time() -> None:
+    clock = FakeClock()
+    store = MemoryBucketStore(max_buckets=10, clock=clock)
+    assert [store.take([Bucket("key", 2, 1.0)]) for _ in range(2)] == [0, 0]
+    assert store.take([Bucket("key", 2, 1.0)]) == pytest.approx(1.0)
+
+    clock.now += 1
+    assert store.take([Bucket("key", 2, 1.0)]) == 0
+
+
+def test_memory_store_stays_bounded() -> None:
+    clock = FakeClock()
+    store = MemoryBucketStore(max_buckets=3, clock=clock)
+    for i in range(10):
+        store.take([Bucket(f"key-{i}", 5, 1.0)])
+    assert len(store) == 3
+
+    # Buckets that filled up again while idle are dropped
+    clock.now += 60
+    store.take([Bucket("key-new", 5, 1.0)])
+    assert len(store) == 1
+
+
+def test_sqlite_store_is_shared(tmp_path) -> None:
+    path = str(tmp_path / "rate-limits.sqlite3")
+    clock = FakeClock()
+    first_worker = SQLiteBucketStore(path, max_buckets=10, clock=clock)
+    second_worker = SQLiteBucketStore(path, max_buckets=10, clock=clock)
+    assert first_worker.take([Bucket("key", 2, 0.5)]) == 0
+    assert second_worker.take([Bucket("key", 2, 0.5)]) == 0
+    assert first_worker.take([Bucket("key", 2, 0.5)]) == pytest.approx(2.0)
+
+
+def test_sqlite_store_purges_idle_buckets(tmp_path) -> None:
+    clock = FakeClock()
+    store = SQLiteBucketStore(
+        str(tmp_path / "rate-limits.sqlite3"),
+        max_buckets=2,
+        purge_every=5,
+        clock=clock,
+    )
+    for i in range(5):
+        store.take([Bucket(f"key-{i}", 5, 1.0)])
+    connection = store._connect()
+    count_sql = "SELECT COUNT(*) FROM rate_limit_buckets"
+    assert connection.execute(count_sql).fetchone() == (2,)
+
+
+def test_rate_limit_rejects_with_retry_after() -> None:
+    rate_limit = RateLimit(
+        "vote",
+        "1/10",
+        "2/10",
+        MemoryBucketStore(max_buckets=10, clock=FakeClock()),
+    )
+    rate_limit.check(1, "client")
+    with pytest.raises(HTTPException) as exc_info:
+        rate_limit.check(1, "client")
+    assert exc_info.value.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert exc_info.value.headers["Retry-After"] == "10"
+
+    # Another account on the same client has a budget of its own, until
+    # the client's runs out
+    rate_limit.check(2, "client")
+    with pytest.raises(HTTPException):
+        rate_limit.check(3, "client")
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_refused_requests_are_not_charged(tmp_path, shared: bool) -> None:
+    clock = FakeClock()
+    store = (
+        SQLiteBucketStore(
+            str(tmp_path / "rate-limits.sqlite3"), max_buckets=10, clock=clock
+        )
+        if shared
+        else MemoryBucketStore(max_buckets=10, clock=clock)
+    )
+    rate_limit = RateLimit("vote", "1/10", "1/10", store)
+    rate_limit.check(1, "client")
+    # Refused by the client bucket, the user's token is left alone
+    with pytest.raises(HTTPException):
+        rate_limit.check(2, "client")
+    rate_limit.check(2, "other-client")
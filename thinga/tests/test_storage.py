@@ -0,0 +1,85 @@
+import io
+import os
+import uuid
+import urllib.request
+from typing import Iterator
+
+import pytest
+
+from thinga.storage import GALLERY, LocalStorage, S3Storage, Storage
+
+# S3 tests run against a MinIO server, e.g. one started with
+# `docker run -p 9000:9000 minio/minio server /data`
+S3_TEST_ENDPOINT_URL = os.environ.get("TEST_S3_ENDPOINT_URL")
+
+
+@pytest.fixture(params=["local", "s3"])
+def media_storage(
+    request: pytest.FixtureRequest, tmp_path
+) -> Iterator[Storage]:
+    if request.param == "local":
+        (tmp_path / GALLERY).mkdir()
+        yield LocalStorage(str(tmp_path), "signing-key")
+        return None
+
+    pytest.importorskip("boto3")
+    if S3_TEST_ENDPOINT_URL is None:
+        pytest.skip("TEST_S3_ENDPOINT_URL is not set.")
+    s3_storage = S3Storage(
+        f"thinga-test-{uuid.uuid4().hex[:8]}",
+        endpoint_url=S3_TEST_ENDPOINT_URL,
+        region="us-east-1",
+        access_key_id=os.environ.get("TEST_S3_ACCESS_KEY_ID", "minioadmin"),
+        secret_access_key=os.environ.get(
+            "TEST_S3_SECRET_ACCESS_KEY", "minioadmin"
+        ),
+    )
+    s3_storage.client.create_bucket(Bucket=s3_storage.bucket)
+    yield s3_storage
+    for stored_file in s3_storage.list(GALLERY):
+        s3_storage.delete(GALLERY, stored_file.name)
+    s3_storage.client.delete_bucket(Bucket=s3_storage.bucket)
+
+
+def test_store_list_and_delete(media_storage: Storage) -> None:
+    assert media_storage.save(GALLERY, "a.png", io.BytesIO(b"image")) == 5
+    assert media_storage.read(GALLERY, "a.png") == b"image"
+    assert media_storage.size(GALLERY, "a.png") == 5
+    assert [stored.name for stored in media_storage.list(GALLERY)] == ["a.png"]
+
+    assert media_storage.delete(GALLERY, "a.png") == 5
+    assert media_storage.delete(GALLERY, "a.png") is None
+    assert media_storage.size(GALLERY, "a.png") is None
+
+
+def test_direct_upload_to_s3(media_storage: Storage) -> None:
+    if isinstance(media_storage, LocalStorage):
+        pytest.skip("Local uploads go through the API, see `test_apis`.")
+
+    upload = media_storage.create_upload(
+        GALLERY, "b.png", "image/png", 5, expires_in=60
+    )
+    request = urllib.request.Request(
+        upload.url, data=b"image", headers=upload.headers, method=upload.method
+    )
+    with urllib.request.urlopen(request) as response:
+        assert response.status == 200
+    assert media_storage.read(GALLERY, "b.png") == b"image"
+
+
+def test_local_upload_tokens(tmp_path) -> None:
+    local_storage = LocalStorage(str(tmp_path), "signing-key")
+    upload = local_storage.create_upload(
+        GALLERY, "c.png", "image/png", 5, expires_in=60
+    )
+    token = upload.url.removeprefix("/uploads/")
+    assert local_storage.verify_upload(token)["file_name"] == "c.png"
+    assert LocalStorage(str(tmp_path), "other-key").verify_upload(token) is None
+
+    expired = local_storage.create_upload(
+        GALLERY, "c.png", "image/png", 5, expires_in=-1
+    )
+    assert (
+        local_storage.verify_upload(expired.url.removeprefix("/uploads/"))
+        is None
+    )
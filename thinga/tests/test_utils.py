@@ -0,0 +1,56 @@
+import io
+
+from PIL import Image
+from starlette.requests import Request
+
+from thinga import utils
+
+
+def _encode(image: Image.Image, image_format: str, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def test_read_image_metadata() -> None:
+    image = Image.new("RGB", (100, 50), (255, 0, 0))
+    metadata = utils.read_image_metadata(_encode(image, "PNG"))
+    assert (metadata.width, metadata.height) == (100, 50)
+    # Four by three components take 28 characters, the average color is
+    # held in the four after the size flags
+    assert len(metadata.blurhash) == 28
+    assert metadata.blurhash[2:6] == utils._encode_base83(0xFF0000, 4)
+
+
+def test_read_image_metadata_follows_exif_orientation() -> None:
+    image = Image.new("RGB", (100, 50), (0, 0, 255))
+    exif = image.getexif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    metadata = utils.read_image_metadata(_encode(image, "JPEG", exif=exif))
+    assert (metadata.width, metadata.height) == (50, 100)
+
+
+def test_read_image_metadata_of_invalid_image() -> None:
+    assert utils.read_image_metadata(b"image_data") == utils.ImageMetadata()
+
+
+def test_generate_client_key() -> None:
+    def request(host: str) -> Request:
+        return Request(
+            {
+                "type": "http",
+                "headers": [(b"user-agent", b"Firefox")],
+                "client": (host, 5000),
+            }
+        )
+
+    # Same browser and locale, different clients
+    assert utils.generate_client_fingerprint(
+        request("10.0.0.1")
+    ) == utils.generate_client_fingerprint(request("10.0.0.2"))
+    assert utils.generate_client_key(
+        request("10.0.0.1")
+    ) != utils.generate_client_key(request("10.0.0.2"))
+    assert utils.generate_client_key(
+        request("10.0.0.1")
+    ) == utils.generate_client_key(request("10.0.0.1"))
@@ -1,33 +1,196 @@
+import io
 import os
+import math
+import time
 import uuid
 import hashlib
+from typing import NamedTuple, Optional
 
 import bcrypt
-from fastapi import Request
+from fastapi.requests import HTTPConnection
+from PIL import Image, ImageOps
+
+from thinga import metrics
+from thinga.config import BCRYPT_ROUNDS
 
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(
+    started_at = time.perf_counter()
+    hashed_password = bcrypt.hashpw(
         password.encode("utf-8"),
-        bcrypt.gensalt(),
+        bcrypt.gensalt(rounds=BCRYPT_ROUNDS),
     ).decode("utf-8")
+    metrics.password_hash_duration.observe(
+        time.perf_counter() - started_at, "hash"
+    )
+    return hashed_password
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(
+    started_at = time.perf_counter()
+    is_valid = bcrypt.checkpw(
         plain_password.encode("utf-8"),
         hashed_password.encode("utf-8"),
     )
+    metrics.password_hash_duration.observe(
+        time.perf_counter() - started_at, "verify"
+    )
+    return is_valid
 
 
-def generate_client_fingerprint(request: Request) -> str:
+def generate_client_fingerprint(request: HTTPConnection) -> str:
     user_agent = request.headers.get("user-agent", "unknown")
     accept_language = request.headers.get("accept-language", "unknown")
     client_fingerprint = f"{user_agent}-{accept_language}"
     return hashlib.sha256(client_fingerprint.encode("utf-8")).hexdigest()
 
 
+def generate_client_key(request: HTTPConnection) -> str:
+    """Tells clients apart for rate limits, by address and fingerprint.
+
+    The fingerprint alone is shared by everyone on the same browser and
+    locale.
+    """
+    host = request.client.host if request.client else "unknown"
+    client_key = f"{host}-{generate_client_fingerprint(request)}"
+    return hashlib.sha256(client_key.encode("utf-8")).hexdigest()
+
+
 def generate_unique_file_name(file_name: str) -> str:
     unique_id = uuid.uuid4().hex[:15]
     _, file_extension = os.path.splitext(file_name)
     return f"{unique_id}{file_extension}"
+
+
+BLURHASH_CHARACTERS = (
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    "abcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+)
+# Enough detail for a placeholder, it is blurred on the client anyway
+BLURHASH_COMPONENTS = (4, 3)
+BLURHASH_SAMPLE_SIZE = 32
+# EXIF orientations that put the stored pixels on their side
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImageMetadata(NamedTuple):
+    width: Optional[int] = None
+    height: Optional[int] = None
+    blurhash: Optional[str] = None
+
+
+def _encode_base83(value: int, length: int) -> str:
+    return "".join(
+        BLURHASH_CHARACTERS[value // 83 ** (length - i) % 83]
+        for i in range(1, length + 1)
+    )
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+SRGB_TO_LINEAR = tuple(_srgb_to_linear(value) for value in range(256))
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def encode_blurhash(image: Image.Image) -> str:
+    """Encodes a small RGB image the way the BlurHash reference does."""
+    x_components, y_components = BLURHASH_COMPONENTS
+    width, height = image.size
+    data = image.tobytes()
+    pixels = [
+        (
+            SRGB_TO_LINEAR[data[k]],
+            SRGB_TO_LINEAR[data[k + 1]],
+            SRGB_TO_LINEAR[data[k + 2]],
+        )
+        for k in range(0, len(data), 3)
+    ]
+    x_cosines = [
+        [math.cos(math.pi * i * x / width) for x in range(width)]
+        for i in range(x_components)
+    ]
+    y_cosines = [
+        [math.cos(math.pi * j * y / height) for y in range(height)]
+        for j in range(y_components)
+    ]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                y_cosine = y_cosines[j][y]
+                row = pixels[y * width : (y + 1) * width]
+                for x, (pixel_r, pixel_g, pixel_b) in enumerate(row):
+                    basis = x_cosines[i][x] * y_cosine
+                    r += basis * pixel_r
+                    g += basis * pixel_g
+                    b += basis * pixel_b
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = _encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_maximum = max(abs(value) for factor in ac for value in factor)
+        quantised_maximum = int(
+            max(0, min(82, math.floor(actual_maximum * 166 - 0.5)))
+        )
+        maximum = (quantised_maximum + 1) / 166
+    else:
+        quantised_maximum, maximum = 0, 1
+    blurhash += _encode_base83(quantised_maximum, 1)
+    blurhash += _encode_base83(
+        (_linear_to_srgb(dc[0]) << 16)
+        + (_linear_to_srgb(dc[1]) << 8)
+        + _linear_to_srgb(dc[2]),
+        4,
+    )
+    for factor in ac:
+        r, g, b = (
+            int(
+                max(
+                    0,
+                    min(
+                        18,
+                        math.floor(
+                            math.copysign(abs(value / maximum) ** 0.5, value)
+                            * 9
+                            + 9.5
+                        ),
+                    ),
+                )
+            )
+            for value in factor
+        )
+        blurhash += _encode_base83(r * 19 * 19 + g * 19 + b, 2)
+    return blurhash
+
+
+def read_image_metadata(data: bytes) -> ImageMetadata:
+    """Reads the displayed size and a BlurHash of an image in one decode."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            orientation = image.getexif().get(0x0112, 1)
+            # JPEGs decode straight to a fraction of their size this way
+            image.draft("RGB", (BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+            sample = image.convert("RGB")
+            sample.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return ImageMetadata()
+
+    if orientation in ROTATED_ORIENTATIONS:
+        width, height = height, width
+    sample.getexif()[0x0112] = orientation
+    sample = ImageOps.exif_transpose(sample)
+    return ImageMetadata(width, height, encode_blurhash(sample))
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import collections
+from contextlib import AbstractContextManager
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from thinga import models, metrics
+from thinga.database import SessionLocal
+from thinga.invalidation import bus
+from thinga.config import VOTE_BATCH_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SessionFactory = Callable[[], AbstractContextManager[Session]]
+
+_add_votes = (
+    update(models.Image.__table__)
+    .where(models.Image.__table__.c.id == bindparam("image_id"))
+    .values(score=models.Image.__table__.c.score + bindparam("votes"))
+)
+
+
+def write_votes(
+    *,
+    db: Session,
+    votes: list[tuple[int, int, int]],
+) -> set[int]:
+    """Keeps `(user_id, image_id, loser_image_id)` votes, returning the live
+    images among them.
+
+    Votes for images deleted since their pair was served are dropped.
+    """
+    live_image_ids = set(
+        db.scalars(
+            select(models.Image.id).where(
+                models.Image.id.in_({image_id for _, image_id, _ in votes}),
+                models.LIVE_IMAGES,
+            )
+        )
+    )
+    counted_votes = [vote for vote in votes if vote[1] in live_image_ids]
+    if not counted_votes:
+        return live_image_ids
+
+    db.execute(
+        insert(models.Rating),
+        [
+            {
+                "user_id": user_id,
+                "image_id": image_id,
+                "loser_image_id": loser_image_id,
+            }
+            for user_id, image_id, loser_image_id in counted_votes
+        ],
+    )
+    vote_counts = collections.Counter(
+        image_id for _, image_id, _ in counted_votes
+    )
+    # Rows are updated in id order, so concurrent batches never deadlock
+    db.execute(
+        _add_votes,
+        [
+            {"image_id": image_id, "votes": vote_counts[image_id]}
+            for image_id in sorted(vote_counts)
+        ],
+    )
+    db.commit()
+    bus.publish("images")
+    return live_image_ids
+
+
+class VotesNotSaved(Exception):
+    """The batch holding a vote could not be committed."""
+
+
+class VoteBatcher:
+    """Commits the votes of every voting channel of a worker together.
+
+    Votes arriving within `wait_seconds` of the first share a transaction,
+    and each is only answered once that is committed.
+    """
+
+    def __init__(self, open_session: SessionFactory, wait_seconds: float):
+        self.open_session = open_session
+        self.wait_seconds = wait_seconds
+        self._pending = []
+        self._flush_task = None
+
+    async def add(
+        self,
+        user_id: int,
+        image_id: int,
+        loser_image_id: int,
+    ) -> bool:
+        """Whether the vote was kept, `False` if the image is gone.
+
+        Raises `VotesNotSaved` if the database failed its batch.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_id, image_id, loser_image_id, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.wait_seconds)
+        # Votes added from here on go to the next batch
+        pending, self._pending, self._flush_task = self._pending, [], None
+        votes = [
+            (user_id, image_id, loser_image_id)
+            for user_id, image_id, loser_image_id, _ in pending
+        ]
+
+        def write() -> set[int]:
+            with self.open_session() as db:
+                return write_votes(db=db, votes=votes)
+
+        try:
+            live_image_ids = await asyncio.to_thread(write)
+        except SQLAlchemyError:
+            # Only this batch is lost, the next one opens a new session
+            metrics.vote_batch_failures.inc()
+            logger.exception(
+                "Could not commit a batch of %d votes.", len(pending)
+            )
+            self._reject(pending)
+            return None
+        except BaseException:
+            # Not the database's doing, the voters still get an answer
+            self._reject(pending)
+            raise
+
+        metrics.vote_batch_size.observe(len(pending))
+        for _, image_id, _, future in pending:
+            if not future.done():  # Its channel may have closed meanwhile
+                future.set_result(image_id in live_image_ids)
+
+    @staticmethod
+    def _reject(pending: list) -> None:
+        for *_, future in pending:
+            if not future.done():
+                future.set_exception(VotesNotSaved())
+
+
+class VoteChannel:
+    """The identity a WebSocket client proved once, for all of its votes."""
+
+    def __init__(self, db_session: models.Session) -> None:
+        self.session_id = db_session.id
+        self.user_id = db_session.user_id
+        self.expires_at = db_session.expires_at.replace(tzinfo=timezone.utc)
+        # Set when the session may have been ended, by this worker or another
+        self.stale = False
+
+    def is_expired(self) -> bool:
+        return self.expires_at <= datetime.now(timezone.utc)
+
+
+# Session id -> the open channels it authenticated
+channels: dict[int, set[VoteChannel]] = {}
+
+
+def open_channel(db_session: models.Session) -> VoteChannel:
+    channel = VoteChannel(db_session)
+    channels.setdefault(channel.session_id, set()).add(channel)
+    return channel
+
+
+def close_channel(channel: VoteChannel) -> None:
+    session_channels = channels.get(channel.session_id, set())
+    session_channels.discard(channel)
+    if not session_channels:
+        channels.pop(channel.session_id, None)
+
+
+def _on_session_change(key: Optional[str]) -> None:
+    if key is None:
+        stale_channels = [
+            channel
+            for session_channels in list(channels.values())
+            for channel in session_channels
+        ]
+    else:
+        stale_channels = channels.get(int(key), ())
+    for channel in list(stale_channels):
+        channel.stale = True
+
+
+bus.subscribe("sessions", _on_session_change)
+vote_batcher = VoteBatcher(SessionLocal, VOTE_BATCH_WAIT_SECONDS)